@@ -0,0 +1,272 @@
+import os
+import time
+import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from journal import Journal, journal_path_for, replay_journal
+from mapping import is_jsonl_mapping, make_meta, write_json_mapping
+from naming import path_name
+from placement import Placer
+from progress import Metrics, ProgressReporter
+from script import (
+    _BlobRegistry,
+    _DirectorySink,
+    _flatten_file,
+    check_quarantine,
+    print_quarantine_summary,
+)
+from sniff import QuarantineList, quarantine_path_for
+from walker import make_matchers, scan_directory
+
+
+def _place(entry, relative_source_path, new_filename_with_ext, sink, meta, blobs, sniff):
+    """
+    Stats and places one file; runs in an executor thread so neither call
+    blocks the event loop.
+
+    Returns:
+        tuple: (flattened filename, seconds it took, size in bytes, sniffed type)
+    """
+    try:
+        size = entry.stat().st_size
+    except OSError:
+        size = 0
+    new_filename_with_ext, seconds, file_type = _flatten_file(
+        entry.path, relative_source_path, new_filename_with_ext, sink, meta, blobs, sniff
+    )
+    return new_filename_with_ext, seconds, size, file_type
+
+
+async def _flatten(
+    source_dir,
+    target_dir,
+    mapping_file_path,
+    concurrency,
+    dedupe,
+    strategy,
+    fanout,
+    include,
+    exclude,
+    reporter,
+    sniff,
+    salt,
+):
+    metrics = reporter.metrics
+    loop = asyncio.get_running_loop()
+    placer = Placer(strategy)
+    meta = make_meta(fanout=fanout, salt=salt)
+    if not os.path.exists(target_dir):
+        os.makedirs(target_dir)
+    sink = _DirectorySink(target_dir, placer)
+    blobs = _BlobRegistry() if dedupe else None
+    include_matcher, exclude_matcher = make_matchers(include, exclude)
+
+    journal_path = journal_path_for(mapping_file_path)
+    if os.path.exists(journal_path):
+        print(f"Warning: discarding journal of an interrupted run: {journal_path}")
+    journal = Journal(journal_path, meta=meta)
+    quarantine = QuarantineList(quarantine_path_for(mapping_file_path)) if sniff else None
+    files_recorded = 0
+    failed = []
+
+    # Every blocking call (listing, stat, open, copy, metadata) runs here; the
+    # pool size is the number of round trips in flight at once
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    # Listed files wait here for a copier; a full queue stalls the listing
+    queue = asyncio.Queue(maxsize=concurrency * 4)
+    # Directories being listed at once, so listing cannot starve the copiers
+    listing = asyncio.Semaphore(max(1, concurrency // 4))
+
+    def timed_scan(directory, prefix):
+        # Only the listing is charged to the walk phase, not the waits for a
+        # free queue slot; listings overlap, so this sums their thread time
+        started = time.perf_counter()
+        try:
+            return scan_directory(directory, prefix, include_matcher, exclude_matcher)
+        finally:
+            metrics.add_phase_time("walk", time.perf_counter() - started)
+
+    async def scan(directory, prefix):
+        try:
+            async with listing:
+                files, subdirectories = await loop.run_in_executor(
+                    executor, timed_scan, directory, prefix
+                )
+        except OSError as e:
+            failed.append((os.path.relpath(e.filename, source_dir), e))
+            metrics.count("errors")
+            reporter.message(f"Error: cannot list {e.filename}: {e.strerror}")
+            return
+        for item in files:
+            await queue.put(item)
+        await asyncio.gather(*(scan(path, sub_prefix) for path, sub_prefix in subdirectories))
+
+    async def walk():
+        await scan(source_dir, "")
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def copier():
+        # Only the event loop thread writes the journal, so no lock is needed
+        nonlocal files_recorded
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            entry, relative_source_path = item
+            if dedupe:
+                new_filename_with_ext = None
+            elif salt is not None:
+                new_filename_with_ext = path_name(relative_source_path, salt)
+            else:
+                _, file_extension = os.path.splitext(entry.name)
+                new_filename_with_ext = str(uuid.uuid4()) + file_extension
+            try:
+                new_filename_with_ext, seconds, size, file_type = await loop.run_in_executor(
+                    executor,
+                    _place,
+                    entry,
+                    relative_source_path,
+                    new_filename_with_ext,
+                    sink,
+                    meta,
+                    blobs,
+                    sniff,
+                )
+            except OSError as e:
+                failed.append((relative_source_path, e))
+                metrics.count("errors")
+                reporter.message(f"Error: {relative_source_path}: {e}")
+                continue
+            journal.append(new_filename_with_ext, relative_source_path, file_type)
+            files_recorded += 1
+            if quarantine is not None:
+                check_quarantine(
+                    quarantine, new_filename_with_ext, relative_source_path, file_type, reporter
+                )
+            reporter.file_done(relative_source_path, new_filename_with_ext, size, seconds)
+
+    copy_started = time.perf_counter()
+    tasks = [asyncio.create_task(walk())]
+    tasks += [asyncio.create_task(copier()) for _ in range(concurrency)]
+
+    def abort():
+        # The journal keeps what finished, resumable by the sync path
+        for task in tasks:
+            task.cancel()
+        executor.shutdown(cancel_futures=True)
+        journal.close()
+        if quarantine is not None:
+            quarantine.close()
+        reporter.finish()
+
+    try:
+        # A copier that dies stops draining the queue, which would block the
+        # walk on a full queue forever; fail as soon as any task raises
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        abort()
+        print(f"\nInterrupted. Run again with --resume to continue from {journal_path}")
+        raise
+    except Exception as e:
+        abort()
+        print(f"\nError: {e!r}. Run again with --resume to continue from {journal_path}")
+        raise
+    executor.shutdown()
+    metrics.add_phase_time("copy", time.perf_counter() - copy_started)
+    if quarantine is not None:
+        quarantine.close()
+
+    with metrics.phase("mapping"):
+        if is_jsonl_mapping(mapping_file_path):
+            journal.commit(mapping_file_path)
+        else:
+            journal.close()
+            write_json_mapping(
+                replay_journal(journal_path), mapping_file_path, grouped=dedupe, meta=meta
+            )
+            journal.remove()
+    reporter.finish()
+    print(f"\nFlattening complete. Mapping stored in {mapping_file_path}")
+    print(f"Total files processed: {files_recorded}")
+    if dedupe:
+        print(f"Unique blobs copied: {len(blobs)}")
+    print(f"Placement: {placer.summary() or 'none'}")
+    if quarantine is not None:
+        print_quarantine_summary(quarantine)
+    metrics.print_summary()
+    if failed:
+        print(f"Files that failed to copy: {len(failed)}")
+        for relative_source_path, e in failed:
+            print(f"  - {relative_source_path}: {e}")
+
+
+def flatten_directory_async(
+    source_dir,
+    target_dir,
+    mapping_file_path,
+    concurrency=32,
+    dedupe=False,
+    strategy="copy",
+    fanout=0,
+    include=None,
+    exclude=None,
+    reporter=None,
+    sniff=False,
+    salt=None,
+):
+    """
+    Flattens a directory like flatten_directory, driven by an asyncio event
+    loop for filesystems where every call is a network round trip (SMB, NFS).
+
+    Directories are listed concurrently while copier tasks drain a bounded
+    queue of files, so listing, stat, open, copy and metadata calls for many
+    files overlap instead of running one after another. Each blocking call
+    is offloaded to a thread pool of `concurrency` threads, which caps the
+    round trips in flight; when the copiers fall behind the full queue makes
+    the listing wait. The journal and mapping are the same as the sync
+    path's, so an interrupted run can be finished with flatten_directory
+    and resume=True.
+
+    Args:
+        source_dir (str): Path to the source directory
+        target_dir (str): Path to the target directory
+        mapping_file_path (str): Path to save the mapping (.jsonl or legacy .json)
+        concurrency (int): Maximum number of blocking calls in flight
+        dedupe (bool): Name files by content hash and skip duplicate copies
+        strategy (str): How files are placed, one of copy, hardlink, reflink,
+                        rename or auto (default: copy)
+        fanout (int): Number of fan-out directory levels (default: 0, flat)
+        include (list): Gitignore-style patterns a file must match to be flattened
+        exclude (list): Gitignore-style patterns of files and directories to
+                        skip; Thumbs.db is always skipped
+        reporter (ProgressReporter): Receives progress and metrics (default: a
+                                     throttled status line on stdout)
+        sniff (bool): Record each file's type and quarantine likely rejects
+        salt (str): Name files by the UUIDv5 of their path and this salt
+    """
+    if dedupe and salt is not None:
+        print("Error: deduplicated files are named by their content, not their path.")
+        return
+    if reporter is None:
+        reporter = ProgressReporter(Metrics(), verb="Copied")
+    asyncio.run(
+        _flatten(
+            source_dir,
+            target_dir,
+            mapping_file_path,
+            max(1, concurrency),
+            dedupe,
+            strategy,
+            fanout,
+            include,
+            exclude,
+            reporter,
+            sniff,
+            salt,
+        )
+    )
@@ -0,0 +1,438 @@
+import os
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+from mapping import iter_jsonl_lines
+
+
+# Archive member that carries the JSONL mapping, written into the last volume
+MAPPING_MEMBER = "solvaire-mapping.jsonl"
+
+# PAX header (tar) recording the original relative path of a member
+PAX_PATH_KEY = "SOLVAIRE.path"
+
+# Worst-case bytes a closing archive still appends: tar's end-of-archive
+# blocks padded to a full record, or zip's (zip64) end of central directory
+_CLOSING_BYTES = {"tar": tarfile.RECORDSIZE, "zip": 22 + 56 + 20}
+
+# Archive formats by suffix, with the tarfile write mode where applicable
+_FORMATS = (
+    (".tar.gz", "tar", "w|gz"),
+    (".tgz", "tar", "w|gz"),
+    (".tar", "tar", "w|"),
+    (".zip", "zip", None),
+)
+
+
+def _split_archive_path(archive_path):
+    """Returns (path without suffix, suffix, kind, tar write mode)."""
+    for suffix, kind, mode in _FORMATS:
+        if archive_path.endswith(suffix):
+            return archive_path[: -len(suffix)], suffix, kind, mode
+    raise ValueError(f"Unsupported archive type: {archive_path}")
+
+
+def is_archive_path(path):
+    """Returns True if the path names an archive flatten can write or restore from."""
+    return any(path.endswith(suffix) for suffix, _, _ in _FORMATS)
+
+
+def volume_path(archive_path, number):
+    """
+    Returns the path of a volume. The first volume is the archive path
+    itself; later ones get a part number, e.g. batch.part002.tar.gz.
+    """
+    if number == 1:
+        return archive_path
+    stem, suffix, _, _ = _split_archive_path(archive_path)
+    return f"{stem}.part{number:03d}{suffix}"
+
+
+def iter_volumes(archive_path):
+    """Yields the paths of all existing volumes of an archive, in order."""
+    number = 1
+    while os.path.exists(volume_path(archive_path, number)):
+        yield volume_path(archive_path, number)
+        number += 1
+
+
+class _HeadCapture:
+    """Passes reads through to a file, keeping the first head_size bytes."""
+
+    def __init__(self, f, head_size):
+        self._f = f
+        self._head_size = head_size
+        self.head = b""
+
+    def fileno(self):
+        return self._f.fileno()
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        if len(self.head) < self._head_size:
+            self.head += data[: self._head_size - len(self.head)]
+        return data
+
+
+class ArchiveSink:
+    """
+    Writes flattened files straight into a streaming tar (optionally gzipped)
+    or zip archive instead of a target directory, rolling over to a new
+    volume whenever the next file would push the current one past
+    volume_size. Members are written one at a time under a lock, so copier
+    threads can share one sink.
+
+    The cap counts member headers, padding and the archive trailer, so an
+    uncompressed volume never exceeds it. For compressed tars it is applied
+    to the uncompressed stream, an upper bound on the size on disk. A single
+    file larger than the cap still gets a volume of its own.
+    """
+
+    def __init__(self, archive_path, volume_size=None):
+        """
+        Args:
+            archive_path (str): Path of the (first) archive volume
+            volume_size (int): Maximum bytes per volume, or None for a single volume
+        """
+        _, _, self.kind, self._tar_mode = _split_archive_path(archive_path)
+        self.archive_path = archive_path
+        self.volume_size = volume_size
+        self.volumes = 0
+        self._lock = threading.Lock()
+        self._archive = None
+        # Zip central directory bytes owed by the members written so far
+        self._directory_bytes = 0
+        self._open_next_volume()
+
+    def _open_next_volume(self):
+        if self._archive is not None:
+            self._archive.close()
+        self.volumes += 1
+        path = volume_path(self.archive_path, self.volumes)
+        if self.kind == "tar":
+            self._archive = tarfile.open(path, self._tar_mode, format=tarfile.PAX_FORMAT)
+        else:
+            self._archive = zipfile.ZipFile(
+                path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True
+            )
+        self._directory_bytes = 0
+        self._members = 0
+
+    def _used_bytes(self):
+        """Bytes the current volume would occupy if it were closed now."""
+        if self.kind == "tar":
+            written = self._archive.offset
+        else:
+            written = self._archive.fp.tell() + self._directory_bytes
+        return written + _CLOSING_BYTES[self.kind]
+
+    def _member_bytes(self, size, member_name, original_path):
+        """Upper bound on the bytes one member adds to the volume."""
+        name_bytes = len(member_name.encode("utf-8"))
+        path_bytes = len((original_path or "").encode("utf-8"))
+        if self.kind == "tar":
+            # Header block, PAX header block and records, data padded to blocks
+            pax_bytes = -(-(len(PAX_PATH_KEY) + path_bytes + name_bytes + 64) // 512) * 512
+            return 2 * 512 + pax_bytes + -(-size // 512) * 512
+        # Local header with zip64 extra and data descriptor, plus the central
+        # directory entry; deflate can grow incompressible data slightly
+        local_bytes = 30 + name_bytes + 20 + 24
+        central_bytes = 46 + name_bytes + path_bytes + 28
+        return local_bytes + central_bytes + size + size // 1000 + 64
+
+    def _write_member(self, fileobj, member_name, size, mtime, mode, original_path):
+        if self.kind == "tar":
+            info = tarfile.TarInfo(member_name)
+            info.size = size
+            info.mtime = mtime
+            info.mode = mode & 0o7777
+            if original_path is not None:
+                info.pax_headers = {PAX_PATH_KEY: original_path}
+            self._archive.addfile(info, fileobj)
+        else:
+            info = zipfile.ZipInfo(member_name, date_time=_zip_date_time(mtime))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = (mode & 0xFFFF) << 16
+            if original_path is not None:
+                info.comment = original_path.encode("utf-8")
+            self._directory_bytes += 46 + 28 + len(member_name.encode("utf-8")) + len(
+                info.comment
+            )
+            with self._archive.open(info, "w", force_zip64=size >= 2**31) as member:
+                shutil.copyfileobj(fileobj, member)
+
+    def add(self, source_path, member_name, relative_source_path, head_size=0):
+        """
+        Streams one file into the archive.
+
+        Args:
+            source_path (str): Path to the original file
+            member_name (str): Name of the member (the flattened location)
+            relative_source_path (str): Original path, recorded with the member
+            head_size (int): Number of leading bytes to return, captured from
+                             the read that streams the file
+
+        Returns:
+            bytes: The file's first head_size bytes, or None if none were asked for
+        """
+        with open(source_path, "rb") as source:
+            f = _HeadCapture(source, head_size) if head_size else source
+            stat = os.fstat(f.fileno())
+            with self._lock:
+                # Roll over before the volume would exceed its cap
+                if (
+                    self.volume_size
+                    and self._members
+                    and self._used_bytes()
+                    + self._member_bytes(stat.st_size, member_name, relative_source_path)
+                    > self.volume_size
+                ):
+                    self._open_next_volume()
+                self._write_member(
+                    f,
+                    member_name,
+                    stat.st_size,
+                    stat.st_mtime,
+                    stat.st_mode,
+                    relative_source_path,
+                )
+                self._members += 1
+        return f.head if head_size else None
+
+    def close(self, mapping_path=None):
+        """
+        Embeds the mapping into the last volume and closes the archive.
+
+        Args:
+            mapping_path (str): JSONL mapping (or journal) to embed as MAPPING_MEMBER
+        """
+        with self._lock:
+            if mapping_path is not None:
+                with open(mapping_path, "rb") as f:
+                    stat = os.fstat(f.fileno())
+                    if (
+                        self.volume_size
+                        and self._members
+                        and self._used_bytes()
+                        + self._member_bytes(stat.st_size, MAPPING_MEMBER, None)
+                        > self.volume_size
+                    ):
+                        self._open_next_volume()
+                    self._write_member(
+                        f, MAPPING_MEMBER, stat.st_size, stat.st_mtime, 0o644, None
+                    )
+            self._archive.close()
+
+
+def _zip_date_time(mtime):
+    """Converts a timestamp to a zip date_time tuple (zip cannot store pre-1980)."""
+    return max(time.localtime(mtime)[:6], (1980, 1, 1, 0, 0, 0))
+
+
+class _DirectoryCache:
+    """
+    Creates restore directories once each, on first use, and keeps every
+    restored path inside the output directory.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self._root = os.path.realpath(output_dir)
+        self._created = set()
+
+    def target_for(self, original_path):
+        """
+        Returns where an original path is restored, or None if it would land
+        outside the output directory (absolute, "..", or through a symlink),
+        as tarfile's data filter rejects such members.
+        """
+        if not original_path or os.path.isabs(original_path) or original_path[0] in "/\\":
+            return None
+        if ".." in original_path.replace("\\", "/").split("/"):
+            return None
+        target_file = os.path.join(self.output_dir, original_path)
+        directory = os.path.dirname(target_file)
+        if directory not in self._created:
+            # Resolved before creating anything, as a symlink could lead out
+            real_directory = os.path.realpath(directory)
+            if os.path.commonpath([self._root, real_directory]) != self._root:
+                return None
+            os.makedirs(directory, exist_ok=True)
+            self._created.add(directory)
+        if os.path.islink(target_file):
+            return None
+        return target_file
+
+
+class _FirstRestores:
+    """
+    Where each flattened name was first restored, for fanning duplicates out
+    from it. Kept in a temporary SQLite file rather than a dict, so a restore
+    runs in constant memory however many members the archive has.
+    """
+
+    def __init__(self):
+        fd, self._path = tempfile.mkstemp(prefix="solvaire-restore-", suffix=".sqlite")
+        os.close(fd)
+        self._connection = sqlite3.connect(self._path)
+        # Scratch data: nothing to protect against crashes
+        self._connection.execute("PRAGMA journal_mode = OFF")
+        self._connection.execute("PRAGMA synchronous = OFF")
+        self._connection.execute("CREATE TABLE first (name TEXT PRIMARY KEY, path TEXT NOT NULL)")
+
+    def add(self, name, original_path):
+        self._connection.execute("INSERT OR IGNORE INTO first VALUES (?, ?)", (name, original_path))
+
+    def get(self, name):
+        row = self._connection.execute("SELECT path FROM first WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self._connection.close()
+        os.remove(self._path)
+
+
+def _write_restored(fileobj, target_file, mtime, mode):
+    """Writes one member to its restored location and applies its metadata."""
+    with open(target_file, "wb") as f:
+        shutil.copyfileobj(fileobj, f)
+    os.chmod(target_file, mode & 0o7777)
+    os.utime(target_file, (mtime, mtime))
+
+
+def _fan_out(mapping_file, directories, first_restores, on_restored):
+    """
+    Streams the embedded mapping and copies blobs shared by several paths
+    from the copy already restored to their remaining paths.
+
+    Returns:
+        int: Number of files restored
+    """
+    restored = 0
+    # Decoded by hand: a tar stream member cannot be wrapped in TextIOWrapper
+    lines = (line.decode("utf-8") for line in mapping_file)
+    for name, original_path in iter_jsonl_lines(lines):
+        first_path = first_restores.get(name)
+        if first_path is None or first_path == original_path:
+            continue
+        start = time.perf_counter()
+        target_file = directories.target_for(original_path)
+        if target_file is None:
+            print(f"Warning: skipping {original_path}: outside the output directory")
+            continue
+        shutil.copy2(os.path.join(directories.output_dir, first_path), target_file)
+        restored += 1
+        if on_restored:
+            on_restored(
+                name,
+                original_path,
+                os.path.getsize(target_file),
+                time.perf_counter() - start,
+            )
+    return restored
+
+
+def restore_archive(archive_path, output_dir, on_restored=None):
+    """
+    Restores the original tree directly from a flatten archive without
+    extracting it to a temporary directory first.
+
+    Tar volumes are read as a stream: each member is written straight to the
+    original path recorded in its PAX header. The embedded mapping at the end
+    is then streamed to fan content-addressed blobs out to their remaining
+    paths by copying the file that was already restored. Zip members carry
+    their original path in the member comment and are handled the same way.
+    Paths that would land outside output_dir are skipped with a warning.
+
+    Args:
+        archive_path (str): Path of the first archive volume
+        output_dir (str): Path to the output directory
+        on_restored (callable): Called with (flattened filename, original path,
+                                size, seconds) after each file is restored
+
+    Returns:
+        int: Number of files restored
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    directories = _DirectoryCache(output_dir)
+    first_restores = _FirstRestores()
+    restored = 0
+    has_mapping = False
+    _, _, kind, _ = _split_archive_path(archive_path)
+
+    def restore_member(fileobj, name, original_path, size, mtime, mode):
+        start = time.perf_counter()
+        target_file = directories.target_for(original_path)
+        if target_file is None:
+            print(f"Warning: skipping {original_path}: outside the output directory")
+            return 0
+        _write_restored(fileobj, target_file, mtime, mode)
+        first_restores.add(name, original_path)
+        if on_restored:
+            on_restored(name, original_path, size, time.perf_counter() - start)
+        return 1
+
+    try:
+        for path in iter_volumes(archive_path):
+            if kind == "tar":
+                with tarfile.open(path, "r|*") as archive:
+                    for member in archive:
+                        if not member.isfile():
+                            continue
+                        if member.name == MAPPING_MEMBER:
+                            # Written last, after every member it fans out
+                            has_mapping = True
+                            restored += _fan_out(
+                                archive.extractfile(member),
+                                directories,
+                                first_restores,
+                                on_restored,
+                            )
+                            continue
+                        original_path = member.pax_headers.get(PAX_PATH_KEY)
+                        if original_path is None:
+                            continue
+                        restored += restore_member(
+                            archive.extractfile(member),
+                            os.path.basename(member.name),
+                            original_path,
+                            member.size,
+                            member.mtime,
+                            member.mode,
+                        )
+            else:
+                with zipfile.ZipFile(path) as archive:
+                    for info in archive.infolist():
+                        if info.filename == MAPPING_MEMBER or not info.comment:
+                            continue
+                        with archive.open(info) as member:
+                            restored += restore_member(
+                                member,
+                                os.path.basename(info.filename),
+                                info.comment.decode("utf-8"),
+                                info.file_size,
+                                _zip_mtime(info),
+                                (info.external_attr >> 16) or 0o644,
+                            )
+                    if MAPPING_MEMBER in archive.namelist():
+                        has_mapping = True
+                        with archive.open(MAPPING_MEMBER) as mapping_file:
+                            restored += _fan_out(
+                                mapping_file, directories, first_restores, on_restored
+                            )
+    finally:
+        first_restores.close()
+
+    if not has_mapping:
+        print("Warning: archive has no embedded mapping; duplicates were not fanned out")
+    return restored
+
+
+def _zip_mtime(info):
+    """Converts a zip member's date_time back to a timestamp."""
+    return time.mktime(info.date_time + (0, 0, -1))
@@ -0,0 +1,87 @@
+# Name of the directory (and mapping shard suffix) of each sub-batch
+BATCH_NAME_FORMAT = "batch-{:04d}"
+
+# Batches that still take files; beyond this the oldest (fullest) one is
+# closed, so placing a file never scans more than this many batches
+MAX_OPEN_BATCHES = 64
+
+
+def batch_name(number):
+    """Returns the name of a sub-batch, numbered from 1."""
+    return BATCH_NAME_FORMAT.format(number)
+
+
+class BatchPacker:
+    """
+    Packs files into sub-batches bounded by total bytes and file count as
+    they are walked, with the first-fit heuristic: a file goes into the
+    first batch it still fits in, and a new batch is only opened when none
+    has room. Because it never looks ahead it needs no second pass over the
+    tree, and it stays within 1.7 times the optimal number of batches;
+    small files fill the gaps large ones leave behind.
+
+    A file larger than the byte limit cannot fit anywhere and gets a batch
+    of its own. At most MAX_OPEN_BATCHES batches are considered for a file.
+    """
+
+    def __init__(self, max_bytes=None, max_files=None):
+        """
+        Args:
+            max_bytes (int): Maximum total size of a batch (default: no limit)
+            max_files (int): Maximum number of files in a batch (default: no limit)
+        """
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        # [files, bytes] per batch, in batch order
+        self.batches = []
+        # Indexes of batches that may still take a file, in batch order
+        self._open = []
+
+    def _fits(self, batch, size):
+        files, used = batch
+        if self.max_files is not None and files >= self.max_files:
+            return False
+        return self.max_bytes is None or used + size <= self.max_bytes
+
+    def _is_full(self, batch):
+        files, used = batch
+        if self.max_files is not None and files >= self.max_files:
+            return True
+        return self.max_bytes is not None and used >= self.max_bytes
+
+    def add(self, size):
+        """
+        Assigns a file to a batch.
+
+        Args:
+            size (int): Size of the file in bytes
+
+        Returns:
+            int: Number of the batch, from 1; one past the last batch means a
+                 new batch was opened
+        """
+        for position, index in enumerate(self._open):
+            batch = self.batches[index]
+            if self._fits(batch, size):
+                batch[0] += 1
+                batch[1] += size
+                if self._is_full(batch):
+                    del self._open[position]
+                return index + 1
+        return self.restore(1, size)
+
+    def restore(self, files, size):
+        """
+        Appends a batch that already holds files, e.g. from the journal of
+        an interrupted run.
+
+        Returns:
+            int: Number of the batch
+        """
+        batch = [files, size]
+        self.batches.append(batch)
+        if not self._is_full(batch):
+            self._open.append(len(self.batches) - 1)
+            if len(self._open) > MAX_OPEN_BATCHES:
+                del self._open[0]
+        return len(self.batches)
@@ -0,0 +1,378 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+from contextlib import redirect_stdout
+
+from placement import STRATEGIES
+from progress import Metrics, ProgressReporter, format_bytes
+from script import flatten_directory, unflatten_directory
+from stub_server import start_stub_server
+from upload import upload_files
+
+
+# Synthetic tree shapes: directory depth and fan-out, number of files and the
+# range file sizes are drawn from (log-uniformly, so small files dominate)
+PROFILES = {
+    "tiny": {"depth": 3, "fanout": 8, "files": 20000, "min_size": 0, "max_size": 4 * 1024},
+    "mixed": {
+        "depth": 4,
+        "fanout": 4,
+        "files": 5000,
+        "min_size": 1024,
+        "max_size": 4 * 1024 * 1024,
+    },
+    "huge": {
+        "depth": 1,
+        "fanout": 2,
+        "files": 8,
+        "min_size": 64 * 1024 * 1024,
+        "max_size": 256 * 1024 * 1024,
+    },
+}
+
+# Extensions handed out to generated files
+EXTENSIONS = (".pdf", ".docx", ".txt", ".jpg", ".bin")
+
+# Random data generated files are cut from; each file gets a unique prefix so
+# content-addressed runs still see distinct blobs
+_BLOCK_SIZE = 1024 * 1024
+
+
+def _draw_size(rng, min_size, max_size):
+    """Draws a file size log-uniformly from [min_size, max_size]."""
+    if max_size <= min_size:
+        return min_size
+    low = max(min_size, 1)
+    size = int(round(2 ** rng.uniform(low.bit_length() - 1, max_size.bit_length())))
+    return max(min_size, min(size, max_size))
+
+
+def generate_tree(root, depth, fanout, files, min_size, max_size, seed=0):
+    """
+    Writes a reproducible synthetic source tree: the same arguments and seed
+    always produce the same directories, names and contents.
+
+    Args:
+        root (str): Directory to create the tree in (must not exist)
+        depth (int): Levels of subdirectories below root
+        fanout (int): Subdirectories per directory
+        files (int): Number of files, spread uniformly over all directories
+        min_size (int): Smallest file size in bytes
+        max_size (int): Largest file size in bytes
+        seed (int): Random seed
+
+    Returns:
+        int: Total bytes written
+    """
+    rng = random.Random(seed)
+    block = rng.randbytes(_BLOCK_SIZE)
+    directories = [""]
+    level = [""]
+    for _ in range(depth):
+        level = [
+            os.path.join(parent, f"d{index:02d}") for parent in level for index in range(fanout)
+        ]
+        directories.extend(level)
+    os.makedirs(root)
+    for directory in directories[1:]:
+        os.mkdir(os.path.join(root, directory))
+
+    total_bytes = 0
+    for index in range(files):
+        directory = rng.choice(directories)
+        name = f"f{index:06d}{rng.choice(EXTENSIONS)}"
+        size = _draw_size(rng, min_size, max_size)
+        offset = rng.randrange(_BLOCK_SIZE)
+        with open(os.path.join(root, directory, name), "wb") as f:
+            # Unique prefix first, then the shared block from a random offset
+            remaining = size
+            prefix = f"{index}\n".encode()[:remaining]
+            f.write(prefix)
+            remaining -= len(prefix)
+            while remaining > 0:
+                chunk = block[offset : offset + remaining]
+                f.write(chunk)
+                remaining -= len(chunk)
+                offset = 0
+        total_bytes += size
+    return total_bytes
+
+
+def _timed(function, *args, **kwargs):
+    """
+    Runs flatten_directory, unflatten_directory or upload_files quietly.
+
+    Returns:
+        tuple: (wall seconds, Metrics collected during the run)
+    """
+    metrics = Metrics()
+    reporter = ProgressReporter(metrics, stream=io.StringIO())
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        function(*args, reporter=reporter, **kwargs)
+    return time.perf_counter() - start, metrics
+
+
+def _result(profile, operation, strategy, workers, seconds, metrics):
+    return {
+        "profile": profile,
+        "operation": operation,
+        "strategy": strategy,
+        "workers": workers,
+        "seconds": seconds,
+        "files": metrics.files,
+        "bytes": metrics.bytes,
+        "files_per_second": metrics.files / seconds if seconds else 0.0,
+        "bytes_per_second": metrics.bytes / seconds if seconds else 0.0,
+        "errors": metrics.counters.get("errors", 0),
+        "phases": dict(metrics.phases),
+        "latency_p95_seconds": metrics.percentile(0.95),
+    }
+
+
+def run_benchmarks(
+    profiles, strategies, worker_counts, repeat=1, seed=0, work_dir=None, upload=False
+):
+    """
+    Times flatten and unflatten for every profile, strategy and worker count.
+
+    Each profile's tree is generated once and reused. Every run flattens into
+    a fresh directory and then restores that output, so both operations see
+    the same files. The rename strategy consumes its input, so the source
+    tree is regenerated after a rename run. With upload every flatten
+    output is also uploaded to a local stub server (see stub_server.py),
+    which times the upload stage over loopback without the network.
+
+    Args:
+        profiles (dict): Profile name -> generate_tree keyword arguments
+        strategies (list): Placement strategies to time
+        worker_counts (list): Worker counts to time
+        repeat (int): Runs per combination; the median is reported
+        seed (int): Seed for tree generation
+        work_dir (str): Scratch directory (default: a new temporary directory)
+        upload (bool): Also time uploading each flatten output
+
+    Returns:
+        list: One result dict per profile, operation, strategy and worker count
+    """
+    results = []
+    scratch = tempfile.mkdtemp(prefix="solvaire-bench-", dir=work_dir)
+    operations = ["flatten", "upload", "unflatten"] if upload else ["flatten", "unflatten"]
+    # Accepts every generated file, so only the transfer is timed
+    server = start_stub_server(rejected_extensions=()) if upload else None
+    try:
+        for profile_name, shape in profiles.items():
+            source_dir = os.path.join(scratch, profile_name, "source")
+            total_bytes = generate_tree(source_dir, seed=seed, **shape)
+            print(
+                f"Profile {profile_name}: {shape['files']} files, "
+                f"{format_bytes(total_bytes)}"
+            )
+            for strategy in strategies:
+                for workers in worker_counts:
+                    runs = {operation: [] for operation in operations}
+                    for _ in range(repeat):
+                        run_dir = os.path.join(scratch, profile_name, "run")
+                        flat_dir = os.path.join(run_dir, "flat")
+                        mapping = os.path.join(run_dir, "mapping.jsonl")
+                        os.makedirs(flat_dir)
+                        runs["flatten"].append(
+                            _timed(
+                                flatten_directory,
+                                source_dir,
+                                flat_dir,
+                                mapping,
+                                workers=workers,
+                                strategy=strategy,
+                            )
+                        )
+                        if upload:
+                            runs["upload"].append(
+                                _timed(upload_files, flat_dir, server.url, workers=workers)
+                            )
+                        runs["unflatten"].append(
+                            _timed(
+                                unflatten_directory,
+                                flat_dir,
+                                os.path.join(run_dir, "output"),
+                                mapping,
+                                strategy=strategy,
+                                workers=workers,
+                            )
+                        )
+                        shutil.rmtree(run_dir)
+                        if strategy == "rename":
+                            shutil.rmtree(source_dir)
+                            generate_tree(source_dir, seed=seed, **shape)
+                    for operation, timings in runs.items():
+                        seconds, metrics = sorted(timings, key=lambda run: run[0])[
+                            len(timings) // 2
+                        ]
+                        result = _result(
+                            profile_name, operation, strategy, workers, seconds, metrics
+                        )
+                        result["runs"] = [run[0] for run in timings]
+                        results.append(result)
+                        note = f", {result['errors']} errors" if result["errors"] else ""
+                        print(
+                            f"  {operation:<9} {strategy:<8} workers={workers:<3} "
+                            f"{seconds:8.3f}s  {result['files_per_second']:10.1f} files/s  "
+                            f"{format_bytes(result['bytes_per_second'])}/s{note}"
+                        )
+            shutil.rmtree(os.path.join(scratch, profile_name))
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+
+def _result_key(result):
+    return (result["profile"], result["operation"], result["strategy"], result["workers"])
+
+
+def compare_results(results, baseline, threshold=0.10):
+    """
+    Prints how each result changed against a baseline results file and flags
+    those that slowed down by more than the threshold.
+
+    Args:
+        results (list): Results from run_benchmarks
+        baseline (list): Results loaded from an earlier run
+        threshold (float): Relative slowdown reported as a regression
+
+    Returns:
+        int: Number of regressions
+    """
+    previous = {_result_key(result): result for result in baseline}
+    regressions = 0
+    compared = 0
+    print("\nComparison with baseline:")
+    for result in results:
+        old = previous.get(_result_key(result))
+        if old is None or not old["seconds"]:
+            continue
+        compared += 1
+        change = result["seconds"] / old["seconds"] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        profile, operation, strategy, workers = _result_key(result)
+        print(
+            f"  {profile:<6} {operation:<9} {strategy:<8} workers={workers:<3} "
+            f"{old['seconds']:8.3f}s -> {result['seconds']:8.3f}s ({change:+.1%}){flag}"
+        )
+    if not compared:
+        print("  No matching profile/strategy/worker combinations in the baseline")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark flatten and unflatten over synthetic directory trees"
+    )
+    parser.add_argument(
+        "-p",
+        "--profile",
+        action="append",
+        choices=sorted(PROFILES),
+        help="Tree profile to benchmark; repeat for several (default: tiny and mixed)",
+    )
+    parser.add_argument(
+        "--strategy",
+        action="append",
+        choices=STRATEGIES,
+        help="Placement strategy to time; repeat for several (default: all)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        action="append",
+        help="Worker count to time; repeat for several (default: 1 and 8)",
+    )
+    parser.add_argument("--files", type=int, help="Override the profile's file count")
+    parser.add_argument("--depth", type=int, help="Override the profile's directory depth")
+    parser.add_argument("--fanout", type=int, help="Override the profile's directory fan-out")
+    parser.add_argument("--min-size", type=int, help="Override the smallest file size (bytes)")
+    parser.add_argument("--max-size", type=int, help="Override the largest file size (bytes)")
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=1, help="Runs per combination (default: 1)"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Tree generation seed (default: 0)")
+    parser.add_argument(
+        "--work-dir",
+        help="Where to create the scratch trees (default: the system temp directory); "
+        "strategies like reflink depend on its filesystem",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="bench-results.json",
+        help="JSON results file (default: bench-results.json)",
+    )
+    parser.add_argument(
+        "--upload",
+        action="store_true",
+        help="Also time uploading each flatten output to a local stub server",
+    )
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="Relative slowdown reported as a regression (default: 0.10)",
+    )
+
+    args = parser.parse_args()
+
+    profiles = {}
+    for name in args.profile or ["tiny", "mixed"]:
+        shape = dict(PROFILES[name])
+        for key in ("files", "depth", "fanout", "min_size", "max_size"):
+            if getattr(args, key) is not None:
+                shape[key] = getattr(args, key)
+        profiles[name] = shape
+
+    results = run_benchmarks(
+        profiles,
+        args.strategy or list(STRATEGIES),
+        args.workers or [1, 8],
+        repeat=max(1, args.repeat),
+        seed=args.seed,
+        work_dir=args.work_dir,
+        upload=args.upload,
+    )
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "profiles": profiles,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        for name, shape in profiles.items():
+            if name in baseline["profiles"] and baseline["profiles"][name] != shape:
+                print(f"Warning: profile {name} differs from the baseline's; timings are not comparable")
+        if compare_results(results, baseline["results"], args.threshold):
+            sys.exit(1)
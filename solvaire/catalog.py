@@ -0,0 +1,300 @@
+import os
+import sys
+import math
+import mmap
+import struct
+import hashlib
+
+from index import NameResolver, mapping_fingerprint, open_index
+from mapping import iter_mapping, read_manifest
+from sniff import QUARANTINE_SUFFIX
+from upload import UPLOAD_ERRORS_SUFFIX
+
+
+# Suffix of the membership filter built next to each mapping file
+BLOOM_SUFFIX = ".bloom"
+
+# Identifies filter files (and their layout version)
+BLOOM_MAGIC = b"SOLVBLM1"
+
+# Target false positive rate: how often a lookup visits a batch in vain
+BLOOM_ERROR_RATE = 0.01
+
+# Mapping files picked up when a catalog is a directory
+MAPPING_SUFFIXES = (".json", ".jsonl")
+
+# Line-delimited files written next to mappings that are not mappings
+SIDECAR_SUFFIXES = (QUARANTINE_SUFFIX, UPLOAD_ERRORS_SUFFIX)
+
+# magic, number of hash functions, number of bits, fingerprint length
+_HEADER = struct.Struct("<8sBQH")
+
+
+def bloom_path_for(mapping_file_path):
+    """Returns the path of the filter belonging to a mapping file."""
+    return mapping_file_path + BLOOM_SUFFIX
+
+
+def key_hash(key):
+    """
+    Hashes a key once for probing any number of filters: bit positions are
+    derived from the two halves of one 128-bit digest (double hashing).
+    """
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+def _probes(hashed, hashes, bits):
+    """Bit positions of a hashed key in a filter of the given shape."""
+    first, second = hashed
+    return [(first + i * second) % bits for i in range(hashes)]
+
+
+def _stem(name):
+    """A flattened filename without its extension, as logs sometimes quote it."""
+    return name.split(".", 1)[0]
+
+
+def _encode_filter(fingerprint, count, names):
+    """Sizes a filter for count names, adds each name and its stem, and serializes it."""
+    # Room for every name and its stem
+    keys = max(1, count * 2)
+    bits = max(64, int(-keys * math.log(BLOOM_ERROR_RATE) / math.log(2) ** 2))
+    hashes = max(1, round(bits / keys * math.log(2)))
+    filter_bits = bytearray((bits + 7) // 8)
+    for name in names:
+        for key in (name, _stem(name)):
+            for position in _probes(key_hash(key), hashes, bits):
+                filter_bits[position >> 3] |= 1 << (position & 7)
+    encoded_fingerprint = fingerprint.encode("ascii")
+    header = _HEADER.pack(BLOOM_MAGIC, hashes, bits, len(encoded_fingerprint))
+    return header + encoded_fingerprint + bytes(filter_bits)
+
+
+def build_filter(mapping_file_path):
+    """
+    Builds the Bloom filter of a mapping's flattened names (with and without
+    extension) from its index, so the mapping itself is not parsed again.
+    A mapping that cannot be indexed (e.g. in a read-only batch directory)
+    is streamed twice instead: once to size the filter, once to fill it.
+
+    Returns:
+        bytes: The filter, as saved by write_filter
+    """
+    index = open_index(mapping_file_path)
+    if index is not None:
+        with index:
+            return _encode_filter(index.fingerprint(), index.count_names(), index.names())
+    fingerprint = mapping_fingerprint(mapping_file_path)
+    # Counts every path of a dedupe blob, which only makes the filter roomier
+    count = sum(1 for _ in iter_mapping(mapping_file_path))
+    return _encode_filter(fingerprint, count, (name for name, _ in iter_mapping(mapping_file_path)))
+
+
+def write_filter(mapping_file_path, contents):
+    """Saves a filter built by build_filter next to its mapping, atomically."""
+    filter_path = bloom_path_for(mapping_file_path)
+    temp_filter_path = f"{filter_path}.{os.getpid()}.tmp"
+    with open(temp_filter_path, "wb") as f:
+        f.write(contents)
+    os.replace(temp_filter_path, filter_path)
+
+
+class BloomFilter:
+    """
+    A mapping's membership filter, memory-mapped so a probe only touches the
+    few pages holding its bits rather than reading the whole filter.
+    """
+
+    def __init__(self, filter_path, contents=None):
+        """
+        Args:
+            filter_path (str): Filter file to map
+            contents (bytes): A filter built in memory (see build_filter) to
+                              use instead of the file, when it could not be saved
+        """
+        if contents is None:
+            with open(filter_path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._map = contents
+        try:
+            magic, self.hashes, self.bits, fingerprint_length = _HEADER.unpack_from(self._map)
+            if magic != BLOOM_MAGIC:
+                raise ValueError(f"Not a filter file: {filter_path}")
+        except (ValueError, struct.error):
+            self.close()
+            raise
+        self._offset = _HEADER.size + fingerprint_length
+        self.fingerprint = self._map[_HEADER.size : self._offset].decode("ascii")
+
+    def __contains__(self, key):
+        return self.contains_hash(key_hash(key))
+
+    def contains_hash(self, hashed):
+        """Membership test for a key already hashed with key_hash."""
+        for position in _probes(hashed, self.hashes, self.bits):
+            if not self._map[self._offset + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+
+def load_catalog(catalog_path):
+    """
+    Lists the mapping files of a catalog: a directory (every .json and
+    .jsonl file in it, except quarantine lists and upload error logs
+    kept next to the mappings), the manifest of a flatten split into sub-batches
+    (its shards), or a text file with one mapping path per line, relative
+    to the catalog file, with "#" comments.
+
+    Returns:
+        list: Absolute mapping file paths
+    """
+    if os.path.isdir(catalog_path):
+        mapping_paths = [
+            os.path.join(catalog_path, name)
+            for name in sorted(os.listdir(catalog_path))
+            if name.endswith(MAPPING_SUFFIXES) and not name.endswith(SIDECAR_SUFFIXES)
+        ]
+        # A manifest's shards are in the directory themselves
+        return [path for path in mapping_paths if read_manifest(path) is None]
+    manifest = read_manifest(catalog_path)
+    if manifest is not None:
+        return [shard["mapping"] for shard in manifest["shards"]]
+    base = os.path.dirname(os.path.abspath(catalog_path))
+    with open(catalog_path, "r") as f:
+        return [
+            os.path.join(base, line.strip())
+            for line in f
+            if line.strip() and not line.strip().startswith("#")
+        ]
+
+
+class Catalog:
+    """
+    Resolves flattened filenames across many mapping files (batches).
+
+    Every batch has a Bloom filter of its names next to its mapping, built
+    on first use and rebuilt when the mapping changes. A lookup probes the
+    filters and only opens the index of a batch whose filter may hold the
+    name, so with a 1% false positive rate a query over 50 batches almost
+    always touches a single index. Offers the same resolve/resolve_stem/close
+    interface as NameResolver.
+    """
+
+    def __init__(self, catalog_path):
+        self.mapping_paths = load_catalog(catalog_path)
+        # Every batch is looked up through its compiled index and saved filter
+        self.indexed = True
+        self._filters = []
+        # Indexes opened so far, by mapping path
+        self._resolvers = {}
+        for mapping_file_path in self.mapping_paths:
+            if not os.path.exists(mapping_file_path):
+                print(
+                    f"Warning: catalog entry {mapping_file_path} does not exist",
+                    file=sys.stderr,
+                )
+                continue
+            self._filters.append((mapping_file_path, self._open_filter(mapping_file_path)))
+
+    def _open_filter(self, mapping_file_path):
+        filter_path = bloom_path_for(mapping_file_path)
+        if os.path.exists(filter_path):
+            try:
+                bloom = BloomFilter(filter_path)
+                if bloom.fingerprint == mapping_fingerprint(mapping_file_path):
+                    return bloom
+                bloom.close()
+            except (ValueError, struct.error):
+                # Corrupt or foreign file; rebuild it
+                pass
+        print(f"Building filter {filter_path}...", file=sys.stderr)
+        contents = build_filter(mapping_file_path)
+        try:
+            write_filter(mapping_file_path, contents)
+        except OSError as e:
+            print(
+                f"Warning: cannot save filter {filter_path}, keeping it in memory: {e}",
+                file=sys.stderr,
+            )
+            # Anyone else opening the catalog would have to stream this batch again
+            self.indexed = False
+            return BloomFilter(filter_path, contents)
+        return BloomFilter(filter_path)
+
+    def _resolver(self, mapping_file_path):
+        resolver = self._resolvers.get(mapping_file_path)
+        if resolver is None:
+            resolver = NameResolver(mapping_file_path)
+            self._resolvers[mapping_file_path] = resolver
+        return resolver
+
+    def locate(self, name):
+        """
+        Finds the batch holding a flattened filename.
+
+        Returns:
+            tuple: (mapping file path, original path(s)), or None
+        """
+        hashed = key_hash(name)
+        for mapping_file_path, bloom in self._filters:
+            if bloom.contains_hash(hashed):
+                original_paths = self._resolver(mapping_file_path).resolve(name)
+                if original_paths is not None:
+                    return mapping_file_path, original_paths
+        return None
+
+    def resolve(self, name):
+        """Returns the original path(s) of a name, or None if no batch maps it."""
+        found = self.locate(name)
+        return found[1] if found else None
+
+    def resolve_stem(self, stem):
+        """Like NameResolver.resolve_stem, across all batches."""
+        hashed = key_hash(stem)
+        for mapping_file_path, bloom in self._filters:
+            if bloom.contains_hash(hashed):
+                found = self._resolver(mapping_file_path).resolve_stem(stem)
+                if found is not None:
+                    return found
+        return None
+
+    def find_paths(self, query, match="auto"):
+        """
+        Reverse lookup in every batch (see index.find_paths).
+
+        Yields:
+            tuple: (mapping file path, flattened filename, original path)
+        """
+        for mapping_file_path, _ in self._filters:
+            yield from self._resolver(mapping_file_path).find_paths(query, match)
+
+    def close(self):
+        for _, bloom in self._filters:
+            bloom.close()
+        for resolver in self._resolvers.values():
+            resolver.close()
+
+
+def open_resolver(mapping_file_path=None, catalog_path=None, use_index=True, daemon_socket=None):
+    """
+    Returns a client of the lookup daemon when a socket is given, else a
+    Catalog when a catalog (or the manifest of a split flatten) is given,
+    else a NameResolver for one mapping.
+    """
+    if daemon_socket is not None:
+        # Imported here as the daemon module itself builds on this one
+        from lookupd import DaemonResolver
+
+        return DaemonResolver(daemon_socket)
+    if catalog_path is not None:
+        return Catalog(catalog_path)
+    if read_manifest(mapping_file_path) is not None:
+        # Each shard is a batch of its own
+        return Catalog(mapping_file_path)
+    return NameResolver(mapping_file_path, use_index=use_index)
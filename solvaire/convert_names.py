@@ -1,131 +1,303 @@
 import os
-import json
+import sys
 import argparse
 
+from catalog import load_catalog, open_resolver
+from errorlog import rewrite_logs
+from index import MATCH_MODES, find_paths, open_index
+from lookupd import default_socket_path
+from mapping import read_manifest, read_mapping_meta
+from naming import name_matches_path, naming_salt
 
-def convert_uuid_to_original_names(uuid_list_file, mapping_file_path, output_file=None):
+
+def _format_paths(original_paths):
+    """
+    Formats a mapping value for display. Content-addressed (dedupe) mappings
+    store a list of original paths per blob instead of a single path.
+    """
+    if isinstance(original_paths, list):
+        return ", ".join(original_paths)
+    return original_paths
+
+
+def _clean_name(text):
+    """
+    Extracts a flattened filename from a list entry or error line fragment.
+    Fan-out directory prefixes (ab/cd/...) are dropped because the mapping
+    is keyed by the bare flattened name.
+    """
+    return os.path.basename(text.strip().lstrip("-").strip())
+
+
+def convert_paths_to_names(
+    queries,
+    mapping_file_path,
+    match="auto",
+    names_only=False,
+    use_index=True,
+    catalog_path=None,
+    daemon_socket=None,
+):
+    """
+    Prints the flattened files stored for original paths, prefixes or globs,
+    e.g. to re-upload a whole subtree. Results are written as they are found;
+    the summary goes to stderr.
+
+    Args:
+        queries (list): Paths, prefixes or globs (see find_paths)
+        mapping_file_path (str): Path to the mapping file
+        match (str): One of MATCH_MODES
+        names_only (bool): Print just the flattened filenames, one per line
+        use_index (bool): Query the compiled index (default: True)
+        catalog_path (str): Search every batch of this catalog instead of a
+                            single mapping; results name their batch
+        daemon_socket (str): Ask the lookup daemon on this socket instead
+    """
+    if daemon_socket is not None:
+        if not os.path.exists(daemon_socket):
+            print(f"Error: No lookup daemon listening on {daemon_socket}.")
+            return
+        resolver = open_resolver(daemon_socket=daemon_socket)
+        try:
+            for query in queries:
+                matches = 0
+                for batch_path, name, original_path in resolver.find_paths(query, match):
+                    matches += 1
+                    if names_only:
+                        print(name)
+                    elif batch_path is not None:
+                        print(f"{original_path} -> {name} [{os.path.basename(batch_path)}]")
+                    else:
+                        print(f"{original_path} -> {name}")
+                print(f"{query}: {matches} files", file=sys.stderr)
+        finally:
+            resolver.close()
+        return
+    if catalog_path is not None:
+        mapping_paths = [path for path in load_catalog(catalog_path) if os.path.exists(path)]
+    elif not os.path.exists(mapping_file_path):
+        print(f"Error: Mapping file {mapping_file_path} does not exist.")
+        return
+    else:
+        mapping_paths = [mapping_file_path]
+
+    for query in queries:
+        matches = 0
+        for batch_path in mapping_paths:
+            for name, original_path in find_paths(query, batch_path, match, use_index):
+                matches += 1
+                if names_only:
+                    print(name)
+                elif catalog_path is not None:
+                    print(f"{original_path} -> {name} [{os.path.basename(batch_path)}]")
+                else:
+                    print(f"{original_path} -> {name}")
+        print(f"{query}: {matches} files", file=sys.stderr)
+
+
+def check_names(pairs, mapping_file_path, salt=None):
+    """
+    Checks flattened names against candidate original paths without
+    loading the mapping. Path-derived (UUIDv5) names are recomputed from the
+    path and the batch salt, which is read from the mapping's metadata
+    header unless given, so only the first line of the mapping is read.
+
+    Args:
+        pairs (list): (flattened filename, candidate relative path) pairs
+        mapping_file_path (str): Mapping whose salt is used
+        salt (str): Salt to use instead of the one recorded in the mapping
+
+    Returns:
+        int: Number of pairs that do not match, or None if the salt is unknown
+    """
+    if salt is None:
+        if not os.path.exists(mapping_file_path):
+            print(f"Error: Mapping file {mapping_file_path} does not exist.")
+            return None
+        salt = naming_salt(read_mapping_meta(mapping_file_path))
+        if salt is None:
+            print(
+                "Error: The names in this mapping are not derived from paths; "
+                "look them up instead."
+            )
+            return None
+    mismatches = 0
+    for name, candidate_path in pairs:
+        name = _clean_name(name)
+        if name_matches_path(name, os.path.normpath(candidate_path), salt):
+            print(f"Match: {name} -> {candidate_path}")
+        else:
+            mismatches += 1
+            print(f"No match: {name} is not {candidate_path}")
+    return mismatches
+
+
+# How many unresolved names the summary lists before it only counts them
+NOT_FOUND_LISTED = 100
+
+
+def convert_uuid_to_original_names(
+    uuid_list_file,
+    mapping_file_path,
+    output_file=None,
+    use_index=True,
+    catalog_path=None,
+    daemon_socket=None,
+):
     """
     Converts a list of UUID filenames to their original names using the mapping file.
 
+    Input is read and resolved line by line and every result is written as
+    soon as it is known, so the conversion can sit in a shell pipeline over
+    arbitrarily large logs. The summary goes to stderr to keep the results
+    stream clean.
+
     Args:
         uuid_list_file (str): Path to file containing UUID filenames (one per line)
-                             or None to read from stdin
+                             or None (or "-") to read from stdin
         mapping_file_path (str): Path to the mapping JSON file
         output_file (str): Path to output file (optional, prints to stdout if not provided)
+        use_index (bool): Look names up in the compiled index (default: True)
+        catalog_path (str): Look names up across the batches of this catalog
+                            instead of a single mapping; results name their batch
+        daemon_socket (str): Ask the lookup daemon on this socket instead of
+                             opening the mapping in this process
     """
     # Check if the mapping file exists
-    if not os.path.exists(mapping_file_path):
+    if daemon_socket is None and catalog_path is None and not os.path.exists(mapping_file_path):
         print(f"Error: Mapping file {mapping_file_path} does not exist.")
         return
+    if daemon_socket is not None and not os.path.exists(daemon_socket):
+        print(f"Error: No lookup daemon listening on {daemon_socket}.")
+        return
+    if uuid_list_file not in (None, "-") and not os.path.exists(uuid_list_file):
+        print(f"Error: Input file {uuid_list_file} does not exist.")
+        return
 
-    # Load the mapping file
-    with open(mapping_file_path, "r") as f:
-        file_mapping = json.load(f)
-
-    # Read UUID filenames
-    if uuid_list_file and os.path.exists(uuid_list_file):
-        with open(uuid_list_file, "r") as f:
-            uuid_filenames = [line.strip() for line in f if line.strip()]
+    resolver = open_resolver(mapping_file_path, catalog_path, use_index, daemon_socket)
+    # Catalogs and the daemon also report which batch a name came from
+    locate = getattr(resolver, "locate", None)
+    if uuid_list_file in (None, "-"):
+        source = sys.stdin
     else:
-        # Read from the error list you provided
-        uuid_filenames = []
-
-    # Process the conversion
-    results = []
-    not_found = []
-
-    for uuid_filename in uuid_filenames:
-        # Clean up the filename (remove bullet points, colons, etc.)
-        clean_uuid = uuid_filename.strip().lstrip("-").strip().split(":")[0].strip()
+        source = open(uuid_list_file, "r")
+    if output_file:
+        output = open(output_file, "w")
+    else:
+        output = sys.stdout
+    # Flush every line when the results feed another process interactively
+    flush_each_line = output is sys.stdout
 
-        if clean_uuid in file_mapping:
-            original_path = file_mapping[clean_uuid]
-            results.append(f"{clean_uuid} -> {original_path}")
-        else:
-            not_found.append(clean_uuid)
-            results.append(f"{clean_uuid} -> NOT FOUND IN MAPPING")
+    processed = 0
+    not_found = 0
+    not_found_listed = []
+    try:
+        for line in source:
+            if not line.strip():
+                continue
+            # Clean up the filename (remove bullet points, colons, etc.)
+            clean_uuid = _clean_name(line.split(":")[0])
+            processed += 1
+            if locate is not None:
+                found = locate(clean_uuid)
+                batch = f" [{os.path.basename(found[0])}]" if found and found[0] else ""
+                original_paths = found[1] if found else None
+            else:
+                batch = ""
+                original_paths = resolver.resolve(clean_uuid)
+            if original_paths is not None:
+                output.write(f"{clean_uuid} -> {_format_paths(original_paths)}{batch}\n")
+            else:
+                not_found += 1
+                if len(not_found_listed) < NOT_FOUND_LISTED:
+                    not_found_listed.append(clean_uuid)
+                output.write(f"{clean_uuid} -> NOT FOUND IN MAPPING\n")
+            if flush_each_line:
+                output.flush()
+    finally:
+        resolver.close()
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
 
-    # Output results
     if output_file:
-        with open(output_file, "w") as f:
-            for result in results:
-                f.write(result + "\n")
-        print(f"Conversion results written to {output_file}")
-    else:
-        for result in results:
-            print(result)
+        print(f"Conversion results written to {output_file}", file=sys.stderr)
 
     # Summary
-    print(f"\n{'='*60}")
-    print(f"Total files processed: {len(uuid_filenames)}")
-    print(f"Found in mapping: {len(uuid_filenames) - len(not_found)}")
-    print(f"Not found in mapping: {len(not_found)}")
+    print(f"\n{'='*60}", file=sys.stderr)
+    print(f"Total files processed: {processed}", file=sys.stderr)
+    print(f"Found in mapping: {processed - not_found}", file=sys.stderr)
+    print(f"Not found in mapping: {not_found}", file=sys.stderr)
 
-    if not_found:
-        print(f"\nFiles not found in mapping:")
-        for nf in not_found:
-            print(f"  - {nf}")
+    if not_found_listed:
+        print("\nFiles not found in mapping:", file=sys.stderr)
+        for nf in not_found_listed:
+            print(f"  - {nf}", file=sys.stderr)
+        if not_found > len(not_found_listed):
+            print(f"  ... and {not_found - len(not_found_listed)} more", file=sys.stderr)
 
 
-def convert_error_list(error_text, mapping_file_path, output_file=None):
+def convert_error_list(
+    inputs,
+    mapping_file_path,
+    output_file=None,
+    use_index=True,
+    jobs=1,
+    catalog_path=None,
+    daemon_socket=None,
+):
     """
-    Converts an error list (like the one you provided) to original filenames.
+    Converts error logs to original filenames by rewriting every flattened
+    name found in them (see errorlog.py for the formats recognised).
 
     Args:
-        error_text (str): The error text containing UUID filenames
+        inputs (list): Log files and/or directories of logs; empty reads stdin
         mapping_file_path (str): Path to the mapping JSON file
-        output_file (str): Path to output file (optional)
+        output_file (str): Path to output file, or directory when several logs
+                           or a directory are given (optional, prints to stdout)
+        use_index (bool): Look names up in the compiled index (default: True)
+        jobs (int): Worker processes used to split large logs (default: 1)
+        catalog_path (str): Resolve across the batches of this catalog instead
+                            of a single mapping
+        daemon_socket (str): Ask the lookup daemon on this socket instead
+
+    Returns:
+        dict: Counts of files, lines, names found and names resolved
     """
     # Check if the mapping file exists
-    if not os.path.exists(mapping_file_path):
+    if daemon_socket is None and catalog_path is None and not os.path.exists(mapping_file_path):
         print(f"Error: Mapping file {mapping_file_path} does not exist.")
-        return
+        return None
+    if daemon_socket is not None and not os.path.exists(daemon_socket):
+        print(f"Error: No lookup daemon listening on {daemon_socket}.")
+        return None
+    for input_path in inputs:
+        if not os.path.exists(input_path):
+            print(f"Error: Log {input_path} does not exist.")
+            return None
 
-    # Load the mapping file
-    with open(mapping_file_path, "r") as f:
-        file_mapping = json.load(f)
-
-    # Parse the error text to extract UUID filenames
-    import re
-
-    # Pattern to match UUID filenames (with extensions)
-    pattern = r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.\w+"
-    uuid_filenames = re.findall(pattern, error_text)
-
-    # Process the conversion
-    results = []
-    error_details = {}
-
-    lines = error_text.strip().split("\n")
-    for line in lines:
-        if line.strip().startswith("-"):
-            # Extract UUID filename and error message
-            parts = line.split(":", 1)
-            if len(parts) == 2:
-                uuid_part = parts[0].strip().lstrip("-").strip()
-                error_msg = parts[1].strip()
-
-                if uuid_part in file_mapping:
-                    original_path = file_mapping[uuid_part]
-                    results.append(f"- {original_path}: {error_msg}")
-                    error_details[original_path] = error_msg
-                else:
-                    results.append(f"- {uuid_part} (NOT IN MAPPING): {error_msg}")
+    totals = rewrite_logs(
+        inputs,
+        mapping_file_path,
+        output_file,
+        use_index=use_index,
+        jobs=jobs,
+        catalog_path=catalog_path,
+        daemon_socket=daemon_socket,
+    )
 
-    # Output results
     if output_file:
-        with open(output_file, "w") as f:
-            for result in results:
-                f.write(result + "\n")
-        print(f"Converted error list written to {output_file}")
-    else:
-        print("\n" + "=" * 60)
-        print("CONVERTED ERROR LIST:")
-        print("=" * 60)
-        for result in results:
-            print(result)
+        print(f"Converted error list written to {output_file}", file=sys.stderr)
 
-    return error_details
+    # Summary
+    print(f"\n{'='*60}", file=sys.stderr)
+    print(f"Logs processed: {totals['files']}", file=sys.stderr)
+    print(f"Lines processed: {totals['lines']}", file=sys.stderr)
+    print(f"Flattened names found: {totals['tokens']}", file=sys.stderr)
+    print(f"Resolved to original paths: {totals['resolved']}", file=sys.stderr)
+    print(f"Not in mapping: {totals['tokens'] - totals['resolved']}", file=sys.stderr)
+    return totals
 
 
 if __name__ == "__main__":
@@ -136,14 +308,23 @@ if __name__ == "__main__":
     parser.add_argument(
         "-m",
         "--mapping",
-        help="Path to the mapping JSON file (default: ./VenueMarketableBatch2.json)",
+        help="Path to the mapping file, .jsonl or legacy .json (default: ./VenueMarketableBatch2.json)",
         default="VenueMarketableBatch2.json",
     )
 
+    parser.add_argument(
+        "-c",
+        "--catalog",
+        help="Look names up across many batches instead of one mapping: a directory "
+        "of .json/.jsonl mappings or a file listing mapping paths (one per line)",
+        default=None,
+    )
+
     parser.add_argument(
         "-i",
         "--input",
-        help="Input file containing UUID filenames (one per line)",
+        help="Input file containing UUID filenames (one per line); reads stdin "
+        "if not provided or -",
         default=None,
     )
 
@@ -157,20 +338,151 @@ if __name__ == "__main__":
     parser.add_argument(
         "-e",
         "--errors",
-        help="Convert the error list format (paste your error text)",
+        nargs="*",
+        metavar="LOG",
+        help="Rewrite error logs (files or directories; stdin if none are given), "
+        "replacing every flattened name with its original path",
+        default=None,
+    )
+
+    parser.add_argument(
+        "-p",
+        "--path",
+        action="append",
+        metavar="QUERY",
+        help="Reverse lookup: list the flattened files stored for an original path, "
+        "everything under a directory, or a glob like 'Contracts/**/*.pdf' (repeatable)",
+    )
+
+    parser.add_argument(
+        "--check",
+        nargs=2,
+        action="append",
+        metavar=("NAME", "PATH"),
+        help="Check that a flattened name belongs to an original path without loading "
+        "the mapping; needs a flatten with --deterministic-names (repeatable)",
+    )
+
+    parser.add_argument(
+        "--salt",
+        help="With --check, the salt of the flatten instead of the one recorded in "
+        "the mapping (which then need not exist)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--match",
+        choices=MATCH_MODES,
+        help="How --path queries match: exact path, path prefix, glob, or auto "
+        "(glob if it has wildcards, else the path and everything below it) (default: auto)",
+        default="auto",
+    )
+
+    parser.add_argument(
+        "--names-only",
+        help="With --path, print only the flattened filenames (e.g. to feed a re-upload)",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="With --errors, worker processes used to split large logs (default: 1)",
+        default=1,
+    )
+
+    parser.add_argument(
+        "-d",
+        "--daemon",
+        nargs="?",
+        const="",
+        metavar="SOCKET",
+        help="Ask a running lookup daemon (lookupd.py) instead of opening the mapping; "
+        "the socket defaults to the daemon's own default",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--no-index",
+        help="Stream the mapping file instead of using (or building) its index",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--rebuild-index",
+        help="Rebuild the index next to the mapping file even if it looks current",
         action="store_true",
     )
 
     args = parser.parse_args()
 
     mapping_file_path = os.path.abspath(args.mapping)
+    catalog_path = os.path.abspath(args.catalog) if args.catalog else None
+    use_index = not args.no_index
+    daemon_socket = None
+    if args.daemon is not None:
+        daemon_socket = args.daemon or default_socket_path()
+    if (
+        catalog_path is None
+        and os.path.exists(mapping_file_path)
+        and read_manifest(mapping_file_path) is not None
+    ):
+        # A flatten split into sub-batches: its shards are looked up as a catalog
+        catalog_path = mapping_file_path
+
+    if args.rebuild_index and use_index:
+        if catalog_path is not None:
+            rebuild_paths = [path for path in load_catalog(catalog_path) if os.path.exists(path)]
+        else:
+            rebuild_paths = [mapping_file_path] if os.path.exists(mapping_file_path) else []
+        for path in rebuild_paths:
+            index = open_index(path, rebuild=True)
+            if index is not None:
+                index.close()
 
-    if args.errors:
-        # Handle the specific error format you provided
-        error_text = """
-- 138d4073-acac-4f7e-8e75-a4956628567d: File "138d4073-acac-4f7e-8e75-a4956628567d" has unsupported file type
-- 6c318e25-4f73-4d61-917f-883bafdb1fd8.xlsx: 6c318e25-4f73-4d61-917f-883bafdb1fd8.xlsx failed to process
-        """
-        convert_error_list(error_text, mapping_file_path, args.output)
+    if args.check:
+        mismatches = check_names(args.check, mapping_file_path, salt=args.salt)
+        sys.exit(1 if mismatches is None or mismatches else 0)
+    if args.path:
+        try:
+            convert_paths_to_names(
+                args.path,
+                mapping_file_path,
+                match=args.match,
+                names_only=args.names_only,
+                use_index=use_index,
+                catalog_path=catalog_path,
+                daemon_socket=daemon_socket,
+            )
+        except BrokenPipeError:
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(141)
+    elif args.errors is not None:
+        try:
+            convert_error_list(
+                args.errors,
+                mapping_file_path,
+                args.output,
+                use_index=use_index,
+                jobs=args.jobs,
+                catalog_path=catalog_path,
+                daemon_socket=daemon_socket,
+            )
+        except BrokenPipeError:
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(141)
     else:
-        convert_uuid_to_original_names(args.input, mapping_file_path, args.output)
+        try:
+            convert_uuid_to_original_names(
+                args.input,
+                mapping_file_path,
+                args.output,
+                use_index=use_index,
+                catalog_path=catalog_path,
+                daemon_socket=daemon_socket,
+            )
+        except BrokenPipeError:
+            # The reader went away (e.g. | head); stop quietly like other filters
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(141)
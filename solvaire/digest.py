@@ -0,0 +1,47 @@
+import hashlib
+
+
+# Size of the chunks used when hashing file contents
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """
+    Computes the SHA-256 digest of a file, reading it in fixed-size chunks
+    so large files are never loaded into memory at once.
+
+    Args:
+        path (str): Path to the file to hash
+
+    Returns:
+        str: Hex digest of the file contents
+    """
+    return hash_file_head(path, 0)[0]
+
+
+def hash_file_head(path, head_size):
+    """
+    Like hash_file, also returning the first bytes of the file from the
+    same read, for callers that inspect them (see sniff.py).
+
+    Args:
+        path (str): Path to the file to hash
+        head_size (int): Number of leading bytes to return (at most HASH_CHUNK_SIZE)
+
+    Returns:
+        tuple: (hex digest of the file contents, first head_size bytes)
+    """
+    digest = hashlib.sha256()
+    # One buffer reused for every chunk keeps memory flat per hashing thread
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    head = b""
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            if head_size and not head:
+                head = bytes(view[: min(count, head_size)])
+            digest.update(view[:count])
+    return digest.hexdigest(), head
@@ -0,0 +1,294 @@
+import os
+import re
+import sys
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from catalog import open_resolver
+from walker import walk_files
+
+
+# Flattened names as they appear in logs: a UUID (flatten) or a SHA-256
+# (dedupe), optionally followed by the extension. The lookbehind and
+# lookahead keep the match from starting or ending inside a longer token.
+TOKEN_PATTERN = re.compile(
+    rb"(?<![0-9A-Za-z])"
+    rb"(?P<stem>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9a-f]{64})"
+    rb"(?P<ext>\.[A-Za-z0-9]+)?"
+    rb"(?![0-9A-Za-z])"
+)
+
+# Logs at least this large are split into ranges for the process pool
+SPLIT_THRESHOLD = 64 * 1024 * 1024
+
+# Resolved tokens kept per process before the cache is emptied
+TOKEN_CACHE_SIZE = 100000
+
+
+def _join_paths(original_paths):
+    """Formats one or several original paths as a replacement."""
+    if isinstance(original_paths, list):
+        return ", ".join(original_paths)
+    return original_paths
+
+
+class LogRewriter:
+    """
+    Rewrites log lines, replacing every flattened filename it recognises
+    with the original path. Works on bytes, so lines are never decoded and
+    logs with stray non-UTF-8 bytes pass through untouched. Unknown names
+    are left as they are.
+    """
+
+    def __init__(self, resolver):
+        self.resolver = resolver
+        self.lines = 0
+        self.tokens = 0
+        self.resolved = 0
+        self._cache = {}
+
+    def _replace(self, match):
+        self.tokens += 1
+        token = match.group(0)
+        replacement = self._cache.get(token)
+        if replacement is None:
+            replacement = self._lookup(match)
+            if len(self._cache) >= TOKEN_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[token] = replacement
+        if replacement != token:
+            self.resolved += 1
+        return replacement
+
+    def _lookup(self, match):
+        token = match.group(0)
+        name = token.decode("ascii")
+        original_paths = self.resolver.resolve(name)
+        if original_paths is None and match.group("ext") is None:
+            # The log left out the extension
+            found = self.resolver.resolve_stem(name)
+            if found is not None:
+                original_paths = found[1]
+        if original_paths is None:
+            return token
+        return _join_paths(original_paths).encode("utf-8", "surrogateescape")
+
+    def rewrite(self, line):
+        """Returns the line with flattened names replaced."""
+        self.lines += 1
+        return TOKEN_PATTERN.sub(self._replace, line)
+
+    def stats(self):
+        return {
+            "lines": self.lines,
+            "tokens": self.tokens,
+            "resolved": self.resolved,
+        }
+
+
+def _rewrite_stream(rewriter, source, output, end=None):
+    """Rewrites lines from a binary stream until EOF or the end offset."""
+    position = source.tell() if end is not None else 0
+    if end is not None and position >= end:
+        return
+    for line in source:
+        output.write(rewriter.rewrite(line))
+        if end is not None:
+            position += len(line)
+            if position >= end:
+                break
+
+
+def _rewrite_range(log_path, start, end, resolver_args, part_path):
+    """
+    Rewrites one newline-aligned byte range of a log into a part file.
+    Runs in a worker process with its own connection to the index.
+
+    Args:
+        resolver_args (tuple): Arguments for catalog.open_resolver
+
+    Returns:
+        dict: Line and token counts for the range
+    """
+    resolver = open_resolver(*resolver_args)
+    rewriter = LogRewriter(resolver)
+    try:
+        with open(log_path, "rb") as source, open(part_path, "wb") as output:
+            source.seek(start)
+            _rewrite_stream(rewriter, source, output, end)
+    finally:
+        resolver.close()
+    return rewriter.stats()
+
+
+def split_ranges(log_path, parts):
+    """
+    Splits a file into at most `parts` byte ranges that start and end on
+    line boundaries.
+
+    Returns:
+        list: (start, end) offsets covering the whole file
+    """
+    size = os.path.getsize(log_path)
+    ranges = []
+    start = 0
+    with open(log_path, "rb") as f:
+        for number in range(1, parts):
+            target = size * number // parts
+            if target <= start:
+                continue
+            f.seek(target)
+            # Finish the line the target falls into
+            f.readline()
+            end = f.tell()
+            if end >= size:
+                break
+            ranges.append((start, end))
+            start = end
+    ranges.append((start, size))
+    return ranges
+
+
+def _iter_log_files(inputs):
+    """
+    Expands the input paths into (log path, path relative to its input)
+    pairs; directories contribute every file below them.
+    """
+    for input_path in inputs:
+        if os.path.isdir(input_path):
+            files = sorted(walk_files(input_path), key=lambda item: item[1])
+            for entry, relative_path in files:
+                yield entry.path, relative_path
+        else:
+            yield input_path, os.path.basename(input_path)
+
+
+def rewrite_logs(
+    inputs,
+    mapping_file_path,
+    output=None,
+    use_index=True,
+    jobs=1,
+    catalog_path=None,
+    daemon_socket=None,
+):
+    """
+    Rewrites log files with original paths substituted for flattened names.
+
+    Logs are streamed line by line. With jobs > 1 logs of at least
+    SPLIT_THRESHOLD bytes are split into newline-aligned ranges that a
+    process pool rewrites in parallel; the parts are then joined in order,
+    so the output is identical to a serial run.
+
+    Args:
+        inputs (list): Log files and/or directories of logs; empty reads stdin
+        mapping_file_path (str): Path to the mapping file
+        output (str): Output file, or output directory when a directory or
+                      several logs are given (default: stdout)
+        use_index (bool): Resolve names through the compiled index
+        jobs (int): Worker processes for large logs
+        catalog_path (str): Resolve across the batches of this catalog instead
+                            of a single mapping
+        daemon_socket (str): Resolve through the lookup daemon on this socket
+
+    Returns:
+        dict: Counts of "files", "lines", "tokens" and "resolved" names
+    """
+    totals = {"files": 0, "lines": 0, "tokens": 0, "resolved": 0}
+
+    def add(stats):
+        for key, value in stats.items():
+            totals[key] += value
+
+    # Opening the resolver builds any missing index or filter once, up front,
+    # rather than in every worker
+    resolver_args = (mapping_file_path, catalog_path, use_index, daemon_socket)
+    resolver = open_resolver(*resolver_args)
+    if not resolver.indexed:
+        # Every worker would have to load the whole mapping
+        jobs = 1
+    to_directory = output is not None and (
+        len(inputs) > 1 or any(os.path.isdir(path) for path in inputs)
+    )
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    try:
+        if not inputs:
+            rewriter = LogRewriter(resolver)
+            target = open(output, "wb") if output else sys.stdout.buffer
+            try:
+                _rewrite_stream(rewriter, sys.stdin.buffer, target)
+            finally:
+                if output:
+                    target.close()
+                else:
+                    target.flush()
+            add(rewriter.stats())
+            totals["files"] = 1
+            return totals
+
+        stdout_target = None if output else sys.stdout.buffer
+        single_target = None
+        if output and not to_directory:
+            single_target = open(output, "wb")
+        try:
+            for log_path, relative_path in _iter_log_files(inputs):
+                totals["files"] += 1
+                if to_directory:
+                    output_path = os.path.join(output, relative_path)
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                    target = open(output_path, "wb")
+                else:
+                    target = single_target or stdout_target
+                try:
+                    if executor is not None and os.path.getsize(log_path) >= SPLIT_THRESHOLD:
+                        add(
+                            _rewrite_parallel(executor, jobs, log_path, resolver_args, target)
+                        )
+                    else:
+                        rewriter = LogRewriter(resolver)
+                        with open(log_path, "rb") as source:
+                            _rewrite_stream(rewriter, source, target)
+                        add(rewriter.stats())
+                finally:
+                    if to_directory:
+                        target.close()
+            if stdout_target is not None:
+                stdout_target.flush()
+        finally:
+            if single_target is not None:
+                single_target.close()
+    finally:
+        resolver.close()
+        if executor is not None:
+            executor.shutdown()
+    return totals
+
+
+def _rewrite_parallel(executor, jobs, log_path, resolver_args, target):
+    """Rewrites one large log in ranges and appends the parts to target in order."""
+    ranges = split_ranges(log_path, jobs * 4)
+    parts_dir = tempfile.mkdtemp(prefix="solvaire-log-")
+    try:
+        futures = [
+            executor.submit(
+                _rewrite_range,
+                log_path,
+                start,
+                end,
+                resolver_args,
+                os.path.join(parts_dir, f"{number:05d}"),
+            )
+            for number, (start, end) in enumerate(ranges)
+        ]
+        stats = {"lines": 0, "tokens": 0, "resolved": 0}
+        for number, future in enumerate(futures):
+            for key, value in future.result().items():
+                stats[key] += value
+            part_path = os.path.join(parts_dir, f"{number:05d}")
+            with open(part_path, "rb") as part:
+                shutil.copyfileobj(part, target)
+            os.remove(part_path)
+        return stats
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
@@ -0,0 +1,361 @@
+import os
+import sys
+import sqlite3
+
+from mapping import iter_mapping
+from walker import compile_glob
+
+
+# Suffix of the index file built next to a mapping file
+INDEX_SUFFIX = ".idx.sqlite"
+
+# Bumped whenever the index schema changes, so old indexes get rebuilt
+INDEX_VERSION = 2
+
+# Rows inserted per executemany call while building
+BUILD_BATCH_SIZE = 10000
+
+# Bytes of the index SQLite may memory-map for lookups
+INDEX_MMAP_SIZE = 1024 * 1024 * 1024
+
+# Characters that make a path query a glob
+GLOB_CHARACTERS = "*?["
+
+# Path query modes for find_paths
+MATCH_MODES = ("auto", "exact", "prefix", "glob")
+
+
+def index_path_for(mapping_file_path):
+    """Returns the path of the index belonging to a mapping file."""
+    return mapping_file_path + INDEX_SUFFIX
+
+
+def mapping_fingerprint(mapping_file_path):
+    """Identifies one version of a mapping file; any rewrite changes it."""
+    stat = os.stat(mapping_file_path)
+    return f"{INDEX_VERSION}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def build_index(mapping_file_path, index_path=None):
+    """
+    Compiles a mapping file into a SQLite index in one streaming pass.
+
+    The index is written to a temporary file and moved into place, so
+    readers never see a half-built index. It records a fingerprint of the
+    mapping (inode, size, modification time) to detect when it goes stale.
+
+    Args:
+        mapping_file_path (str): Path to the mapping file (.jsonl or legacy .json)
+        index_path (str): Where to write the index (default: next to the mapping)
+
+    Returns:
+        int: Number of entries indexed
+    """
+    index_path = index_path or index_path_for(mapping_file_path)
+    # Taken before reading, so a mapping rewritten meanwhile reads as stale
+    fingerprint = mapping_fingerprint(mapping_file_path)
+    temp_index_path = f"{index_path}.{os.getpid()}.tmp"
+    if os.path.exists(temp_index_path):
+        os.remove(temp_index_path)
+    connection = sqlite3.connect(temp_index_path)
+    entries = 0
+    try:
+        # Nothing to protect until the file is moved into place
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)")
+        connection.execute("CREATE TABLE entries (name TEXT NOT NULL, path TEXT NOT NULL)")
+        batch = []
+        for name, original_path in iter_mapping(mapping_file_path):
+            batch.append((name, original_path))
+            if len(batch) >= BUILD_BATCH_SIZE:
+                connection.executemany("INSERT INTO entries VALUES (?, ?)", batch)
+                entries += len(batch)
+                batch = []
+        connection.executemany("INSERT INTO entries VALUES (?, ?)", batch)
+        entries += len(batch)
+        # Building the index after the inserts is much faster than maintaining it
+        connection.execute("CREATE INDEX entries_name ON entries (name)")
+        connection.execute("CREATE INDEX entries_path ON entries (path)")
+        connection.execute(
+            "INSERT INTO info VALUES ('fingerprint', ?), ('entries', ?)",
+            (fingerprint, str(entries)),
+        )
+        connection.commit()
+    except BaseException:
+        connection.close()
+        os.remove(temp_index_path)
+        raise
+    connection.close()
+    os.replace(temp_index_path, index_path)
+    return entries
+
+
+class MappingIndex:
+    """
+    Read-only view of a compiled mapping index. Lookups go through the
+    B-trees on the flattened name and on the original path, so they only
+    touch the pages they need however large the mapping is.
+    """
+
+    def __init__(self, index_path):
+        # Opened read-only through a URI so a lookup never writes
+        self._connection = sqlite3.connect(
+            f"file:{index_path}?mode=ro", uri=True, check_same_thread=False
+        )
+        # Read pages straight from the page cache instead of a read() each
+        self._connection.execute(f"PRAGMA mmap_size = {INDEX_MMAP_SIZE}")
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def fingerprint(self):
+        row = self._connection.execute(
+            "SELECT value FROM info WHERE key = 'fingerprint'"
+        ).fetchone()
+        return row[0] if row else None
+
+    def names(self):
+        """Yields every distinct flattened filename in the index."""
+        for (name,) in self._connection.execute("SELECT DISTINCT name FROM entries"):
+            yield name
+
+    def count_names(self):
+        """Returns the number of distinct flattened filenames."""
+        return self._connection.execute("SELECT COUNT(DISTINCT name) FROM entries").fetchone()[0]
+
+    def lookup_name(self, name):
+        """Returns the original paths of one flattened filename, in mapping order."""
+        return [
+            row[0]
+            for row in self._connection.execute(
+                "SELECT path FROM entries WHERE name = ? ORDER BY rowid", (name,)
+            )
+        ]
+
+    def lookup_stem(self, stem):
+        """
+        Returns (name, original paths) of the first flattened filename that is
+        stem plus an extension, for logs that drop the extension. Uses the
+        name index as a range scan: every "stem.<ext>" sorts between "stem."
+        and "stem/".
+        """
+        row = self._connection.execute(
+            "SELECT name FROM entries WHERE name >= ? AND name < ? ORDER BY name LIMIT 1",
+            (stem + ".", stem + "/"),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], self.lookup_name(row[0])
+
+    def paths_with_prefix(self, prefix):
+        """
+        Yields (name, original path) for every path starting with prefix, in
+        path order, as one range scan over the path index.
+        """
+        if not prefix:
+            query = self._connection.execute("SELECT name, path FROM entries ORDER BY path")
+        else:
+            # The smallest string greater than every string with this prefix
+            upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            query = self._connection.execute(
+                "SELECT name, path FROM entries WHERE path >= ? AND path < ? ORDER BY path",
+                (prefix, upper),
+            )
+        yield from query
+
+    def lookup_path(self, path):
+        """Returns the flattened filenames stored for one original path."""
+        return [
+            row[0]
+            for row in self._connection.execute(
+                "SELECT name FROM entries WHERE path = ? ORDER BY rowid", (path,)
+            )
+        ]
+
+
+def open_index(mapping_file_path, rebuild=False):
+    """
+    Opens the index of a mapping file, building it first if it is missing or
+    no longer matches the mapping.
+
+    Args:
+        mapping_file_path (str): Path to the mapping file
+        rebuild (bool): Rebuild even if the existing index looks current
+
+    Returns:
+        MappingIndex: The open index, or None if it cannot be written here
+                      (callers then fall back to streaming the mapping)
+    """
+    index_path = index_path_for(mapping_file_path)
+    if not rebuild and os.path.exists(index_path):
+        try:
+            index = MappingIndex(index_path)
+            if index.fingerprint() == mapping_fingerprint(mapping_file_path):
+                return index
+            index.close()
+        except sqlite3.DatabaseError:
+            # Corrupt or foreign file; rebuild it
+            pass
+    print(f"Building index {index_path}...", file=sys.stderr)
+    try:
+        entries = build_index(mapping_file_path, index_path)
+    except (OSError, sqlite3.OperationalError) as e:
+        print(f"Warning: cannot build index {index_path}: {e}", file=sys.stderr)
+        return None
+    print(f"Indexed {entries} entries", file=sys.stderr)
+    return MappingIndex(index_path)
+
+
+class NameResolver:
+    """
+    Resolves flattened filenames one at a time, for streaming conversions.
+
+    Uses the compiled index when available, so memory does not depend on how
+    many names are resolved. Without it the mapping is loaded into a dict
+    once, which is bounded by the mapping rather than by the input.
+    """
+
+    def __init__(self, mapping_file_path, use_index=True):
+        self.mapping_file_path = mapping_file_path
+        self._index = open_index(mapping_file_path) if use_index else None
+        # Whether lookups go through the compiled index
+        self.indexed = self._index is not None
+        self._mapping = None
+        self._stems = None
+        if self._index is None:
+            self._mapping = {}
+            self._stems = {}
+            for name, original_path in iter_mapping(mapping_file_path):
+                self._mapping.setdefault(name, []).append(original_path)
+                self._stems.setdefault(name.split(".", 1)[0], name)
+
+    def resolve(self, name):
+        """Returns the original path(s) of a name, or None if it is not mapped."""
+        if self._index is not None:
+            paths = self._index.lookup_name(name)
+        else:
+            paths = self._mapping.get(name)
+        if not paths:
+            return None
+        return paths[0] if len(paths) == 1 else paths
+
+    def resolve_stem(self, stem):
+        """
+        Like resolve, for a flattened filename given without its extension.
+
+        Returns:
+            tuple: (full flattened filename, original path(s)), or None
+        """
+        if self._index is not None:
+            found = self._index.lookup_stem(stem)
+            if found is None:
+                return None
+            name, paths = found
+        else:
+            name = self._stems.get(stem)
+            if name is None:
+                return None
+            paths = self._mapping[name]
+        return name, paths[0] if len(paths) == 1 else paths
+
+    def find_paths(self, query, match="auto"):
+        """
+        Reverse lookup through the open index (see find_paths).
+
+        Yields:
+            tuple: (mapping file path, flattened filename, original path)
+        """
+        for name, original_path in find_paths(
+            query, self.mapping_file_path, match, self.indexed, self._index
+        ):
+            yield self.mapping_file_path, name, original_path
+
+    def close(self):
+        if self._index is not None:
+            self._index.close()
+
+
+def _literal_prefix(pattern):
+    """Returns the part of a glob before its first wildcard."""
+    for position, character in enumerate(pattern):
+        if character in GLOB_CHARACTERS or character == "\\":
+            return pattern[:position]
+    return pattern
+
+
+def find_paths(query, mapping_file_path, match="auto", use_index=True, index=None):
+    """
+    Finds the flattened files stored for original paths, the reverse of
+    NameResolver.resolve.
+
+    Match modes:
+    - exact: the path itself
+    - prefix: every path starting with the query, e.g. "Contracts/2023/"
+    - glob: "*", "?" and "[...]" within a path component, "**" across them,
+      e.g. "Contracts/**/*.pdf"
+    - auto: glob if the query has wildcards, otherwise the path itself plus
+      everything below it as a directory
+
+    Through the index every mode is a range scan over the sorted paths; a
+    glob scans only the range of its literal prefix and filters that.
+
+    Args:
+        query (str): Path, prefix or glob, relative to the flattened source
+        mapping_file_path (str): Path to the mapping file
+        match (str): One of MATCH_MODES
+        use_index (bool): Query the compiled index instead of parsing the mapping
+        index (MappingIndex): Already open index of the mapping to query; it is
+                              left open
+
+    Yields:
+        tuple: (flattened filename, original path), in path order when indexed
+    """
+    query = query.lstrip("/")
+    if match == "auto":
+        match = "glob" if any(c in query for c in GLOB_CHARACTERS) else "subtree"
+    if match == "glob":
+        regex = compile_glob(query)
+        prefix = _literal_prefix(query)
+    elif match == "subtree":
+        directory = query.rstrip("/") + "/"
+        prefix = query.rstrip("/")
+    else:
+        prefix = query
+
+    def wanted(path):
+        if match == "exact":
+            return path == query
+        if match == "prefix":
+            return path.startswith(prefix)
+        if match == "subtree":
+            return path == prefix or path.startswith(directory)
+        return regex.match(path) is not None
+
+    if index is not None:
+        yield from _find_in_index(index, query, match, prefix, wanted)
+        return
+    index = open_index(mapping_file_path) if use_index else None
+    if index is None:
+        for name, original_path in iter_mapping(mapping_file_path):
+            if wanted(original_path):
+                yield name, original_path
+        return
+    with index:
+        yield from _find_in_index(index, query, match, prefix, wanted)
+
+
+def _find_in_index(index, query, match, prefix, wanted):
+    if match == "exact":
+        for name in index.lookup_path(query):
+            yield name, query
+        return
+    for name, original_path in index.paths_with_prefix(prefix):
+        if wanted(original_path):
+            yield name, original_path
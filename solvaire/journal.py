@@ -0,0 +1,118 @@
+import os
+
+from mapping import encode_entry, encode_meta, iter_jsonl_mapping, read_jsonl_meta
+
+
+# Force journal entries to stable storage after this many appends
+FSYNC_INTERVAL = 1000
+
+
+def journal_path_for(mapping_file_path):
+    """Returns the path of the journal that belongs to a mapping file."""
+    return mapping_file_path + ".journal"
+
+
+def _trim_partial_line(path):
+    """
+    Cuts off a trailing record that was only half written when the previous
+    run died, so new appends start on a clean line.
+    """
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Walk back to the last complete line
+        position = size
+        while position > 0:
+            step = min(64 * 1024, position)
+            position -= step
+            f.seek(position)
+            chunk = f.read(step)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                f.truncate(position + newline + 1)
+                return
+        f.truncate(0)
+
+
+def replay_journal(path):
+    """
+    Reads the mapping entries recorded in a journal.
+
+    Args:
+        path (str): Path to the journal file
+
+    Yields:
+        tuple: (flattened filename, relative source path) for every complete entry
+    """
+    if not os.path.exists(path):
+        return
+    # The journal uses the JSONL mapping format, so the mapping reader applies
+    yield from iter_jsonl_mapping(path)
+
+
+def read_journal_meta(path):
+    """Returns the mapping metadata a journal was started with."""
+    if not os.path.exists(path):
+        return {}
+    return read_jsonl_meta(path)
+
+
+class Journal:
+    """
+    Append-only log of mapping entries, written as each file lands in the
+    target directory so an interrupted flatten can pick up where it stopped.
+    It is written in the JSONL mapping format, so a finished journal can
+    become a .jsonl mapping simply by renaming it.
+    """
+
+    def __init__(self, path, resume=False, meta=None):
+        """
+        Args:
+            path (str): Path to the journal file
+            resume (bool): Keep existing entries and append to them
+            meta (dict): Mapping metadata written as the header of a new journal
+        """
+        self.path = path
+        if resume and os.path.exists(path):
+            _trim_partial_line(path)
+            self._file = open(path, "a")
+        else:
+            self._file = open(path, "w")
+            if meta:
+                self._file.write(encode_meta(meta))
+        self._unsynced = 0
+
+    def append(self, name, relative_source_path, file_type=None):
+        """
+        Records that a file has been placed under its flattened name, with
+        its sniffed type when known.
+        """
+        self._file.write(encode_entry(name, relative_source_path, file_type=file_type))
+        # Flush every entry so a killed process loses at most the line in flight
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= FSYNC_INTERVAL:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def close(self):
+        """Flushes the journal to disk and closes it."""
+        if self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def commit(self, mapping_file_path):
+        """Closes the journal and moves it into place as a JSONL mapping."""
+        self.close()
+        os.replace(self.path, mapping_file_path)
+
+    def remove(self):
+        """Closes and deletes the journal once the final mapping is safely written."""
+        self.close()
+        os.remove(self.path)
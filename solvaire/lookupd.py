@@ -0,0 +1,312 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import sqlite3
+import argparse
+import tempfile
+import threading
+import socketserver
+
+from catalog import Catalog, load_catalog
+from index import MATCH_MODES, NameResolver, mapping_fingerprint
+from mapping import read_manifest
+
+
+# Seconds between checks whether the served mapping files changed
+RELOAD_CHECK_INTERVAL = 1.0
+
+
+def default_socket_path():
+    """Per-user socket path used when none is given."""
+    return os.path.join(tempfile.gettempdir(), f"solvaire-lookupd-{os.getuid()}.sock")
+
+
+class _LookupService:
+    """
+    Tracks the mapping or catalog being served and which version of it
+    sessions should use. Every session (client connection) reads through
+    its own resolver, as one SQLite connection must not be shared between
+    threads, so lookups of different clients run side by side instead of
+    queueing on a lock. The indexes are memory-mapped (see INDEX_MMAP_SIZE)
+    and stay resident in the page cache across sessions, rather than being
+    loaded into Python dicts per process.
+
+    When a mapping file changes, the indexes and filters are rebuilt once and
+    the generation is bumped; each session reopens its resolver at its next
+    request.
+    """
+
+    def __init__(self, mapping_file_path=None, catalog_path=None):
+        self.mapping_file_path = mapping_file_path
+        self.catalog_path = catalog_path
+        # Held while checking for and applying a reload, never during lookups
+        self.lock = threading.Lock()
+        self.fingerprints = None
+        self.generation = 0
+        self.last_check = 0.0
+        self.reloads = 0
+        self._load()
+
+    def _current_fingerprints(self):
+        if self.catalog_path is None:
+            paths = [self.mapping_file_path]
+        else:
+            paths = load_catalog(self.catalog_path)
+        fingerprints = []
+        for path in paths:
+            try:
+                fingerprints.append((path, mapping_fingerprint(path)))
+            except FileNotFoundError:
+                fingerprints.append((path, None))
+        return fingerprints
+
+    def open_resolver(self):
+        """Opens a resolver for the current version of the mapping or catalog."""
+        if self.catalog_path is None:
+            return NameResolver(self.mapping_file_path)
+        return Catalog(self.catalog_path)
+
+    def _load(self):
+        fingerprints = self._current_fingerprints()
+        # Builds any missing or stale index and filter here, once, so sessions
+        # only open them
+        self.open_resolver().close()
+        if self.fingerprints is not None:
+            self.reloads += 1
+            print(f"Reloaded after a mapping changed ({self.reloads})", file=sys.stderr)
+        self.fingerprints = fingerprints
+        self.generation += 1
+        self.last_check = time.monotonic()
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if now - self.last_check < RELOAD_CHECK_INTERVAL:
+            return
+        # Another session is already checking; it reloads for everyone
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            self.last_check = now
+            if self._current_fingerprints() != self.fingerprints:
+                self._load()
+        except (OSError, ValueError, sqlite3.Error) as e:
+            # Replaced or removed mid-reload: sessions keep their previous
+            # resolver and the reload is tried again at the next check
+            print(f"Warning: reload failed, serving the previous mapping: {e}", file=sys.stderr)
+        finally:
+            self.lock.release()
+
+    def handle(self, request, session):
+        """Answers one decoded request with a JSON-serialisable response."""
+        op = request.get("op")
+        self._reload_if_changed()
+        resolver = session.resolver(self.generation)
+        if op == "resolve":
+            return {"results": [session.locate(name) for name in request["names"]]}
+        if op == "resolve_stem":
+            results = []
+            for stem in request["names"]:
+                found = resolver.resolve_stem(stem)
+                results.append(list(found) if found else None)
+            return {"results": results}
+        if op == "find_paths":
+            match = request.get("match", "auto")
+            if match not in MATCH_MODES:
+                return {"error": f"unknown match mode: {match}"}
+            results = []
+            for query in request["queries"]:
+                for batch, name, original_path in resolver.find_paths(query, match):
+                    results.append([batch if self.catalog_path else None, name, original_path])
+            return {"results": results}
+        if op == "ping":
+            return {"ok": True, "reloads": self.reloads}
+        return {"error": f"unknown op: {op}"}
+
+
+class _Session:
+    """The resolver of one client connection, used only by its thread."""
+
+    def __init__(self, service):
+        self._service = service
+        self._resolver = None
+        self._generation = None
+
+    def resolver(self, generation):
+        """Returns the open resolver, reopened first if the mapping was reloaded."""
+        if self._resolver is None or generation != self._generation:
+            resolver = self._service.open_resolver()
+            self.close()
+            self._resolver = resolver
+            self._generation = generation
+        return self._resolver
+
+    def locate(self, name):
+        if isinstance(self._resolver, Catalog):
+            found = self._resolver.locate(name)
+            return list(found) if found else None
+        original_paths = self._resolver.resolve(name)
+        return [None, original_paths] if original_paths is not None else None
+
+    def close(self):
+        if self._resolver is not None:
+            self._resolver.close()
+            self._resolver = None
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Serves newline-delimited JSON requests on one persistent connection."""
+
+    def handle(self):
+        service = self.server.service
+        session = _Session(service)
+        try:
+            for line in self.rfile:
+                try:
+                    response = service.handle(json.loads(line), session)
+                except (ValueError, KeyError, TypeError) as e:
+                    response = {"error": f"bad request: {e}"}
+                except (OSError, sqlite3.Error) as e:
+                    response = {"error": f"lookup failed: {e}"}
+                self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+                self.wfile.flush()
+        finally:
+            session.close()
+
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path, mapping_file_path=None, catalog_path=None):
+    """
+    Serves lookups for a mapping or catalog on a Unix socket until
+    interrupted or terminated.
+
+    Protocol: one JSON object per line in each direction, e.g.
+    {"op": "resolve", "names": [...]} -> {"results": [[batch, paths] or null, ...]}
+    {"op": "resolve_stem", "names": [...]} -> {"results": [[name, paths] or null, ...]}
+    {"op": "find_paths", "queries": [...], "match": "auto"}
+        -> {"results": [[batch, name, path], ...]}
+    where batch is the mapping a result came from when serving a catalog.
+
+    Args:
+        socket_path (str): Path of the Unix socket to create
+        mapping_file_path (str): Mapping to serve
+        catalog_path (str): Catalog to serve instead of a single mapping
+    """
+    service = _LookupService(mapping_file_path, catalog_path)
+    if os.path.exists(socket_path):
+        # Left behind by a daemon that did not shut down cleanly
+        os.remove(socket_path)
+    server = _Server(socket_path, _Handler)
+    server.service = service
+    os.chmod(socket_path, 0o600)
+    # Service managers stop daemons with SIGTERM; clean up the socket then too.
+    # Only the main thread may install handlers (tests serve from another one).
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _stop)
+    print(f"Serving {catalog_path or mapping_file_path} on {socket_path}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+class DaemonResolver:
+    """
+    Client side of the lookup daemon, with the same interface as
+    NameResolver and Catalog. Keeps one connection open, so a lookup costs a
+    single local round trip instead of interpreter startup plus index load.
+    """
+
+    # Lookups go through the daemon's compiled indexes
+    indexed = True
+
+    def __init__(self, socket_path=None):
+        self.socket_path = socket_path or default_socket_path()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(self.socket_path)
+        self._reader = self._socket.makefile("rb")
+
+    def _call(self, request):
+        self._socket.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        response = json.loads(self._reader.readline())
+        if "error" in response:
+            raise ValueError(f"lookup daemon: {response['error']}")
+        return response
+
+    def locate_many(self, names):
+        """Resolves a batch of names in one round trip: a list of (batch, paths) or None."""
+        results = self._call({"op": "resolve", "names": list(names)})["results"]
+        return [tuple(found) if found else None for found in results]
+
+    def locate(self, name):
+        """Returns (batch or None, original path(s)) for a name, or None."""
+        return self.locate_many([name])[0]
+
+    def resolve(self, name):
+        found = self.locate(name)
+        return found[1] if found else None
+
+    def resolve_stem(self, stem):
+        found = self._call({"op": "resolve_stem", "names": [stem]})["results"][0]
+        return tuple(found) if found else None
+
+    def find_paths(self, query, match="auto"):
+        """Yields (batch or None, flattened filename, original path)."""
+        response = self._call({"op": "find_paths", "queries": [query], "match": match})
+        for batch, name, original_path in response["results"]:
+            yield batch, name, original_path
+
+    def close(self):
+        self._reader.close()
+        self._socket.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve mapping lookups from memory over a Unix socket."
+    )
+    parser.add_argument(
+        "-m",
+        "--mapping",
+        help="Path to the mapping file, .jsonl or legacy .json (default: ./VenueMarketableBatch2.json)",
+        default="VenueMarketableBatch2.json",
+    )
+    parser.add_argument(
+        "-c",
+        "--catalog",
+        help="Serve every batch of a catalog (directory of mappings or list file) instead",
+        default=None,
+    )
+    parser.add_argument(
+        "-s",
+        "--socket",
+        help=f"Unix socket to listen on (default: {default_socket_path()})",
+        default=None,
+    )
+
+    args = parser.parse_args()
+
+    if args.catalog:
+        serve(args.socket or default_socket_path(), catalog_path=os.path.abspath(args.catalog))
+    else:
+        mapping_file_path = os.path.abspath(args.mapping)
+        if not os.path.exists(mapping_file_path):
+            print(f"Error: Mapping file {mapping_file_path} does not exist.")
+            sys.exit(1)
+        if read_manifest(mapping_file_path) is not None:
+            # A flatten split into sub-batches is served as a catalog of its shards
+            serve(args.socket or default_socket_path(), catalog_path=mapping_file_path)
+        else:
+            serve(args.socket or default_socket_path(), mapping_file_path=mapping_file_path)
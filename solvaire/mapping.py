@@ -0,0 +1,457 @@
+import os
+import json
+
+from naming import PATH_NAMING_SCHEME
+
+# Mapping files with this suffix use the line-delimited (streaming) format
+JSONL_SUFFIX = ".jsonl"
+
+# How much of a legacy JSON mapping is read at a time when streaming it
+READ_CHUNK_SIZE = 256 * 1024
+
+# Key under which a legacy JSON mapping stores its metadata (layout etc.)
+META_KEY = "__solvaire__"
+
+# Number of name characters used per fan-out directory level
+FANOUT_WIDTH = 2
+
+# Key of the single record in a manifest of a flatten split into batches
+MANIFEST_KEY = "manifest"
+
+# Longest first line read when checking whether a mapping is a manifest
+MANIFEST_PROBE_SIZE = 64 * 1024
+
+
+def is_jsonl_mapping(mapping_file_path):
+    """Returns True if the mapping file uses the line-delimited format."""
+    return mapping_file_path.endswith(JSONL_SUFFIX)
+
+
+def encode_entry(name, relative_source_path, digest=None, file_type=None):
+    """
+    Encodes one mapping entry as a line of the JSONL format. The content
+    digest and the sniffed file type are only written when known.
+    """
+    entry = {"name": name, "path": relative_source_path}
+    if digest is not None:
+        entry["sha256"] = digest
+    if file_type is not None:
+        entry["type"] = file_type
+    return json.dumps(entry) + "\n"
+
+
+def encode_meta(meta):
+    """Encodes the metadata header line of the JSONL format."""
+    return json.dumps({"meta": meta}) + "\n"
+
+
+def make_meta(fanout=0, salt=None):
+    """
+    Builds the metadata recorded in a mapping file.
+
+    Args:
+        fanout (int): Number of fan-out directory levels in the flattened
+                      directory (0 keeps every file at the top level)
+        salt (str): Salt of path-derived (UUIDv5) names; None for random names
+
+    Returns:
+        dict: Metadata describing how the flattened directory is laid out,
+              empty when everything is at its default
+    """
+    meta = {}
+    if fanout:
+        meta["layout"] = {"fanout": fanout, "width": FANOUT_WIDTH}
+    if salt is not None:
+        meta["naming"] = {"scheme": PATH_NAMING_SCHEME, "salt": salt}
+    return meta
+
+
+def flat_location(name, meta):
+    """
+    Returns where a flattened file lives relative to the flattened directory.
+    With a fan-out layout of depth 2, "3fa2c1...pdf" is stored as
+    "3f/a2/3fa2c1...pdf".
+
+    Args:
+        name (str): Flattened filename
+        meta (dict): Mapping metadata (see make_meta), may be empty
+
+    Returns:
+        str: Relative path of the file inside the flattened directory
+    """
+    layout = meta.get("layout") or {}
+    fanout = layout.get("fanout", 0)
+    if not fanout:
+        return name
+    width = layout.get("width", FANOUT_WIDTH)
+    parts = [name[level * width : (level + 1) * width] for level in range(fanout)]
+    return os.path.join(*parts, name)
+
+
+def read_jsonl_meta(path):
+    """Reads the metadata header of a JSONL mapping or journal, if it has one."""
+    with open(path, "r") as f:
+        first_line = f.readline()
+    if first_line.endswith("\n"):
+        record = json.loads(first_line)
+        if "meta" in record:
+            return record["meta"]
+    return {}
+
+
+def read_mapping_meta(mapping_file_path):
+    """
+    Reads the metadata of a mapping file without reading its entries.
+    Mappings written before metadata existed have none and yield {}. The
+    manifest of a split flatten yields the metadata its shards share.
+
+    Args:
+        mapping_file_path (str): Path to a .jsonl or legacy .json mapping
+
+    Returns:
+        dict: The recorded metadata
+    """
+    manifest = read_manifest(mapping_file_path)
+    if manifest is not None:
+        return manifest["meta"]
+    if is_jsonl_mapping(mapping_file_path):
+        return read_jsonl_meta(mapping_file_path)
+    with open(mapping_file_path, "r") as f:
+        for key, value in _iter_json_object(f):
+            # The writer always puts the metadata first
+            return value if key == META_KEY else {}
+    return {}
+
+
+def iter_jsonl_mapping(path):
+    """
+    Reads a line-delimited mapping one entry at a time.
+
+    A final line without a newline is a record that was still being written
+    when the writer died, so it is ignored.
+
+    Args:
+        path (str): Path to the JSONL mapping (or journal) file
+
+    Yields:
+        tuple: (flattened filename, relative source path)
+    """
+    with open(path, "r") as f:
+        yield from iter_jsonl_lines(f)
+
+
+def iter_jsonl_lines(lines):
+    """
+    Parses JSONL mapping records from any iterable of text lines, such as an
+    open file or a mapping member read from an archive.
+
+    Yields:
+        tuple: (flattened filename, relative source path)
+    """
+    for entry in _iter_jsonl_records(lines):
+        yield entry["name"], entry["path"]
+
+
+def _iter_jsonl_records(lines):
+    """Yields the decoded entry records of JSONL lines, skipping metadata."""
+    for line in lines:
+        if not line.endswith("\n"):
+            break
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        if "meta" in entry:
+            continue
+        yield entry
+
+
+def _iter_json_object(f):
+    """
+    Incrementally parses the top-level object of a legacy JSON mapping,
+    keeping only a small window of the file in memory.
+
+    Yields:
+        tuple: (key, decoded value) for every member of the object
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+
+    def fill():
+        # Drop what has been consumed and read the next chunk
+        nonlocal buffer, position, eof
+        chunk = f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            eof = True
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    def skip_whitespace():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or eof:
+                return
+            fill()
+
+    def decode():
+        # Decode one JSON value, reading more data until it is complete
+        nonlocal position
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            if end == len(buffer) and not eof:
+                # The value may continue in the next chunk
+                fill()
+                continue
+            position = end
+            return value
+
+    def expect(character):
+        nonlocal position
+        skip_whitespace()
+        if position >= len(buffer) or buffer[position] != character:
+            raise ValueError(f"Malformed mapping file: expected {character!r}")
+        position += 1
+
+    expect("{")
+    skip_whitespace()
+    if position < len(buffer) and buffer[position] == "}":
+        return
+    while True:
+        skip_whitespace()
+        key = decode()
+        expect(":")
+        skip_whitespace()
+        value = decode()
+        yield key, value
+        skip_whitespace()
+        if position < len(buffer) and buffer[position] == ",":
+            position += 1
+            continue
+        expect("}")
+        return
+
+
+def shard_mapping_path(mapping_file_path, batch):
+    """
+    Returns the path of one batch's mapping shard, next to the manifest and
+    in the same format: "Batch2.jsonl" -> "Batch2.batch-0001.jsonl".
+    """
+    root, extension = os.path.splitext(mapping_file_path)
+    return f"{root}.{batch}{extension}"
+
+
+def write_manifest(mapping_file_path, shards, meta=None, limits=None):
+    """
+    Writes the manifest of a flatten split into batches, atomically. It is
+    a single JSON line, so it can be told from a mapping by its first line.
+
+    Args:
+        mapping_file_path (str): Where the mapping of an unsplit flatten would go
+        shards (list): Dicts with the "batch" directory name, its "mapping"
+                       shard path, and its "files" and "bytes"
+        meta (dict): Mapping metadata shared by every shard
+        limits (dict): The "bytes" and "files" limits batches were packed under
+    """
+    base = os.path.dirname(os.path.abspath(mapping_file_path))
+    manifest = {
+        "meta": meta or {},
+        "limits": limits or {},
+        "shards": [
+            dict(shard, mapping=os.path.relpath(shard["mapping"], base)) for shard in shards
+        ],
+    }
+    temp_mapping_path = mapping_file_path + ".tmp"
+    with open(temp_mapping_path, "w") as f:
+        f.write(json.dumps({MANIFEST_KEY: manifest}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_mapping_path, mapping_file_path)
+
+
+def read_manifest(mapping_file_path):
+    """
+    Reads the manifest of a split flatten.
+
+    Returns:
+        dict: The manifest, with absolute shard mapping paths, or None if
+              the file is an ordinary mapping
+    """
+    prefix = f'{{"{MANIFEST_KEY}":'
+    with open(mapping_file_path, "r") as f:
+        if f.read(len(prefix)) != prefix:
+            return None
+        f.seek(0)
+        manifest = json.loads(f.readline())[MANIFEST_KEY]
+    base = os.path.dirname(os.path.abspath(mapping_file_path))
+    for shard in manifest["shards"]:
+        shard["mapping"] = os.path.join(base, shard["mapping"])
+    return manifest
+
+
+def iter_mapping(mapping_file_path):
+    """
+    Streams the entries of a mapping file in either format without loading
+    the whole file. Content-addressed (dedupe) entries that list several
+    original paths are yielded once per path. A manifest of a split flatten
+    yields the entries of all its shards.
+
+    Args:
+        mapping_file_path (str): Path to a .jsonl or legacy .json mapping
+
+    Yields:
+        tuple: (flattened filename, relative source path)
+    """
+    manifest = read_manifest(mapping_file_path)
+    if manifest is not None:
+        for shard in manifest["shards"]:
+            yield from iter_mapping(shard["mapping"])
+        return
+    if is_jsonl_mapping(mapping_file_path):
+        yield from iter_jsonl_mapping(mapping_file_path)
+        return
+    with open(mapping_file_path, "r") as f:
+        for name, original_paths in _iter_json_object(f):
+            if name == META_KEY:
+                continue
+            if isinstance(original_paths, str):
+                yield name, original_paths
+            else:
+                for original_path in original_paths:
+                    yield name, original_path
+
+
+def iter_mapping_locations(mapping_file_path):
+    """
+    Streams mapping entries together with where each flattened file is
+    stored relative to the flattened directory, following the recorded
+    layout. For a split flatten that is inside the entry's batch directory.
+
+    Args:
+        mapping_file_path (str): Path to a mapping or manifest
+
+    Yields:
+        tuple: (flattened filename, relative source path, flattened location)
+    """
+    manifest = read_manifest(mapping_file_path)
+    if manifest is None:
+        meta = read_mapping_meta(mapping_file_path)
+        for name, original_path in iter_mapping(mapping_file_path):
+            yield name, original_path, flat_location(name, meta)
+        return
+    for shard in manifest["shards"]:
+        meta = read_mapping_meta(shard["mapping"])
+        for name, original_path in iter_mapping(shard["mapping"]):
+            yield name, original_path, os.path.join(shard["batch"], flat_location(name, meta))
+
+
+def iter_mapping_digests(mapping_file_path):
+    """
+    Streams mapping entries together with the content digest recorded for
+    them by a previous verification, if any. Only JSONL mappings can carry
+    digests; entries of a legacy JSON mapping never have one.
+
+    Args:
+        mapping_file_path (str): Path to a .jsonl or legacy .json mapping
+
+    Yields:
+        tuple: (flattened filename, relative source path, SHA-256 hex digest or None)
+    """
+    if not is_jsonl_mapping(mapping_file_path):
+        for name, original_path in iter_mapping(mapping_file_path):
+            yield name, original_path, None
+        return
+    with open(mapping_file_path, "r") as f:
+        for entry in _iter_jsonl_records(f):
+            yield entry["name"], entry["path"], entry.get("sha256")
+
+
+def record_digests(mapping_file_path, digests):
+    """
+    Rewrites a JSONL mapping with a SHA-256 digest on every entry whose
+    flattened file has one in digests, atomically. Entry order, metadata
+    and any other recorded fields (such as the sniffed type) are kept.
+
+    Args:
+        mapping_file_path (str): Path to the .jsonl mapping
+        digests (dict): Flattened filename -> SHA-256 hex digest
+    """
+    meta = read_jsonl_meta(mapping_file_path)
+    temp_mapping_path = mapping_file_path + ".tmp"
+    with open(temp_mapping_path, "w") as f:
+        if meta:
+            f.write(encode_meta(meta))
+        with open(mapping_file_path, "r") as source:
+            for entry in _iter_jsonl_records(source):
+                digest = digests.get(entry["name"])
+                if digest is not None:
+                    entry["sha256"] = digest
+                f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_mapping_path, mapping_file_path)
+
+
+def write_jsonl_mapping(entries, mapping_file_path, meta=None):
+    """
+    Writes entries as a JSONL mapping, atomically.
+
+    Args:
+        entries (iterable): (flattened filename, relative source path) pairs
+        mapping_file_path (str): Path to save the .jsonl mapping
+        meta (dict): Metadata for the header line; omitted when empty
+    """
+    temp_mapping_path = mapping_file_path + ".tmp"
+    with open(temp_mapping_path, "w") as f:
+        if meta:
+            f.write(encode_meta(meta))
+        for name, relative_source_path in entries:
+            f.write(encode_entry(name, relative_source_path))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_mapping_path, mapping_file_path)
+
+
+def write_json_mapping(entries, mapping_file_path, grouped=False, meta=None):
+    """
+    Writes entries as a legacy JSON mapping, atomically.
+
+    Plain mappings are streamed out entry by entry in the same layout
+    json.dump(indent=4) produces. Grouped (dedupe) mappings have to collect
+    every path of a blob first, so they are built in memory.
+
+    Args:
+        entries (iterable): (flattened filename, relative source path) pairs
+        mapping_file_path (str): Path to save the mapping JSON file
+        grouped (bool): Map each name to a list of all its original paths
+        meta (dict): Metadata to record under META_KEY; omitted when empty so
+                     plain flattens keep producing the original format
+    """
+    temp_mapping_path = mapping_file_path + ".tmp"
+    with open(temp_mapping_path, "w") as f:
+        if grouped:
+            file_mapping = {META_KEY: meta} if meta else {}
+            for name, relative_source_path in entries:
+                file_mapping.setdefault(name, []).append(relative_source_path)
+            json.dump(file_mapping, f, indent=4)
+        else:
+            separator = "{\n"
+            if meta:
+                f.write(f"{separator}    {json.dumps(META_KEY)}: {json.dumps(meta)}")
+                separator = ",\n"
+            for name, relative_source_path in entries:
+                f.write(f"{separator}    {json.dumps(name)}: {json.dumps(relative_source_path)}")
+                separator = ",\n"
+            f.write("{}" if separator == "{\n" else "\n}")
+        f.flush()
+        os.fsync(f.fileno())
+    # Replace atomically so a crash never leaves half a mapping behind
+    os.replace(temp_mapping_path, mapping_file_path)
@@ -0,0 +1,72 @@
+import os
+import uuid
+
+
+# Namespace of path-derived flattened names. Never change it: every
+# deterministic name ever handed out would stop matching its path.
+NAME_NAMESPACE = uuid.UUID("40415371-99ad-4d63-8e87-74c0518d95cd")
+
+# Scheme recorded in the mapping metadata for path-derived names
+PATH_NAMING_SCHEME = "uuid5"
+
+
+def _name_key(relative_source_path, salt):
+    # Paths are hashed with "/" on every platform; the NUL byte cannot occur
+    # in a path, so no salt/path pair collides with another
+    return f"{salt}\0{relative_source_path.replace(os.sep, '/')}"
+
+
+def path_uuid(relative_source_path, salt):
+    """
+    Returns the UUIDv5 of a source path within a batch.
+
+    Args:
+        relative_source_path (str): Path of the file relative to the source directory
+        salt (str): Batch salt recorded in the mapping metadata
+
+    Returns:
+        str: The UUID in canonical form, without extension
+    """
+    return str(uuid.uuid5(NAME_NAMESPACE, _name_key(relative_source_path, salt)))
+
+
+def path_name(relative_source_path, salt):
+    """
+    Returns the deterministic flattened filename of a source path: its
+    UUIDv5 plus the original extension, the same on every flatten of the
+    tree with the same salt.
+    """
+    _, file_extension = os.path.splitext(relative_source_path)
+    return path_uuid(relative_source_path, salt) + file_extension
+
+
+def naming_salt(meta):
+    """
+    Returns the salt of a mapping with path-derived names.
+
+    Args:
+        meta (dict): Mapping metadata (see mapping.make_meta)
+
+    Returns:
+        str: The salt, or None if the names are random or content hashes
+    """
+    naming = meta.get("naming") or {}
+    if naming.get("scheme") != PATH_NAMING_SCHEME:
+        return None
+    return naming.get("salt", "")
+
+
+def name_matches_path(name, relative_source_path, salt):
+    """
+    Checks a flattened name (with or without extension, as logs quote it)
+    against a candidate source path without consulting the mapping.
+
+    Returns:
+        bool: True if the name is the path's deterministic name
+    """
+    stem = os.path.basename(name).split(".", 1)[0].lower()
+    if stem != path_uuid(relative_source_path, salt):
+        return False
+    _, file_extension = os.path.splitext(relative_source_path)
+    extension = os.path.basename(name)[len(stem) :]
+    return not extension or extension == file_extension
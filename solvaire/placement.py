@@ -0,0 +1,214 @@
+import os
+import errno
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; reflinks are simply never attempted there
+    fcntl = None
+
+
+# ioctl request number for FICLONE (_IOW(0x94, 9, int)) on Linux
+FICLONE = 0x40049409
+
+# Size of the reads of a copy made through user space
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Placement strategies accepted by flatten/unflatten
+STRATEGIES = ("copy", "hardlink", "reflink", "rename", "auto")
+
+# Errors that mean "this primitive does not work here", not "this file is bad"
+_UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EINVAL,
+    errno.ENOTTY,
+    errno.ENOSYS,
+    errno.EPERM,
+    errno.EMLINK,
+    errno.EBADF,
+}
+
+
+def copy_file(source_path, target_path):
+    """Copies a file and its metadata byte by byte."""
+    shutil.copy2(source_path, target_path)
+
+
+def copy_file_head(source_path, target_path, head_size):
+    """
+    Copies a file and its metadata through user space, returning the first
+    head_size bytes from the copy's own first read.
+    """
+    with open(source_path, "rb") as src, open(target_path, "wb") as dst:
+        head = src.read(max(head_size, COPY_CHUNK_SIZE))
+        dst.write(head)
+        shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+    shutil.copystat(source_path, target_path)
+    return head[:head_size]
+
+
+def reflink_file(source_path, target_path):
+    """
+    Clones a file with the FICLONE ioctl (btrfs, XFS, bcachefs...). The
+    clone shares extents with the source until either side is modified.
+    """
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform")
+    with open(source_path, "rb") as src, open(target_path, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.unlink(target_path)
+            raise
+    shutil.copystat(source_path, target_path)
+
+
+def copy_range_file(source_path, target_path):
+    """
+    Copies a file with os.copy_file_range, which keeps the data in the
+    kernel and lets NFS/SMB servers copy server-side.
+    """
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    with open(source_path, "rb") as src, open(target_path, "wb") as dst:
+        try:
+            remaining = os.fstat(src.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        except OSError:
+            dst.close()
+            os.unlink(target_path)
+            raise
+    shutil.copystat(source_path, target_path)
+
+
+def hardlink_file(source_path, target_path):
+    """Links the target to the same inode as the source (same filesystem only)."""
+    try:
+        os.link(source_path, target_path)
+    except FileExistsError:
+        # Match copy semantics and replace whatever is already there
+        os.unlink(target_path)
+        os.link(source_path, target_path)
+
+
+def rename_file(source_path, target_path):
+    """Moves the source file into place; the source no longer exists afterwards."""
+    os.replace(source_path, target_path)
+
+
+# Non-destructive primitives that auto mode tries, cheapest first
+_AUTO_CHAIN = (
+    ("reflink", reflink_file),
+    ("hardlink", hardlink_file),
+    ("copy_file_range", copy_range_file),
+    ("copy", copy_file),
+)
+
+_PRIMITIVES = {
+    "copy": copy_file,
+    "hardlink": hardlink_file,
+    "reflink": reflink_file,
+    "rename": rename_file,
+}
+
+
+class Placer:
+    """
+    Places files into their destination using one of STRATEGIES.
+
+    In auto mode the first file probes the filesystem by walking down the
+    chain reflink -> hardlink -> copy_file_range -> copy. The primitive that
+    works is remembered, and every later file starts from it and falls back
+    down the chain on its own if that primitive is refused.
+    """
+
+    def __init__(self, strategy="copy"):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown placement strategy: {strategy}")
+        self.strategy = strategy
+        self._lock = threading.Lock()
+        # Index into _AUTO_CHAIN chosen by the probe (auto mode only)
+        self._auto_start = None
+        # How many files each primitive actually placed
+        self.counts = {}
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def _place_auto(self, source_path, target_path):
+        start = self._auto_start or 0
+        for index in range(start, len(_AUTO_CHAIN)):
+            name, primitive = _AUTO_CHAIN[index]
+            try:
+                primitive(source_path, target_path)
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED_ERRNOS or index == len(_AUTO_CHAIN) - 1:
+                    raise
+                continue
+            with self._lock:
+                if self._auto_start is None:
+                    # The first successful placement is the filesystem probe
+                    self._auto_start = index
+            self._count(name)
+            return name
+
+    def place(self, source_path, target_path, keep_source=False):
+        """
+        Places a single file.
+
+        Args:
+            source_path (str): Path to the file to place
+            target_path (str): Destination path
+            keep_source (bool): The source is needed again afterwards, so the
+                                rename strategy falls back to auto for this file
+
+        Returns:
+            str: Name of the primitive that placed the file
+        """
+        strategy = self.strategy
+        if strategy == "rename" and keep_source:
+            strategy = "auto"
+        if strategy == "auto":
+            return self._place_auto(source_path, target_path)
+        _PRIMITIVES[strategy](source_path, target_path)
+        self._count(strategy)
+        return strategy
+
+    def place_head(self, source_path, target_path, head_size, keep_source=False):
+        """
+        Places a single file like place and also returns its first bytes.
+        The copy strategy takes them from the first chunk it copies, so the
+        file is read once; primitives that move no data through user space
+        (reflink, hardlink, copy_file_range, rename) read them from the
+        placed file, the only read of its contents.
+
+        Args:
+            source_path (str): Path to the file to place
+            target_path (str): Destination path
+            head_size (int): Number of leading bytes to return
+            keep_source (bool): See place
+
+        Returns:
+            tuple: (name of the primitive that placed the file, leading bytes)
+        """
+        if self.strategy == "copy":
+            head = copy_file_head(source_path, target_path, head_size)
+            self._count("copy")
+            return "copy", head
+        name = self.place(source_path, target_path, keep_source)
+        with open(target_path, "rb", buffering=0) as f:
+            return name, f.read(head_size)
+
+    def summary(self):
+        """Returns a short human-readable breakdown of primitives used."""
+        return ", ".join(f"{name}: {count}" for name, count in sorted(self.counts.items()))
@@ -0,0 +1,267 @@
+import sys
+import json
+import time
+import heapq
+import threading
+from contextlib import contextmanager
+
+
+# Upper bounds (seconds) of the per-file latency histogram buckets, doubling
+# from 0.1 ms; anything slower lands in the final overflow bucket
+LATENCY_BUCKETS = tuple(0.0001 * 2**i for i in range(20))
+
+# Number of slowest files kept for the outlier report
+SLOWEST_FILES = 10
+
+
+def format_bytes(count):
+    """Formats a byte count with a binary unit, e.g. 1.5 GiB."""
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if count < 1024 or unit == "TiB":
+            return f"{count:.1f} {unit}" if unit != "B" else f"{int(count)} B"
+        count /= 1024
+
+
+class Metrics:
+    """
+    Collects throughput numbers for one flatten or unflatten run: per-phase
+    wall time, file and byte counts, a latency histogram over individual
+    files and the slowest files seen. Safe to update from worker threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.counters = {}
+        self.files = 0
+        self.bytes = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._slowest = []
+
+    @contextmanager
+    def phase(self, name):
+        """Adds the wall time of a block to the named phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase_time(name, time.perf_counter() - start)
+
+    def add_phase_time(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def timed_iter(self, name, iterable):
+        """Yields from an iterable, charging the time spent producing items to a phase."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_phase_time(name, time.perf_counter() - start)
+                return
+            self.add_phase_time(name, time.perf_counter() - start)
+            yield item
+
+    def count(self, name, amount=1):
+        """Increments a named counter (errors, skipped files, ...)."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_file(self, label, size, seconds):
+        """
+        Records one processed file.
+
+        Args:
+            label (str): Identifies the file in the outlier report
+            size (int): Bytes processed
+            seconds (float): Time spent on the file
+        """
+        bucket = len(LATENCY_BUCKETS)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                bucket = index
+                break
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+            self.histogram[bucket] += 1
+            if len(self._slowest) < SLOWEST_FILES:
+                heapq.heappush(self._slowest, (seconds, label))
+            elif seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, (seconds, label))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def percentile(self, fraction):
+        """Approximates a latency percentile (upper bound of its histogram bucket)."""
+        with self._lock:
+            total = sum(self.histogram)
+            if not total:
+                return 0.0
+            threshold = fraction * total
+            seen = 0
+            for index, count in enumerate(self.histogram):
+                seen += count
+                if seen >= threshold:
+                    if index < len(LATENCY_BUCKETS):
+                        return LATENCY_BUCKETS[index]
+                    return float("inf")
+        return float("inf")
+
+    def slowest(self):
+        """Returns the slowest files as (seconds, label), slowest first."""
+        with self._lock:
+            return sorted(self._slowest, reverse=True)
+
+    def to_dict(self):
+        """Returns all metrics as a JSON-serialisable dict."""
+        elapsed = self.elapsed()
+        with self._lock:
+            histogram = {
+                f"<={bound * 1000:g}ms": count
+                for bound, count in zip(LATENCY_BUCKETS, self.histogram)
+                if count
+            }
+            if self.histogram[-1]:
+                histogram["overflow"] = self.histogram[-1]
+            result = {
+                "elapsed_seconds": elapsed,
+                "files": self.files,
+                "bytes": self.bytes,
+                "files_per_second": self.files / elapsed if elapsed else 0.0,
+                "bytes_per_second": self.bytes / elapsed if elapsed else 0.0,
+                "phases": dict(self.phases),
+                "counters": dict(self.counters),
+                "latency_histogram": histogram,
+            }
+        result["latency_p50_seconds"] = self.percentile(0.50)
+        result["latency_p95_seconds"] = self.percentile(0.95)
+        result["latency_p99_seconds"] = self.percentile(0.99)
+        result["slowest_files"] = [
+            {"file": label, "seconds": seconds} for seconds, label in self.slowest()
+        ]
+        return result
+
+    def write_json(self, path):
+        """Dumps the metrics to a JSON file."""
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    def print_summary(self):
+        """Prints throughput, phase times and latency outliers."""
+        elapsed = self.elapsed()
+        rate = self.files / elapsed if elapsed else 0.0
+        bandwidth = self.bytes / elapsed if elapsed else 0.0
+        print(
+            f"Throughput: {rate:.1f} files/s, {format_bytes(bandwidth)}/s "
+            f"({format_bytes(self.bytes)} in {elapsed:.2f}s)"
+        )
+        if self.phases:
+            phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+            print(f"Phases: {phases}")
+        if self.files:
+            print(
+                f"Per-file latency: p50 <= {self.percentile(0.5) * 1000:g}ms, "
+                f"p95 <= {self.percentile(0.95) * 1000:g}ms, "
+                f"p99 <= {self.percentile(0.99) * 1000:g}ms"
+            )
+            seconds, label = self.slowest()[0]
+            print(f"Slowest file: {label} ({seconds * 1000:.1f}ms)")
+
+
+def _count(number, noun):
+    """Formats a count with its noun, e.g. "1 file" or "3 files"."""
+    return f"{number} {noun}" if number == 1 else f"{number} {noun}s"
+
+
+class ProgressReporter:
+    """
+    Replaces per-file output with a status line redrawn at most every
+    `interval` seconds. On a terminal the line is rewritten in place; when
+    output is redirected a plain line is printed every `log_interval`
+    seconds instead. Verbose mode additionally prints every file.
+    """
+
+    def __init__(
+        self,
+        metrics,
+        verb="Processed",
+        verbose=False,
+        interval=0.5,
+        log_interval=10.0,
+        stream=None,
+    ):
+        """
+        Args:
+            metrics (Metrics): Where processed files are recorded
+            verb (str): Word used in the status line, e.g. "Copied"
+            verbose (bool): Also print one line per file
+            interval (float): Seconds between status redraws on a terminal
+            log_interval (float): Seconds between status lines when redirected
+            stream (file): Output stream (default: stdout)
+        """
+        self.metrics = metrics
+        self.verb = verb
+        self.verbose = verbose
+        self.stream = stream or sys.stdout
+        self.is_tty = self.stream.isatty()
+        self.interval = interval if self.is_tty else log_interval
+        self._last_draw = 0.0
+        self._line_drawn = False
+
+    def _status(self):
+        elapsed = self.metrics.elapsed()
+        rate = self.metrics.files / elapsed if elapsed else 0.0
+        bandwidth = self.metrics.bytes / elapsed if elapsed else 0.0
+        errors = self.metrics.counters.get("errors", 0)
+        status = (
+            f"{self.verb} {_count(self.metrics.files, 'file')}, "
+            f"{format_bytes(self.metrics.bytes)} "
+            f"| {rate:.0f} files/s, {format_bytes(bandwidth)}/s"
+        )
+        if errors:
+            status += f" | {_count(errors, 'error')}"
+        return status
+
+    def _clear(self):
+        if self._line_drawn:
+            self.stream.write("\r\033[K")
+            self._line_drawn = False
+
+    def file_done(self, source, destination, size, seconds):
+        """Records a processed file and redraws the status line if it is due."""
+        self.metrics.record_file(source, size, seconds)
+        if self.verbose:
+            self.message(f"{self.verb}: {source} -> {destination}")
+            return
+        now = time.monotonic()
+        if now - self._last_draw < self.interval:
+            return
+        self._last_draw = now
+        if self.is_tty:
+            self.stream.write("\r\033[K" + self._status())
+            self._line_drawn = True
+        else:
+            self.stream.write(self._status() + "\n")
+        self.stream.flush()
+
+    def message(self, text):
+        """Prints a line (warning, error, ...) without garbling the status line."""
+        self._clear()
+        self.stream.write(text + "\n")
+        self.stream.flush()
+
+    def finish(self):
+        """
+        Clears the status line before the final summary is printed. When
+        redirected, the final state is logged first, as the last periodic
+        line may be up to `log_interval` seconds stale.
+        """
+        self._clear()
+        if not self.is_tty:
+            self.stream.write(self._status() + "\n")
+        self.stream.flush()
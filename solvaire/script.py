@@ -1,101 +1,891 @@
 import os
-import shutil
 import uuid
-import json
+import sys
+import time
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
+from digest import hash_file, hash_file_head
+from journal import Journal, journal_path_for, read_journal_meta, replay_journal
+from mapping import (
+    flat_location,
+    is_jsonl_mapping,
+    iter_mapping,
+    iter_mapping_locations,
+    make_meta,
+    shard_mapping_path,
+    write_json_mapping,
+    write_manifest,
+)
+from archive import ArchiveSink, is_archive_path, restore_archive
+from batches import BatchPacker, batch_name
+from naming import naming_salt, path_name
+from placement import Placer, STRATEGIES
+from progress import Metrics, ProgressReporter, format_bytes
+from restore import (
+    create_directories,
+    delete_stale,
+    plan_directories,
+    report_plan_savings,
+    target_is_current,
+)
+from sniff import (
+    SNIFF_BYTES,
+    QuarantineList,
+    quarantine_path_for,
+    quarantine_reason,
+    sniff_type,
+)
+from verify import verify_tree
+from walker import load_patterns, walk_files
 
-def flatten_directory(source_dir, target_dir, mapping_file_path):
+
+class _BlobRegistry:
+    """
+    Tracks which content-addressed blobs have been claimed by a copier.
+
+    The first thread to claim a name copies it; every later claimant waits
+    until that copy finishes and learns whether the blob actually exists.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blobs = {}
+
+    def claim(self, name):
+        """
+        Returns True if the caller must copy the blob, False if another
+        thread already owns it.
+        """
+        with self._lock:
+            if name in self._blobs:
+                return False
+            self._blobs[name] = [threading.Event(), False]
+            return True
+
+    def finish(self, name, ok):
+        """Marks a claimed blob as copied (or failed) and wakes up waiters."""
+        with self._lock:
+            blob = self._blobs[name]
+            if not ok:
+                # Let a later duplicate retry the copy
+                del self._blobs[name]
+        blob[1] = ok
+        blob[0].set()
+
+    def mark_done(self, name):
+        """Registers a blob that an earlier, interrupted run already placed."""
+        with self._lock:
+            event = threading.Event()
+            event.set()
+            self._blobs[name] = [event, True]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._blobs)
+
+    def wait(self, name):
+        """Blocks until the owner of a blob is done; returns True if it was copied."""
+        with self._lock:
+            blob = self._blobs.get(name)
+        if blob is None:
+            return False
+        blob[0].wait()
+        return blob[1]
+
+
+class _DirectorySink:
+    """
+    Places flattened files into the target directory, creating fan-out
+    directories the first time they are needed.
+    """
+
+    def __init__(self, target_dir, placer):
+        self.target_dir = target_dir
+        self.placer = placer
+        self._lock = threading.Lock()
+        self._created = set()
+
+    def add(self, source_path, location, relative_source_path, head_size=0):
+        """
+        Places a file at its location relative to the target directory.
+
+        Returns:
+            bytes: The file's first head_size bytes, or None if none were asked for
+        """
+        target_path = os.path.join(self.target_dir, location)
+        directory = os.path.dirname(target_path)
+        if directory != self.target_dir:
+            with self._lock:
+                known = directory in self._created
+            if not known:
+                # Only remembered once it exists, so no worker places a file
+                # into a directory another worker is still creating
+                os.makedirs(directory, exist_ok=True)
+                with self._lock:
+                    self._created.add(directory)
+        if head_size:
+            return self.placer.place_head(source_path, target_path, head_size)[1]
+        self.placer.place(source_path, target_path)
+        return None
+
+
+def _flatten_file(
+    source_path,
+    relative_source_path,
+    new_filename_with_ext,
+    sink,
+    meta,
+    blobs=None,
+    sniff=False,
+):
+    """
+    Places a single file into the flattened directory or archive.
+
+    Runs inside a worker thread, so it only touches its own paths and
+    leaves all bookkeeping to the caller.
+
+    Args:
+        source_path (str): Path to the original file
+        relative_source_path (str): Path of the file relative to the source directory
+        new_filename_with_ext (str): Flattened filename, or None to name the
+                                     file by its content hash
+        sink (_DirectorySink or ArchiveSink): Where flattened files are written
+        meta (dict): Mapping metadata, which determines the file's location
+        blobs (_BlobRegistry): Registry of copied blobs (content-addressed mode only)
+        sniff (bool): Tell the file's type from its first bytes
+
+    Returns:
+        tuple: (flattened filename the file is stored under, seconds it took,
+                sniffed type or None)
+    """
+    start = time.perf_counter()
+    file_type = None
+    if new_filename_with_ext is not None:
+        head = sink.add(
+            source_path,
+            flat_location(new_filename_with_ext, meta),
+            relative_source_path,
+            head_size=SNIFF_BYTES if sniff else 0,
+        )
+        if sniff:
+            # The head comes out of the copy's own first read
+            file_type = sniff_type(head)
+        return new_filename_with_ext, time.perf_counter() - start, file_type
+
+    # Content-addressed mode: identical files share one blob
+    _, file_extension = os.path.splitext(source_path)
+    if sniff:
+        # The head comes out of the hashing read
+        digest, head = hash_file_head(source_path, SNIFF_BYTES)
+        file_type = sniff_type(head)
+    else:
+        digest = hash_file(source_path)
+    new_filename_with_ext = digest + file_extension
+    while not blobs.claim(new_filename_with_ext):
+        if blobs.wait(new_filename_with_ext):
+            # Another file with the same content is already in place
+            return new_filename_with_ext, time.perf_counter() - start, file_type
+    try:
+        sink.add(
+            source_path, flat_location(new_filename_with_ext, meta), relative_source_path
+        )
+    except BaseException:
+        blobs.finish(new_filename_with_ext, False)
+        raise
+    blobs.finish(new_filename_with_ext, True)
+    return new_filename_with_ext, time.perf_counter() - start, file_type
+
+
+def check_quarantine(quarantine, name, relative_source_path, file_type, reporter):
+    """Lists a placed file in the quarantine if the upload would likely reject it."""
+    reason = quarantine_reason(relative_source_path, file_type)
+    if reason is None:
+        return
+    quarantine.add(name, relative_source_path, file_type, reason)
+    reporter.metrics.count("quarantined")
+    if reporter.verbose:
+        reporter.message(f"Quarantined {relative_source_path}: {reason}")
+
+
+def print_quarantine_summary(quarantine):
+    """Prints how many files were quarantined and where they are listed."""
+    print(f"Quarantined (likely rejected by the upload): {quarantine.count}")
+    if quarantine.count:
+        print(f"Quarantine list: {quarantine.path}")
+
+
+def _remove_orphans(target_dir, placed_names):
+    """
+    Deletes files in the target directory (including fan-out directories)
+    that no mapping entry refers to. These are copies that landed just before
+    an interruption, before their journal entry was written.
+
+    Returns:
+        int: Number of files removed
+    """
+    removed = 0
+    for entry, _ in walk_files(target_dir):
+        if entry.name not in placed_names:
+            os.remove(entry.path)
+            removed += 1
+    return removed
+
+
+class _Batch:
+    """
+    One flattened output with its own journal, mapping and blob registry.
+    An unsplit flatten has a single batch; a flatten split by size or file
+    count has one per sub-batch directory, each uploadable on its own.
+    """
+
+    def __init__(self, name, target_dir, mapping_file_path, sink, dedupe):
+        self.name = name
+        self.target_dir = target_dir
+        self.mapping_file_path = mapping_file_path
+        self.sink = sink
+        self.journal_path = journal_path_for(mapping_file_path)
+        self.journal = None
+        # Blobs already placed in this batch (dedupe mode only); a batch
+        # never relies on a blob stored in another one
+        self.blobs = _BlobRegistry() if dedupe else None
+        # Number of files recorded in this batch's mapping
+        self.files = 0
+
+    def finish(self, meta):
+        """Turns the journal into the batch's mapping."""
+        if is_jsonl_mapping(self.mapping_file_path):
+            # The journal already is a complete JSONL mapping
+            self.journal.commit(self.mapping_file_path)
+        else:
+            # Convert the journal into a legacy JSON mapping
+            self.journal.close()
+            write_json_mapping(
+                replay_journal(self.journal_path),
+                self.mapping_file_path,
+                grouped=self.blobs is not None,
+                meta=meta,
+            )
+            self.journal.remove()
+
+
+def _replay_batch(batch, done_sources, measure=False):
+    """
+    Picks up one batch of an interrupted run from its journal: the files it
+    placed are added to done_sources, and copies that landed without a
+    journal entry are removed.
+
+    Args:
+        batch (_Batch): The batch, whose journal has not been opened yet
+        done_sources (set): Relative source paths already placed
+        measure (bool): Also add up the size of the batch's files
+
+    Returns:
+        tuple: (bytes the batch holds, or 0 if not measured, orphaned files removed)
+    """
+    meta = read_journal_meta(batch.journal_path)
+    placed_names = set()
+    size = 0
+    for new_filename_with_ext, relative_source_path in replay_journal(batch.journal_path):
+        placed_names.add(new_filename_with_ext)
+        done_sources.add(relative_source_path)
+        batch.files += 1
+        if batch.blobs is not None:
+            batch.blobs.mark_done(new_filename_with_ext)
+        if measure:
+            try:
+                size += os.path.getsize(
+                    os.path.join(batch.target_dir, flat_location(new_filename_with_ext, meta))
+                )
+            except OSError:
+                pass
+    return size, _remove_orphans(batch.target_dir, placed_names)
+
+
+def flatten_directory(
+    source_dir,
+    target_dir,
+    mapping_file_path,
+    workers=1,
+    dedupe=False,
+    strategy="copy",
+    resume=False,
+    fanout=0,
+    include=None,
+    exclude=None,
+    archive=None,
+    volume_size=None,
+    reporter=None,
+    sniff=False,
+    max_batch_bytes=None,
+    max_batch_files=None,
+    salt=None,
+):
     """
     Flattens a directory structure by:
     1. Creating a new target directory
     2. Copying all files to the target directory with UUID filenames
     3. Creating a mapping file that links UUID filenames to original paths
+
+    In dedupe mode each file is named by the SHA-256 of its contents instead,
+    byte-identical files are copied only once, and the mapping links every
+    blob to the list of original paths that share it.
+
+    With a salt each file is instead named by the UUIDv5 of its relative
+    path and the salt (see naming.py), so flattening the same tree again
+    gives every file the same name, and a name can be checked against a
+    candidate path without loading the mapping. The salt is recorded in
+    the mapping metadata.
+
+    Every placed file is appended to a journal next to the mapping file as
+    soon as it lands, so an interrupted run can be continued with resume=True
+    instead of starting over. The journal is removed once the mapping is written.
+
+    A mapping path ending in .jsonl selects the line-delimited format: the
+    journal itself becomes the mapping, so memory use does not grow with the
+    size of the batch. Any other path gets the legacy JSON object.
+
+    With fanout > 0 files are spread over nested directories named after the
+    leading characters of their flattened name (e.g. 3f/a2/3fa2...pdf), which
+    keeps directories small. The layout is recorded in the mapping.
+
+    With an archive path (.tar, .tar.gz, .tgz or .zip) files are streamed
+    straight into the archive instead of the target directory, optionally
+    split into volumes of at most volume_size bytes. Each member records its
+    original path and the mapping is embedded in the last volume.
+
+    With sniff each file's type is told from its first bytes as it is
+    placed and recorded on its entry of a .jsonl mapping. Files the upload
+    is likely to reject (unsupported or empty content, a missing extension,
+    an extension that contradicts the content) are listed in a quarantine
+    list next to the mapping.
+
+    With max_batch_bytes and/or max_batch_files the output is split into
+    numbered sub-batches (target_dir/batch-0001, ...) that each stay within
+    the limits, packed first-fit as the tree is walked (see batches.py).
+    Every batch gets its own mapping shard and journal, and the mapping
+    path holds a manifest of the shards, which unflatten_directory and the
+    lookup tools read like a single mapping.
+
     Args:
         source_dir (str): Path to the source directory
         target_dir (str): Path to the target directory
-        mapping_file_path (str): Path to save the mapping JSON file
+        mapping_file_path (str): Path to save the mapping (.jsonl or legacy .json)
+        workers (int): Number of copier threads (default: 1, copies serially)
+        dedupe (bool): Name files by content hash and skip duplicate copies
+        strategy (str): How files are placed, one of copy, hardlink, reflink,
+                        rename or auto (default: copy)
+        resume (bool): Replay the journal of an interrupted run, skip the files
+                       it already placed and finish the mapping
+        fanout (int): Number of fan-out directory levels (default: 0, flat)
+        include (list): Gitignore-style patterns a file must match to be flattened
+        exclude (list): Gitignore-style patterns of files and directories to
+                        skip; Thumbs.db is always skipped
+        archive (str): Write into this archive instead of target_dir
+        volume_size (int): Maximum bytes per archive volume (default: no limit)
+        reporter (ProgressReporter): Receives progress and metrics (default: a
+                                     throttled status line on stdout)
+        sniff (bool): Record each file's type and quarantine likely rejects
+        max_batch_bytes (int): Maximum total size of a sub-batch
+        max_batch_files (int): Maximum number of files in a sub-batch
+        salt (str): Name files by the UUIDv5 of their path and this salt
+                    instead of a random UUID
     """
-    # Create target directory if it doesn't exist
-    if not os.path.exists(target_dir):
+    if reporter is None:
+        reporter = ProgressReporter(Metrics(), verb="Copied")
+    metrics = reporter.metrics
+    split = bool(max_batch_bytes or max_batch_files)
+    if archive and resume:
+        print("Error: an archive cannot be resumed; flatten it again instead.")
+        return
+    if archive and split:
+        print("Error: an archive is split into volumes by size, not into batches.")
+        return
+    if dedupe and salt is not None:
+        print("Error: deduplicated files are named by their content, not their path.")
+        return
+    placer = Placer(strategy)
+    meta = make_meta(fanout=fanout, salt=salt)
+    if archive:
+        sink = ArchiveSink(archive, volume_size)
+    elif not os.path.exists(target_dir):
+        # Create target directory if it doesn't exist
         os.makedirs(target_dir)
-    # Dictionary to store mapping of UUID to original filepath
-    file_mapping = {}
-    # Walk through the source directory
-    for root, _, files in os.walk(source_dir):
-        for file in files:
-            # Skip Thumbs.db files
-            if file == "Thumbs.db":
+    # Number of files recorded in the mapping so far
+    files_recorded = 0
+    # Relative source paths that an interrupted run already placed
+    done_sources = set()
+    # Where files go: the one output, or every sub-batch opened so far
+    batches = []
+    packer = BatchPacker(max_batch_bytes, max_batch_files) if split else None
+
+    def new_batch():
+        if not split:
+            batch_sink = sink if archive else _DirectorySink(target_dir, placer)
+            return _Batch(None, target_dir, mapping_file_path, batch_sink, dedupe)
+        name = batch_name(len(batches) + 1)
+        batch_dir = os.path.join(target_dir, name)
+        os.makedirs(batch_dir, exist_ok=True)
+        return _Batch(
+            name,
+            batch_dir,
+            shard_mapping_path(mapping_file_path, name),
+            _DirectorySink(batch_dir, placer),
+            dedupe,
+        )
+
+    def start_batch():
+        batch = new_batch()
+        if os.path.exists(batch.journal_path):
+            print(f"Warning: discarding journal of an interrupted run: {batch.journal_path}")
+        batch.journal = Journal(batch.journal_path, meta=meta)
+        batches.append(batch)
+        return batch
+
+    if resume:
+        resume_started = time.perf_counter()
+        orphans = 0
+        while True:
+            batch = new_batch()
+            if not os.path.exists(batch.journal_path):
+                # Without a journal nothing says which files are orphans
+                break
+            # The interrupted run decided the layout; keep it
+            meta = read_journal_meta(batch.journal_path)
+            # Pick up the state of the interrupted run from its journal
+            size, removed = _replay_batch(batch, done_sources, measure=split)
+            orphans += removed
+            if split:
+                packer.restore(batch.files, size)
+            batch.journal = Journal(batch.journal_path, resume=True, meta=meta)
+            batches.append(batch)
+            if not split:
+                break
+        if not batches:
+            print(
+                f"Error: No journal of an interrupted run at {batch.journal_path}; "
+                "nothing to resume. Run without --resume to flatten again."
+            )
+            return
+        files_recorded = len(done_sources)
+        print(f"Resuming: {len(done_sources)} files already placed")
+        print(f"Removed {orphans} orphaned files from the interrupted run")
+        metrics.add_phase_time("resume", time.perf_counter() - resume_started)
+    elif not split:
+        start_batch()
+    # The interrupted run decided the naming too
+    salt = naming_salt(meta)
+    quarantine = QuarantineList(quarantine_path_for(mapping_file_path), resume) if sniff else None
+    # Files that could not be copied, as (relative path, error) pairs
+    failed = []
+    # Copies that have been submitted but not collected yet
+    pending = {}
+    # Keep a few copies queued per worker so the walk never runs far ahead
+    max_pending = max(1, workers) * 4
+
+    def collect(done):
+        # Record finished copies; only the main thread writes the journals
+        nonlocal files_recorded
+        for future in done:
+            relative_source_path, size, batch = pending.pop(future)
+            try:
+                new_filename_with_ext, seconds, file_type = future.result()
+            except OSError as e:
+                failed.append((relative_source_path, e))
+                metrics.count("errors")
+                reporter.message(f"Error: {relative_source_path}: {e}")
                 continue
-            # Get the full path of the source file
-            source_path = os.path.join(root, file)
-            # Generate a UUID for the new filename
-            new_filename = str(uuid.uuid4())
-            # Get the file extension
-            _, file_extension = os.path.splitext(file)
-            # Create the new filename with the original extension
-            new_filename_with_ext = new_filename + file_extension
-            # Path to the new file in the target directory
-            target_path = os.path.join(target_dir, new_filename_with_ext)
+            batch.journal.append(new_filename_with_ext, relative_source_path, file_type)
+            batch.files += 1
+            files_recorded += 1
+            if quarantine is not None:
+                check_quarantine(
+                    quarantine, new_filename_with_ext, relative_source_path, file_type, reporter
+                )
+            reporter.file_done(relative_source_path, new_filename_with_ext, size, seconds)
+
+    def report_walk_error(e):
+        # A directory that cannot be listed is reported, not fatal
+        failed.append((os.path.relpath(e.filename, source_dir), e))
+        metrics.count("errors")
+        reporter.message(f"Error: cannot list {e.filename}: {e.strerror}")
+
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    copy_started = time.perf_counter()
+    try:
+        # Walk through the source directory, pruning excluded subtrees; time
+        # spent listing directories is charged to the walk phase
+        walk = walk_files(
+            source_dir, include=include, exclude=exclude, onerror=report_walk_error
+        )
+        for entry, relative_source_path in metrics.timed_iter("walk", walk):
+            # Skip files placed before an interruption
+            if relative_source_path in done_sources:
+                continue
+            if dedupe:
+                # The name is derived from the content by the copier
+                new_filename_with_ext = None
+            elif salt is not None:
+                # The name is derived from the path, the same on every run
+                new_filename_with_ext = path_name(relative_source_path, salt)
+            else:
+                # Generate a UUID for the new filename
+                new_filename = str(uuid.uuid4())
+                # Get the file extension
+                _, file_extension = os.path.splitext(entry.name)
+                # Create the new filename with the original extension
+                new_filename_with_ext = new_filename + file_extension
+            # Size for throughput numbers and batch packing (cached by scandir
+            # where the OS allows)
+            try:
+                size = entry.stat().st_size
+            except OSError:
+                size = 0
+            if split:
+                number = packer.add(size)
+                if number > len(batches):
+                    if max_batch_bytes and size > max_batch_bytes:
+                        reporter.message(
+                            f"Warning: {relative_source_path} is larger than the batch "
+                            "size limit; it gets a batch of its own"
+                        )
+                    start_batch()
+                batch = batches[number - 1]
+            else:
+                batch = batches[0]
+            # Wait for a free slot before queueing another copy
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
             # Copy the file to the target directory
-            shutil.copy2(source_path, target_path)
-            # Store the mapping
-            relative_source_path = os.path.relpath(source_path, source_dir)
-            file_mapping[new_filename_with_ext] = relative_source_path
-            print(f"Copied: {relative_source_path} -> {new_filename_with_ext}")
-    # Write the mapping to a JSON file
-    with open(mapping_file_path, "w") as f:
-        json.dump(file_mapping, f, indent=4)
+            future = executor.submit(
+                _flatten_file,
+                entry.path,
+                relative_source_path,
+                new_filename_with_ext,
+                batch.sink,
+                meta,
+                batch.blobs,
+                sniff,
+            )
+            pending[future] = (relative_source_path, size, batch)
+        # Drain the remaining copies
+        collect(list(pending))
+        executor.shutdown()
+    except KeyboardInterrupt:
+        # Drop queued copies and journal whatever already finished
+        executor.shutdown(cancel_futures=True)
+        collect([future for future in list(pending) if not future.cancelled()])
+        for batch in batches:
+            batch.journal.close()
+        if quarantine is not None:
+            quarantine.close()
+        reporter.finish()
+        if archive:
+            sink.close()
+            print("\nInterrupted. The archive is incomplete and must be flattened again.")
+            raise
+        if split:
+            print("\nInterrupted. Run again with --resume to continue from the batch journals")
+        else:
+            print(
+                f"\nInterrupted. Run again with --resume to continue from {batches[0].journal_path}"
+            )
+        raise
+    metrics.add_phase_time("copy", time.perf_counter() - copy_started)
+    if quarantine is not None:
+        quarantine.close()
+    with metrics.phase("mapping"):
+        if archive:
+            # Embed the mapping in the last volume
+            batches[0].journal.close()
+            sink.close(batches[0].journal_path)
+        for batch in batches:
+            batch.finish(meta)
+        if split:
+            write_manifest(
+                mapping_file_path,
+                [
+                    {
+                        "batch": batch.name,
+                        "mapping": batch.mapping_file_path,
+                        "files": batch.files,
+                        "bytes": packed[1],
+                    }
+                    for batch, packed in zip(batches, packer.batches)
+                ],
+                meta=meta,
+                limits={"bytes": max_batch_bytes, "files": max_batch_files},
+            )
+    reporter.finish()
     print(f"\nFlattening complete. Mapping stored in {mapping_file_path}")
-    print(f"Total files processed: {len(file_mapping)}")
+    print(f"Total files processed: {files_recorded}")
+    if dedupe:
+        print(f"Unique blobs copied: {sum(len(batch.blobs) for batch in batches)}")
+    if archive:
+        print(f"Archive volumes written: {sink.volumes}")
+    else:
+        print(f"Placement: {placer.summary() or 'none'}")
+    if split:
+        print(f"Batches: {len(batches)}")
+        for batch, (_, packed_bytes) in zip(batches, packer.batches):
+            print(f"  - {batch.name}: {batch.files} files, {format_bytes(packed_bytes)}")
+    if quarantine is not None:
+        print_quarantine_summary(quarantine)
+    metrics.print_summary()
+    if failed:
+        print(f"Files that failed to copy: {len(failed)}")
+        for relative_source_path, e in failed:
+            print(f"  - {relative_source_path}: {e}")
 
 
-def unflatten_directory(flattened_dir, output_dir, mapping_file_path):
+def _restore_file(
+    source_file,
+    target_file,
+    placer,
+    keep_source=False,
+    after=None,
+    incremental=False,
+    verify_hash=False,
+):
+    """
+    Places one file at its original location. Runs inside a worker thread.
+
+    Args:
+        source_file (str): Path to the flattened (or already restored) file
+        target_file (str): Path to restore it to; its directory already exists
+        placer (Placer): Strategy used to put the file in place
+        keep_source (bool): The source is needed again afterwards
+        after (Future): Placement that must finish first because it produces
+                        source_file (rename strategy with shared blobs)
+        incremental (bool): Leave the target alone if it already matches
+        verify_hash (bool): Match by content hash instead of modification time
+
+    Returns:
+        tuple: (status, bytes restored, seconds it took), where status is
+               "restored", "unchanged" or "missing" (the source does not exist)
+    """
+    if after is not None:
+        wait([after])
+    start = time.perf_counter()
+    try:
+        if incremental and target_is_current(source_file, target_file, verify_hash):
+            return "unchanged", 0, time.perf_counter() - start
+        placer.place(source_file, target_file, keep_source=keep_source)
+    except FileNotFoundError:
+        # Only stat the source once something went wrong
+        if not os.path.exists(source_file):
+            return "missing", 0, time.perf_counter() - start
+        raise
+    seconds = time.perf_counter() - start
+    return "restored", os.stat(target_file).st_size, seconds
+
+
+def unflatten_directory(
+    flattened_dir,
+    output_dir,
+    mapping_file_path,
+    strategy="copy",
+    workers=1,
+    incremental=False,
+    verify_hash=False,
+    delete=False,
+    reporter=None,
+):
     """
     Unflattens a directory structure using a mapping file:
     1. Creates the original directory structure
     2. Copies files from the flattened directory to their original locations
 
+    If flattened_dir is an archive written by flatten_directory, the files
+    are restored straight from it using its embedded mapping.
+
+    Blobs from a content-addressed (dedupe) flatten are copied to every
+    original path recorded for them. The mapping is streamed entry by entry,
+    so either format can be restored without loading it into memory. The
+    manifest of a flatten split into sub-batches restores all of them.
+
+    The restore is planned first: one pass over the mapping collects the
+    unique directories, which are created once each, parents first. A second
+    pass dispatches the copies to a pool of worker threads.
+
+    An incremental restore only touches files that differ from an earlier
+    restore into the same output directory, and can delete files the mapping
+    no longer contains.
+
     Args:
-        flattened_dir (str): Path to the flattened directory
+        flattened_dir (str): Path to the flattened directory or archive
         output_dir (str): Path to the output directory
-        mapping_file_path (str): Path to the mapping JSON file
+        mapping_file_path (str): Path to the mapping file (.jsonl or legacy .json)
+        strategy (str): How files are placed, one of copy, hardlink, reflink,
+                        rename or auto (default: copy)
+        workers (int): Number of copier threads (default: 1, copies serially)
+        incremental (bool): Skip targets whose size and modification time
+                            already match the flattened file
+        verify_hash (bool): With incremental, compare contents by SHA-256
+                            instead of modification time
+        delete (bool): Remove files under output_dir that are not in the mapping
+        reporter (ProgressReporter): Receives progress and metrics (default: a
+                                     throttled status line on stdout)
     """
+    if reporter is None:
+        reporter = ProgressReporter(Metrics(), verb="Restored")
+    metrics = reporter.metrics
+
+    if is_archive_path(flattened_dir):
+        # Archives carry their own mapping and are restored as a stream
+        if not os.path.exists(flattened_dir):
+            print(f"Error: Archive {flattened_dir} does not exist.")
+            return
+        with metrics.phase("restore"):
+            files_processed = restore_archive(
+                flattened_dir,
+                output_dir,
+                on_restored=lambda name, path, size, seconds: reporter.file_done(
+                    name, path, size, seconds
+                ),
+            )
+        reporter.finish()
+        print(f"\nUnflattening complete. Files restored to {output_dir}")
+        print(f"Total files processed: {files_processed}")
+        metrics.print_summary()
+        return
+
+    placer = Placer(strategy)
+
     # Check if the mapping file exists
     if not os.path.exists(mapping_file_path):
         print(f"Error: Mapping file {mapping_file_path} does not exist.")
         return
 
-    # Load the mapping file
-    with open(mapping_file_path, "r") as f:
-        file_mapping = json.load(f)
-
     # Create output directory if it doesn't exist
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # Process each file in the mapping
+    # Plan: collect every directory the restore needs
+    with metrics.phase("plan"):
+        directories, entry_count = plan_directories(iter_mapping(mapping_file_path))
+
+    # Create the directory tree in a single pass
+    with metrics.phase("directories"):
+        mkdir_calls = create_directories(output_dir, directories)
+    if not delete:
+        del directories
+
+    # With the rename strategy a blob leaves the flattened directory on its
+    # first placement; later paths sharing it are copied from that restored file
+    moved_blobs = {}
+
     files_processed = 0
-    for uuid_filename, original_path in file_mapping.items():
-        # Source file in flattened directory
-        source_file = os.path.join(flattened_dir, uuid_filename)
+    unchanged = 0
+    missing = 0
+    # Every path the mapping restores, needed to find stale files (delete only)
+    expected_paths = set()
+    # Files that could not be restored, as (relative path, error) pairs
+    failed = []
+    # Copies that have been submitted but not collected yet
+    pending = {}
+    # Keep a few copies queued per worker so the mapping read never runs far ahead
+    max_pending = max(1, workers) * 4
 
-        # Target file in output directory
-        target_file = os.path.join(output_dir, original_path)
+    def collect(done):
+        nonlocal files_processed, unchanged, missing
+        for future in done:
+            uuid_filename, original_path = pending.pop(future)
+            try:
+                status, size, seconds = future.result()
+            except OSError as e:
+                failed.append((original_path, e))
+                metrics.count("errors")
+                reporter.message(f"Error: {original_path}: {e}")
+                continue
+            if status == "restored":
+                reporter.file_done(uuid_filename, original_path, size, seconds)
+                files_processed += 1
+            elif status == "unchanged":
+                metrics.count("unchanged")
+                unchanged += 1
+            else:
+                reporter.message(f"Warning: {uuid_filename} not found in flattened directory")
+                metrics.count("missing")
+                missing += 1
 
-        # Create the directory structure if it doesn't exist
-        os.makedirs(os.path.dirname(target_file), exist_ok=True)
+    # Stream the mapping entries again and dispatch the copies
+    with metrics.phase("copy"):
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            # The recorded layout (and batch, for a split flatten) says where
+            # each flattened file is stored
+            for uuid_filename, original_path, location in iter_mapping_locations(
+                mapping_file_path
+            ):
+                # Target file in output directory
+                target_file = os.path.join(output_dir, original_path)
 
-        # Copy the file if it exists
-        if os.path.exists(source_file):
-            shutil.copy2(source_file, target_file)
-            print(f"Restored: {uuid_filename} -> {original_path}")
-            files_processed += 1
-        else:
-            print(f"Warning: {uuid_filename} not found in flattened directory")
+                if uuid_filename in moved_blobs:
+                    # Copy from the location the blob was renamed to
+                    first_future, source_file = moved_blobs[uuid_filename]
+                    keep_source = True
+                else:
+                    # Source file in flattened directory
+                    source_file = os.path.join(flattened_dir, location)
+                    first_future = None
+                    keep_source = False
+                if delete:
+                    expected_paths.add(os.path.normpath(original_path))
 
+                # Wait for a free slot before queueing another copy
+                if len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                future = executor.submit(
+                    _restore_file,
+                    source_file,
+                    target_file,
+                    placer,
+                    keep_source,
+                    first_future,
+                    incremental,
+                    verify_hash,
+                )
+                pending[future] = (uuid_filename, original_path)
+                if strategy == "rename" and uuid_filename not in moved_blobs:
+                    moved_blobs[uuid_filename] = (future, target_file)
+            # Drain the remaining copies
+            collect(list(pending))
+
+    if delete:
+        # Remove what earlier restores left behind but the mapping dropped
+        with metrics.phase("delete"):
+            stale_files, stale_directories = delete_stale(
+                output_dir, expected_paths, directories, reporter
+            )
+
+    reporter.finish()
     print(f"\nUnflattening complete. Files restored to {output_dir}")
     print(f"Total files processed: {files_processed}")
+    if incremental:
+        print(f"Files already up to date: {unchanged}")
+    if delete:
+        print(f"Stale files deleted: {stale_files} (empty directories: {stale_directories})")
+    if missing:
+        print(f"Files missing from the flattened directory: {missing}")
+    print(f"Placement: {placer.summary() or 'none'}")
+    metrics.print_summary()
+    report_plan_savings(entry_count, mkdir_calls, metrics.phases["directories"])
+    if failed:
+        print(f"Files that failed to restore: {len(failed)}")
+        for original_path, e in failed:
+            print(f"  - {original_path}: {e}")
+
+
+def _parse_size(text):
+    """Parses a byte count with an optional K, M, G or T suffix (powers of 1024)."""
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
 
 
 if __name__ == "__main__":
@@ -119,7 +909,8 @@ if __name__ == "__main__":
     parser.add_argument(
         "-m",
         "--mapping",
-        help="Path for the mapping JSON file (default: ./VenueMarketableBatch2.json)",
+        help="Path for the mapping file; a .jsonl path selects the streaming "
+        "line-delimited format (default: ./VenueMarketableBatch2.json)",
         default="VenueMarketableBatch2.json",
     )
     parser.add_argument(
@@ -134,9 +925,173 @@ if __name__ == "__main__":
         help="Output directory for unflattened files (default: ./VenueMarketableBatch2_Restored)",
         default="VenueMarketableBatch2_Restored",
     )
+    parser.add_argument(
+        "-d",
+        "--dedupe",
+        action="store_true",
+        help="Name flattened files by content hash and copy duplicate files only once",
+    )
+    parser.add_argument(
+        "--strategy",
+        choices=STRATEGIES,
+        help="How files are placed: copy bytes, hardlink, reflink, rename (move) "
+        "or auto (probe for the cheapest that works) (default: copy)",
+        default="copy",
+    )
+    parser.add_argument(
+        "-f",
+        "--fanout",
+        type=int,
+        help="Spread flattened files over this many levels of subdirectories "
+        "named after their leading characters, e.g. ab/cd/<uuid>.ext (default: 0, flat)",
+        default=0,
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        metavar="PATTERN",
+        help="Only flatten files matching this gitignore-style pattern (repeatable)",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        metavar="PATTERN",
+        help="Skip files and directories matching this gitignore-style pattern, "
+        "e.g. .git/ or node_modules/ (repeatable; Thumbs.db is always skipped)",
+    )
+    parser.add_argument(
+        "--exclude-from",
+        action="append",
+        metavar="FILE",
+        help="Read exclude patterns from a gitignore-style file (repeatable)",
+    )
+    parser.add_argument(
+        "-a",
+        "--archive",
+        help="Stream flattened files into this .tar, .tar.gz, .tgz or .zip archive "
+        "instead of the target directory",
+        default=None,
+    )
+    parser.add_argument(
+        "--volume-size",
+        type=_parse_size,
+        help="Split the archive into volumes of at most this size, e.g. 4G or 500M",
+        default=None,
+    )
+    parser.add_argument(
+        "--max-batch-bytes",
+        type=_parse_size,
+        help="Split the flattened output into sub-batches (batch-0001, ...) of at most "
+        "this many bytes, e.g. 20G; each gets its own mapping shard",
+        default=None,
+    )
+    parser.add_argument(
+        "--max-batch-files",
+        type=int,
+        help="Split the flattened output into sub-batches of at most this many files",
+        default=None,
+    )
+    parser.add_argument(
+        "-r",
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted flatten from its journal instead of starting over",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="When unflattening, only restore files whose size or modification time "
+        "differs from what is already in the output directory",
+    )
+    parser.add_argument(
+        "--verify-hash",
+        action="store_true",
+        help="With --incremental, compare file contents by SHA-256 instead of "
+        "modification time",
+    )
+    parser.add_argument(
+        "--delete",
+        action="store_true",
+        help="When unflattening, delete files in the output directory that are "
+        "not in the mapping",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Flatten with an asyncio pipeline that overlaps listing, stat and copy "
+        "calls; faster on high-latency network filesystems (SMB, NFS)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="With --async, maximum number of filesystem calls in flight (default: 32)",
+        default=32,
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Instead of copying, hash every mapping entry on both sides and report "
+        "mismatched, missing and extra files: the flattened directory against the "
+        "source, or with -u against the output directory",
+    )
+    parser.add_argument(
+        "--record-digests",
+        action="store_true",
+        help="With --verify, store the verified SHA-256 digests in the .jsonl "
+        "mapping so later verifications only hash the tree",
+    )
+    parser.add_argument(
+        "--sniff",
+        action="store_true",
+        help="Tell each file's type from its first bytes while flattening, record it "
+        "in the .jsonl mapping and list files the upload would likely reject "
+        "(unsupported type, no extension, ...) in <mapping>.quarantine.jsonl",
+    )
+    parser.add_argument(
+        "--deterministic-names",
+        nargs="?",
+        const="",
+        metavar="SALT",
+        help="Name files by the UUIDv5 of their relative path and a salt instead of a "
+        "random UUID, so re-flattening gives the same names; the salt defaults to "
+        "the source directory's name and is recorded in the mapping",
+        default=None,
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="After flattening (or reconciling an existing mapping), keep watching "
+        "the source with inotify and apply created, modified, renamed and deleted "
+        "files to the flattened directory and mapping until interrupted (Linux only)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Number of parallel copier threads (default: 1)",
+        default=1,
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Print a line for every file instead of a periodic progress line",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        help="Write throughput metrics (phase times, latency histogram, "
+        "slowest files) to this JSON file",
+    )
 
     # Parse arguments
     args = parser.parse_args()
+    if args.fanout < 0:
+        parser.error("--fanout must be 0 or more")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
 
     # Get the current directory
     current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -147,17 +1102,137 @@ if __name__ == "__main__":
     mapping_file_path = os.path.abspath(args.mapping)
     output_directory = os.path.abspath(args.output)
 
+    # Collect exclude patterns from the command line and pattern files
+    exclude_patterns = list(args.exclude or [])
+    for pattern_file in args.exclude_from or []:
+        exclude_patterns.extend(load_patterns(pattern_file))
+
+    metrics = Metrics()
+
+    # Salt of path-derived names; None keeps random names
+    name_salt = args.deterministic_names
+    if name_salt == "":
+        name_salt = os.path.basename(source_directory)
+
+    if args.verify:
+        # Verify mode
+        flattened_directory = source_directory if args.unflatten else target_directory
+        tree_directory = output_directory if args.unflatten else source_directory
+        print(f"Flattened directory: {flattened_directory}")
+        print(f"Tree: {tree_directory}")
+        print(f"Mapping file: {mapping_file_path}")
+        print("-" * 50)
+        counts = verify_tree(
+            flattened_directory,
+            tree_directory,
+            mapping_file_path,
+            workers=args.workers,
+            record=args.record_digests,
+            include=None if args.unflatten else args.include,
+            exclude=None if args.unflatten else exclude_patterns,
+            reporter=ProgressReporter(metrics, verb="Verified", verbose=args.verbose),
+        )
+        if args.metrics_json:
+            metrics.write_json(os.path.abspath(args.metrics_json))
+        if counts is None or counts["mismatched"] or counts["missing"] or counts["extra"]:
+            sys.exit(1)
+        sys.exit(0)
+
     if args.unflatten:
         # Unflatten mode
         print(f"Flattened directory: {source_directory}")
         print(f"Output directory: {output_directory}")
         print(f"Mapping file: {mapping_file_path}")
         print("-" * 50)
-        unflatten_directory(source_directory, output_directory, mapping_file_path)
+        unflatten_directory(
+            source_directory,
+            output_directory,
+            mapping_file_path,
+            strategy=args.strategy,
+            workers=args.workers,
+            incremental=args.incremental,
+            verify_hash=args.verify_hash,
+            delete=args.delete,
+            reporter=ProgressReporter(metrics, verb="Restored", verbose=args.verbose),
+        )
     else:
         # Flatten mode
         print(f"Source directory: {source_directory}")
-        print(f"Target directory: {target_directory}")
+        if args.archive:
+            print(f"Archive: {os.path.abspath(args.archive)}")
+        else:
+            print(f"Target directory: {target_directory}")
         print(f"Mapping file: {mapping_file_path}")
         print("-" * 50)
-        flatten_directory(source_directory, target_directory, mapping_file_path)
+        split = args.max_batch_bytes or args.max_batch_files
+        if args.use_async and (args.archive or args.resume or split):
+            print(
+                "Error: --async cannot be combined with --archive, --resume or batch limits"
+            )
+            sys.exit(2)
+        if args.watch and (args.use_async or args.archive or args.resume or split or args.dedupe):
+            print(
+                "Error: --watch cannot be combined with --async, --archive, --resume, "
+                "--dedupe or batch limits"
+            )
+            sys.exit(2)
+        try:
+            if args.watch:
+                # Imported here: watch mode builds on this module
+                from watch import watch_directory
+
+                watch_directory(
+                    source_directory,
+                    target_directory,
+                    mapping_file_path,
+                    workers=args.workers,
+                    strategy=args.strategy,
+                    fanout=args.fanout,
+                    include=args.include,
+                    exclude=exclude_patterns,
+                    reporter=ProgressReporter(metrics, verb="Copied", verbose=args.verbose),
+                    salt=name_salt,
+                )
+            elif args.use_async:
+                # Imported here: the async pipeline builds on this module
+                from aflatten import flatten_directory_async
+
+                flatten_directory_async(
+                    source_directory,
+                    target_directory,
+                    mapping_file_path,
+                    concurrency=args.concurrency,
+                    dedupe=args.dedupe,
+                    strategy=args.strategy,
+                    fanout=args.fanout,
+                    include=args.include,
+                    exclude=exclude_patterns,
+                    reporter=ProgressReporter(metrics, verb="Copied", verbose=args.verbose),
+                    sniff=args.sniff,
+                    salt=name_salt,
+                )
+            else:
+                flatten_directory(
+                    source_directory,
+                    target_directory,
+                    mapping_file_path,
+                    workers=args.workers,
+                    dedupe=args.dedupe,
+                    strategy=args.strategy,
+                    resume=args.resume,
+                    fanout=args.fanout,
+                    include=args.include,
+                    exclude=exclude_patterns,
+                    archive=os.path.abspath(args.archive) if args.archive else None,
+                    volume_size=args.volume_size,
+                    reporter=ProgressReporter(metrics, verb="Copied", verbose=args.verbose),
+                    sniff=args.sniff,
+                    max_batch_bytes=args.max_batch_bytes,
+                    max_batch_files=args.max_batch_files,
+                    salt=name_salt,
+                )
+        except KeyboardInterrupt:
+            sys.exit(130)
+
+    if args.metrics_json:
+        metrics.write_json(os.path.abspath(args.metrics_json))
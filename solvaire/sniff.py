@@ -0,0 +1,238 @@
+import os
+import json
+import struct
+
+
+# Bytes read from the start of a file to tell its type
+SNIFF_BYTES = 4096
+
+# Suffix of the quarantine list written next to the mapping file
+QUARANTINE_SUFFIX = ".quarantine.jsonl"
+
+# Leading bytes of each recognised format: (offset, magic, type)
+SIGNATURES = (
+    (0, b"%PDF-", "pdf"),
+    (0, b"\x89PNG\r\n\x1a\n", "png"),
+    (0, b"\xff\xd8\xff", "jpeg"),
+    (0, b"GIF87a", "gif"),
+    (0, b"GIF89a", "gif"),
+    (0, b"II*\x00", "tiff"),
+    (0, b"MM\x00*", "tiff"),
+    (0, b"{\\rtf", "rtf"),
+    (0, b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "ole"),
+    (0, b"\x1f\x8b", "gzip"),
+    (0, b"7z\xbc\xaf\x27\x1c", "7z"),
+    (0, b"Rar!\x1a\x07", "rar"),
+    (0, b"\x7fELF", "elf"),
+    (4, b"ftyp", "video"),
+)
+
+# Two-byte signatures that plain text can start with too; only trusted
+# when the head also holds a NUL byte
+WEAK_SIGNATURES = (
+    (0, b"BM", "bmp"),
+    (0, b"MZ", "exe"),
+)
+
+# Types the upload accepts; everything else is quarantined
+SUPPORTED_TYPES = frozenset(
+    {
+        "pdf",
+        "docx",
+        "xlsx",
+        "pptx",
+        "ooxml",
+        "ole",
+        "rtf",
+        "text",
+        "html",
+        "xml",
+        "png",
+        "jpeg",
+        "gif",
+        "tiff",
+        "bmp",
+    }
+)
+
+# Types a file's content may have for its extension to be believable.
+# Extensions not listed here are not checked against the content.
+EXTENSION_TYPES = {
+    ".pdf": {"pdf"},
+    ".docx": {"docx", "ooxml"},
+    ".xlsx": {"xlsx", "ooxml"},
+    ".pptx": {"pptx", "ooxml"},
+    ".doc": {"ole", "rtf"},
+    ".xls": {"ole"},
+    ".ppt": {"ole"},
+    ".msg": {"ole"},
+    ".rtf": {"rtf"},
+    ".txt": {"text"},
+    ".csv": {"text"},
+    ".eml": {"text"},
+    ".htm": {"html", "text"},
+    ".html": {"html", "text"},
+    ".xml": {"xml", "text"},
+    ".png": {"png"},
+    ".jpg": {"jpeg"},
+    ".jpeg": {"jpeg"},
+    ".gif": {"gif"},
+    ".tif": {"tiff"},
+    ".tiff": {"tiff"},
+    ".bmp": {"bmp"},
+    ".zip": {"zip", "docx", "xlsx", "pptx", "ooxml"},
+}
+
+# Local file header of a zip member: signature ... name length at 26, name at 30
+_ZIP_HEADER = struct.Struct("<4s22xHH")
+
+# Office Open XML packages name their parts after the application
+_OOXML_PARTS = ((b"word/", "docx"), (b"xl/", "xlsx"), (b"ppt/", "pptx"))
+
+
+def _sniff_zip(head):
+    """Tells Office documents (which are zip packages) from plain archives."""
+    if len(head) < _ZIP_HEADER.size:
+        return "zip"
+    _, name_length, _ = _ZIP_HEADER.unpack_from(head)
+    first_member = head[_ZIP_HEADER.size : _ZIP_HEADER.size + name_length]
+    if first_member != b"[Content_Types].xml" and not first_member.startswith(
+        (b"word/", b"xl/", b"ppt/", b"_rels/", b"docProps/")
+    ):
+        return "zip"
+    for part, file_type in _OOXML_PARTS:
+        if part in head:
+            return file_type
+    # The application's parts start beyond the bytes read
+    return "ooxml"
+
+
+def _sniff_text(head):
+    """Classifies a head that has no binary signature: text, markup or binary."""
+    if head.startswith((b"\xff\xfe", b"\xfe\xff")):
+        # UTF-16 text, which never decodes as UTF-8
+        return "text"
+    if b"\x00" in head:
+        return "binary"
+    try:
+        text = head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # A multibyte character cut off by SNIFF_BYTES is still text
+        if e.start < len(head) - 3:
+            return "binary"
+        text = head[: e.start].decode("utf-8")
+    start = text.lstrip("\ufeff \t\r\n")[:256].lower()
+    if start.startswith("<?xml"):
+        return "html" if "<html" in start else "xml"
+    if start.startswith(("<!doctype html", "<html")):
+        return "html"
+    return "text"
+
+
+def sniff_type(head):
+    """
+    Tells a file's type from its first bytes.
+
+    Args:
+        head (bytes): Start of the file, at least SNIFF_BYTES if it is that long
+
+    Returns:
+        str: A type such as "pdf", "docx", "jpeg", "text", "zip", "binary"
+             or "empty"
+    """
+    if not head:
+        return "empty"
+    if head.startswith(b"PK\x03\x04"):
+        return _sniff_zip(head)
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return "webp"
+    for offset, magic, file_type in SIGNATURES:
+        if head.startswith(magic, offset):
+            return file_type
+    if b"\x00" in head:
+        for offset, magic, file_type in WEAK_SIGNATURES:
+            if head.startswith(magic, offset):
+                return file_type
+    return _sniff_text(head)
+
+
+def quarantine_reason(relative_source_path, file_type):
+    """
+    Decides whether a file is likely to be rejected by the upload.
+
+    Args:
+        relative_source_path (str): Path of the file relative to the source directory
+        file_type (str): Type found by sniff_type
+
+    Returns:
+        str: Why the file is quarantined, or None if it looks uploadable
+    """
+    if file_type == "empty":
+        return "empty file"
+    if file_type not in SUPPORTED_TYPES:
+        return f"unsupported type {file_type}"
+    _, extension = os.path.splitext(relative_source_path)
+    if not extension:
+        # The upload goes by the extension, so the content alone is not enough
+        return f"no extension (content is {file_type})"
+    expected = EXTENSION_TYPES.get(extension.lower())
+    if expected is not None and file_type not in expected:
+        return f"extension {extension} but content is {file_type}"
+    return None
+
+
+def quarantine_path_for(mapping_file_path):
+    """Returns the path of the quarantine list that belongs to a mapping file."""
+    return mapping_file_path + QUARANTINE_SUFFIX
+
+
+class QuarantineList:
+    """
+    Line-delimited list of flattened files that are likely to fail the
+    upload, with their original path, sniffed type and the reason, so they
+    can be held back or fixed before the batch goes out. The file is only
+    created once something is quarantined.
+    """
+
+    def __init__(self, path, resume=False):
+        """
+        Args:
+            path (str): Path to the quarantine list
+            resume (bool): Keep the entries of an interrupted run and append
+        """
+        self.path = path
+        self.count = 0
+        self._file = None
+        if resume and os.path.exists(path):
+            self.count = self._count_entries()
+            self._file = open(path, "a")
+        elif os.path.exists(path):
+            # Belongs to an earlier flatten of this mapping
+            os.remove(path)
+
+    def _count_entries(self):
+        """Counts the entries of an interrupted run, dropping a torn last line."""
+        count = 0
+        complete_bytes = 0
+        with open(self.path, "rb+") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                complete_bytes += len(line)
+                if line.strip():
+                    count += 1
+            f.truncate(complete_bytes)
+        return count
+
+    def add(self, name, relative_source_path, file_type, reason):
+        """Lists one flattened file."""
+        if self._file is None:
+            self._file = open(self.path, "w")
+        entry = {"name": name, "path": relative_source_path, "type": file_type, "reason": reason}
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
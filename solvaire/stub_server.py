@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Bytes of a request body read at a time
+READ_CHUNK_SIZE = 256 * 1024
+
+# Extensions rejected as unsupported by default, like the real upload
+DEFAULT_REJECTED_EXTENSIONS = (".exe", ".dll", ".bin", ".zip", ".7z", ".rar")
+
+
+class _Stats:
+    """Counters of a stub server, readable while it runs (GET /stats)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {
+            "connections": 0,
+            "requests": 0,
+            "stored": 0,
+            "bytes": 0,
+            "rejected": 0,
+            "failed": 0,
+        }
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, so clients can reuse their connections
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this every
+    # response waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.stats.count("connections")
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _reply(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _receive(self, length, target_file):
+        """Reads the request body, storing it if a target is given."""
+        remaining = length
+        out = open(target_file, "wb") if target_file else None
+        try:
+            while remaining > 0:
+                chunk = self.rfile.read(min(READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise ConnectionError("request body ended early")
+                if out is not None:
+                    out.write(chunk)
+                remaining -= len(chunk)
+        finally:
+            if out is not None:
+                out.close()
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._reply(200, self.server.stats.snapshot())
+        else:
+            self._reply(404, {"error": "Not found"})
+
+    def do_PUT(self):
+        server = self.server
+        server.stats.count("requests")
+        name = os.path.basename(urllib.parse.unquote(urllib.parse.urlsplit(self.path).path))
+        length = self.headers.get("Content-Length")
+        if not name or length is None:
+            self.close_connection = True
+            self._reply(411 if length is None else 400, {"error": "Bad request"})
+            return
+        temp_file = None
+        if server.store_dir:
+            temp_file = os.path.join(server.store_dir, f".{name}.{threading.get_ident()}.part")
+        # The body is always read, so the connection stays usable
+        self._receive(int(length), temp_file)
+        if server.latency:
+            time.sleep(server.latency)
+
+        _, extension = os.path.splitext(name)
+        if random.random() < server.fail_rate:
+            server.stats.count("failed")
+            status, payload = 503, {"error": "Service temporarily unavailable"}
+            headers = {"Retry-After": "0"}
+        elif extension.lower() in server.rejected_extensions or not extension:
+            server.stats.count("rejected")
+            status, payload = 415, {"error": f"Unsupported file type: {extension or 'none'}"}
+            headers = None
+        else:
+            server.stats.count("stored")
+            server.stats.count("bytes", int(length))
+            status, payload, headers = 201, {"name": name, "size": int(length)}, None
+            if temp_file:
+                os.replace(temp_file, os.path.join(server.store_dir, name))
+                temp_file = None
+        if temp_file:
+            os.remove(temp_file)
+        self._reply(status, payload, headers)
+
+
+def make_stub_server(
+    host="127.0.0.1",
+    port=0,
+    store_dir=None,
+    rejected_extensions=DEFAULT_REJECTED_EXTENSIONS,
+    fail_rate=0.0,
+    latency=0.0,
+    verbose=False,
+):
+    """
+    Builds a local stand-in for the upload service: files are PUT to
+    /<name>, and answered 201, 415 for unsupported types (by extension,
+    or none) or, at random, 503 with Retry-After to exercise retries. GET
+    /stats returns the counters, including how many connections clients
+    opened. Every connection gets its own thread.
+
+    Args:
+        host (str): Interface to listen on
+        port (int): Port to listen on; 0 picks a free one
+        store_dir (str): Keep accepted files here (default: discard them)
+        rejected_extensions (tuple): Extensions answered with 415
+        fail_rate (float): Share of uploads answered with 503
+        latency (float): Seconds added to every response
+        verbose (bool): Log every request to stderr
+
+    Returns:
+        ThreadingHTTPServer: The server, with its base URL in .url; call
+                             serve_forever (or start_stub_server)
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.stats = _Stats()
+    server.store_dir = store_dir
+    server.rejected_extensions = {extension.lower() for extension in rejected_extensions}
+    server.fail_rate = fail_rate
+    server.latency = latency
+    server.verbose = verbose
+    bound_host, bound_port = server.server_address[:2]
+    server.url = f"http://{bound_host}:{bound_port}/upload"
+    if store_dir:
+        os.makedirs(store_dir, exist_ok=True)
+    return server
+
+
+def start_stub_server(**options):
+    """
+    Starts a stub server (see make_stub_server) on a background thread, for
+    benchmarks and tests. Stop it with server.shutdown().
+    """
+    server = make_stub_server(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a local stand-in for the upload service, for tests and benchmarks."
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Interface (default: 127.0.0.1)")
+    parser.add_argument(
+        "-p", "--port", type=int, default=8765, help="Port, 0 for any free one (default: 8765)"
+    )
+    parser.add_argument("--store", help="Keep accepted files in this directory")
+    parser.add_argument(
+        "--reject",
+        action="append",
+        metavar="EXT",
+        help="Extension answered with 415 Unsupported (repeatable; default: "
+        + " ".join(DEFAULT_REJECTED_EXTENSIONS)
+        + ")",
+    )
+    parser.add_argument(
+        "--fail-rate",
+        type=float,
+        default=0.0,
+        help="Share of uploads answered with 503 to exercise retries (default: 0)",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added to every response"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    server = make_stub_server(
+        args.host,
+        args.port,
+        store_dir=os.path.abspath(args.store) if args.store else None,
+        rejected_extensions=tuple(args.reject) if args.reject else DEFAULT_REJECTED_EXTENSIONS,
+        fail_rate=args.fail_rate,
+        latency=args.latency,
+        verbose=args.verbose,
+    )
+    print(f"Stub upload server listening on {server.url}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats.snapshot()), file=sys.stderr)
@@ -0,0 +1,614 @@
+import os
+import sys
+import json
+import time
+import random
+import tarfile
+import zipfile
+import zlib
+import argparse
+import tempfile
+import threading
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from archive import MAPPING_MEMBER, is_archive_path, iter_volumes
+from progress import Metrics, ProgressReporter
+from walker import walk_files
+
+
+# Suffix of the error log written next to the uploaded directory or archive
+UPLOAD_ERRORS_SUFFIX = ".upload-errors.jsonl"
+
+# Attempts per file before it is logged as failed
+MAX_ATTEMPTS = 5
+
+# First retry delay in seconds; doubled per attempt, with jitter, up to BACKOFF_MAX
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+# Responses worth retrying: the server is busy or briefly failing, not
+# refusing the file
+RETRY_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+# Errors reading a corrupt or truncated archive member; retrying would read the
+# same bytes again, so the file fails at once
+ARCHIVE_READ_ERRORS = (zipfile.BadZipFile, tarfile.TarError, zlib.error)
+
+# Seconds a connection waits on the server before the attempt fails
+DEFAULT_TIMEOUT = 60.0
+
+# Bytes handed to the socket at a time while streaming a file
+SEND_BLOCK_SIZE = 256 * 1024
+
+# Members of a compressed tar are spooled in memory up to this size, on disk beyond
+SPOOL_MEMORY_BYTES = 8 * 1024 * 1024
+
+# Most bytes of an error response kept in the error log
+MAX_ERROR_BODY = 2048
+
+
+class _BoundedReader:
+    """Reads at most size bytes of a file from its current position."""
+
+    def __init__(self, f, size, close_file=True):
+        self._f = f
+        self._remaining = size
+        self._close_file = close_file
+
+    def read(self, amount=-1):
+        if amount is None or amount < 0 or amount > self._remaining:
+            amount = self._remaining
+        data = self._f.read(amount)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        if self._close_file:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _FileItem:
+    """A flattened file in a directory."""
+
+    def __init__(self, name, path, size):
+        self.name = name
+        self.size = size
+        self._path = path
+
+    def open(self):
+        return open(self._path, "rb")
+
+    def close(self):
+        pass
+
+
+class _TarMemberItem:
+    """A member of an uncompressed tar volume, read in place."""
+
+    def __init__(self, name, volume, offset, size):
+        self.name = name
+        self.size = size
+        self._volume = volume
+        self._offset = offset
+
+    def open(self):
+        f = open(self._volume, "rb")
+        f.seek(self._offset)
+        return _BoundedReader(f, self.size)
+
+    def close(self):
+        pass
+
+
+class _SpooledItem:
+    """A member of a compressed tar, copied out so a retry can read it again."""
+
+    def __init__(self, name, fileobj, size):
+        self.name = name
+        self.size = size
+        self._spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+        while True:
+            chunk = fileobj.read(SEND_BLOCK_SIZE)
+            if not chunk:
+                break
+            self._spool.write(chunk)
+
+    def open(self):
+        self._spool.seek(0)
+        return _BoundedReader(self._spool, self.size, close_file=False)
+
+    def close(self):
+        self._spool.close()
+
+
+class _ZipHandles:
+    """
+    Open zip volumes of one upload: every thread keeps its own handle per
+    volume, as a ZipFile must not be read by two threads at once. All of
+    them are closed together once the threads are done.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._opened = []
+        self._lock = threading.Lock()
+
+    def get(self, volume):
+        archives = getattr(self._local, "archives", None)
+        if archives is None:
+            archives = self._local.archives = {}
+        archive = archives.get(volume)
+        if archive is None:
+            archive = archives[volume] = zipfile.ZipFile(volume)
+            with self._lock:
+                self._opened.append(archive)
+        return archive
+
+    def close(self):
+        with self._lock:
+            opened, self._opened = self._opened, []
+        for archive in opened:
+            archive.close()
+
+
+class _ZipMemberItem:
+    """A member of a zip volume, read through the reading thread's handle."""
+
+    def __init__(self, name, volume, info, handles):
+        self.name = name
+        self.size = info.file_size
+        self._volume = volume
+        self._info = info
+        self._handles = handles
+
+    def open(self):
+        return self._handles.get(self._volume).open(self._info)
+
+    def close(self):
+        pass
+
+
+def iter_upload_items(source, zip_handles=None):
+    """
+    Lists the files to upload from a flattened directory (including fan-out
+    and sub-batch directories) or a flatten archive and all its volumes.
+    Archive members are never extracted to disk first: uncompressed tar and
+    zip members are read in place, compressed tar members, which can only
+    be read in order, are spooled one at a time as the upload reaches them.
+
+    Args:
+        source (str): Flattened directory, or the first volume of a flatten archive
+        zip_handles (_ZipHandles): Where zip members are opened; close it once
+                                   the items are uploaded (default: a new one)
+
+    Yields:
+        Items with a name, a size, open() returning a fresh binary reader
+        for every attempt, and close()
+    """
+    if zip_handles is None:
+        zip_handles = _ZipHandles()
+    if not is_archive_path(source):
+        for entry, _ in walk_files(source):
+            yield _FileItem(entry.name, entry.path, entry.stat().st_size)
+        return
+    for volume in iter_volumes(source):
+        if volume.endswith(".zip"):
+            with zipfile.ZipFile(volume) as archive:
+                infos = archive.infolist()
+            for info in infos:
+                if info.is_dir() or info.filename == MAPPING_MEMBER:
+                    continue
+                yield _ZipMemberItem(os.path.basename(info.filename), volume, info, zip_handles)
+        elif volume.endswith(".tar"):
+            with tarfile.open(volume, "r:") as archive:
+                members = archive.getmembers()
+            for member in members:
+                if member.isfile() and member.name != MAPPING_MEMBER:
+                    yield _TarMemberItem(
+                        os.path.basename(member.name), volume, member.offset_data, member.size
+                    )
+        else:
+            with tarfile.open(volume, "r|*") as archive:
+                for member in archive:
+                    if member.isfile() and member.name != MAPPING_MEMBER:
+                        yield _SpooledItem(
+                            os.path.basename(member.name),
+                            archive.extractfile(member),
+                            member.size,
+                        )
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections to the upload server, shared by the
+    upload threads. A connection goes back to the pool after every request
+    the server did not close, so a batch of small files costs a handful of
+    TCP (and TLS) handshakes instead of one per file.
+    """
+
+    def __init__(self, url, timeout=DEFAULT_TIMEOUT):
+        """
+        Args:
+            url (str): Base URL; files are PUT to <url>/<flattened name>
+            timeout (float): Socket timeout of every connection
+        """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme == "https":
+            self._connection_class = http.client.HTTPSConnection
+        elif parts.scheme == "http":
+            self._connection_class = http.client.HTTPConnection
+        else:
+            raise ValueError(f"Unsupported upload URL: {url}")
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip("/")
+        self.timeout = timeout
+        # Connections opened so far, to tell how well they were reused
+        self.opened = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def request_path(self, name):
+        return f"{self.base_path}/{urllib.parse.quote(name)}"
+
+    def acquire(self):
+        """
+        Returns:
+            tuple: (connection, True if it was used before and may have
+                   been closed by the server meanwhile)
+        """
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+            self.opened += 1
+        connection = self._connection_class(
+            self.host, self.port, timeout=self.timeout, blocksize=SEND_BLOCK_SIZE
+        )
+        return connection, False
+
+    def release(self, connection, reusable):
+        if not reusable:
+            connection.close()
+            return
+        with self._lock:
+            self._idle.append(connection)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+def _backoff(attempt, retry_after=None):
+    """Seconds to wait before the next attempt: exponential with jitter."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+    if retry_after is not None:
+        try:
+            delay = max(delay, min(BACKOFF_MAX, float(retry_after)))
+        except ValueError:
+            # An HTTP date; the exponential delay will do
+            pass
+    return delay
+
+
+def _upload_item(pool, item, headers, max_attempts):
+    """
+    Uploads one file, retrying connection errors and transient responses.
+
+    Returns:
+        dict: The flattened "name", "size", final "status" (None if no
+              response came), "error" (None on success), "attempts" and "seconds"
+    """
+    start = time.perf_counter()
+    attempt = 0
+    free_retry_used = False
+
+    def result(status, error):
+        return {
+            "name": item.name,
+            "size": item.size,
+            "status": status,
+            "error": error,
+            "attempts": attempt,
+            "seconds": time.perf_counter() - start,
+        }
+
+    while True:
+        attempt += 1
+        try:
+            body = item.open()
+        except (OSError, *ARCHIVE_READ_ERRORS) as e:
+            return result(None, f"{type(e).__name__}: {e}")
+        connection, reused = pool.acquire()
+        retry_after = None
+        try:
+            with body:
+                request_headers = dict(headers)
+                request_headers["Content-Length"] = str(item.size)
+                connection.request(
+                    "PUT", pool.request_path(item.name), body=body, headers=request_headers
+                )
+                response = connection.getresponse()
+                # Read the whole response so the connection can be reused
+                detail = response.read()
+            pool.release(connection, not response.will_close)
+        except ARCHIVE_READ_ERRORS as e:
+            pool.release(connection, False)
+            return result(None, f"{type(e).__name__}: {e}")
+        except (OSError, http.client.HTTPException) as e:
+            pool.release(connection, False)
+            if reused and not free_retry_used:
+                # The server likely closed the idle connection, which is not
+                # the file's fault; once only, so a failing server still
+                # runs out of attempts
+                free_retry_used = True
+                attempt -= 1
+                continue
+            status, error = None, f"{type(e).__name__}: {e}"
+        else:
+            status = response.status
+            if 200 <= status < 300:
+                error = None
+            else:
+                error = detail[:MAX_ERROR_BODY].decode("utf-8", "replace") or response.reason
+                retry_after = response.getheader("Retry-After")
+        retryable = error is not None and (status is None or status in RETRY_STATUSES)
+        if not retryable or attempt >= max_attempts:
+            return result(status, error)
+        time.sleep(_backoff(attempt, retry_after))
+
+
+def error_log_path_for(source):
+    """Returns the default error log path of an upload source."""
+    return source.rstrip(os.sep) + UPLOAD_ERRORS_SUFFIX
+
+
+def read_skip_list(quarantine_path):
+    """Reads the flattened names listed in a quarantine list (see sniff.py)."""
+    names = set()
+    with open(quarantine_path, "r") as f:
+        for line in f:
+            if line.strip():
+                names.add(json.loads(line)["name"])
+    return names
+
+
+def upload_files(
+    source,
+    url,
+    workers=8,
+    error_log_path=None,
+    headers=None,
+    max_attempts=MAX_ATTEMPTS,
+    timeout=DEFAULT_TIMEOUT,
+    skip=None,
+    reporter=None,
+):
+    """
+    Uploads a flattened directory or flatten archive: every file is PUT to
+    <url>/<flattened name>, streamed from disk (or from the archive) rather
+    than read into memory.
+
+    Uploads run on a pool of threads sharing keep-alive connections (see
+    ConnectionPool), with a bounded number of files in flight. Connection
+    errors and transient responses (429, 5xx) are retried with exponential
+    backoff and jitter, honouring Retry-After; other responses, such as 415
+    for an unsupported type, fail the file at once.
+
+    Every file that could not be uploaded gets a line in a JSONL error log
+    with its flattened "name", "status", "error" and "attempts". Pass the
+    log to convert_names.py --errors to see the original paths.
+
+    Args:
+        source (str): Flattened directory, or the first volume of a flatten archive
+        url (str): Base URL of the upload service
+        workers (int): Number of upload threads (and at most as many connections)
+        error_log_path (str): Where to log failures (default: next to the source)
+        headers (dict): Extra request headers, e.g. authorization
+        max_attempts (int): Attempts per file before it counts as failed
+        timeout (float): Socket timeout in seconds
+        skip (set): Flattened names not to upload, e.g. quarantined files
+        reporter (ProgressReporter): Receives progress and metrics
+
+    Returns:
+        dict: Counts of "uploaded", "failed" and "skipped" files, or None if
+              nothing could be uploaded
+    """
+    if reporter is None:
+        reporter = ProgressReporter(Metrics(), verb="Uploaded")
+    metrics = reporter.metrics
+    if not os.path.exists(source):
+        print(f"Error: {source} does not exist")
+        return None
+    try:
+        pool = ConnectionPool(url, timeout=timeout)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return None
+    if error_log_path is None:
+        error_log_path = error_log_path_for(source)
+    if os.path.exists(error_log_path):
+        # Belongs to an earlier upload of this source
+        os.remove(error_log_path)
+    request_headers = {"Content-Type": "application/octet-stream"}
+    request_headers.update(headers or {})
+    skip = skip or set()
+
+    counts = {"uploaded": 0, "failed": 0, "skipped": 0}
+    error_log = None
+    pending = {}
+    # Keep a couple of files queued per thread; also bounds spooled members
+    max_pending = max(1, workers) * 2
+
+    def collect(done):
+        # Only the main thread writes the error log
+        nonlocal error_log
+        for future in done:
+            item = pending.pop(future)
+            item.close()
+            result = future.result()
+            if result["attempts"] > 1:
+                metrics.count("retries", result["attempts"] - 1)
+            if result["error"] is None:
+                counts["uploaded"] += 1
+                reporter.file_done(
+                    item.name, pool.request_path(item.name), item.size, result["seconds"]
+                )
+                continue
+            counts["failed"] += 1
+            metrics.count("errors")
+            reporter.message(f"Error: {item.name}: {result['status'] or ''} {result['error']}")
+            if error_log is None:
+                error_log = open(error_log_path, "w")
+            entry = {key: result[key] for key in ("name", "status", "error", "attempts", "size")}
+            error_log.write(json.dumps(entry) + "\n")
+            error_log.flush()
+
+    zip_handles = _ZipHandles()
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        with metrics.phase("upload"):
+            for item in iter_upload_items(source, zip_handles):
+                if item.name in skip:
+                    counts["skipped"] += 1
+                    item.close()
+                    continue
+                while len(pending) >= max_pending:
+                    done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                    collect(done)
+                future = executor.submit(_upload_item, pool, item, request_headers, max_attempts)
+                pending[future] = item
+            while pending:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                collect(done)
+    finally:
+        executor.shutdown(cancel_futures=True)
+        zip_handles.close()
+        pool.close()
+        if error_log is not None:
+            error_log.close()
+
+    reporter.finish()
+    print("\nUpload complete.")
+    print(f"Files uploaded: {counts['uploaded']}")
+    print(f"Failed: {counts['failed']}")
+    if counts["skipped"]:
+        print(f"Skipped (quarantined): {counts['skipped']}")
+    print(f"Retries: {metrics.counters.get('retries', 0)}")
+    print(f"Connections opened: {pool.opened}")
+    if counts["failed"]:
+        print(f"Failures logged in {error_log_path}")
+    metrics.print_summary()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Upload a flattened directory or flatten archive over pooled "
+        "keep-alive HTTP connections."
+    )
+    parser.add_argument(
+        "-s",
+        "--source",
+        help="Flattened directory or archive to upload "
+        "(default: ./VenueMarketableBatch2_Flattened)",
+        default="VenueMarketableBatch2_Flattened",
+    )
+    parser.add_argument(
+        "-u",
+        "--url",
+        required=True,
+        help="Base URL of the upload service; each file is PUT to <url>/<name> "
+        "(stub_server.py runs a local stand-in)",
+    )
+    parser.add_argument(
+        "-H",
+        "--header",
+        action="append",
+        metavar="'NAME: VALUE'",
+        help="Extra request header, e.g. an authorization token (repeatable)",
+    )
+    parser.add_argument(
+        "--attempts",
+        type=int,
+        help=f"Attempts per file before it is logged as failed (default: {MAX_ATTEMPTS})",
+        default=MAX_ATTEMPTS,
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help=f"Socket timeout in seconds (default: {DEFAULT_TIMEOUT:g})",
+        default=DEFAULT_TIMEOUT,
+    )
+    parser.add_argument(
+        "-e",
+        "--error-log",
+        help="JSONL log of failed files, readable by convert_names.py --errors "
+        f"(default: <source>{UPLOAD_ERRORS_SUFFIX})",
+        default=None,
+    )
+    parser.add_argument(
+        "-q",
+        "--skip-quarantined",
+        metavar="QUARANTINE_LIST",
+        help="Do not upload the files listed in this quarantine list "
+        "(<mapping>.quarantine.jsonl from a flatten with --sniff)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Number of parallel uploads and pooled connections (default: 8)",
+        default=8,
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Print a line for every file instead of a periodic progress line",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        help="Write throughput metrics (latency histogram, slowest files) to this JSON file",
+    )
+    args = parser.parse_args()
+
+    extra_headers = {}
+    for header in args.header or []:
+        key, separator, value = header.partition(":")
+        if not separator:
+            print(f"Error: Header {header!r} is not of the form 'Name: value'")
+            sys.exit(2)
+        extra_headers[key.strip()] = value.strip()
+
+    skip_names = set()
+    if args.skip_quarantined:
+        skip_names = read_skip_list(os.path.abspath(args.skip_quarantined))
+
+    metrics = Metrics()
+    try:
+        counts = upload_files(
+            os.path.abspath(args.source),
+            args.url,
+            workers=args.workers,
+            error_log_path=os.path.abspath(args.error_log) if args.error_log else None,
+            headers=extra_headers,
+            max_attempts=max(1, args.attempts),
+            timeout=args.timeout,
+            skip=skip_names,
+            reporter=ProgressReporter(metrics, verb="Uploaded", verbose=args.verbose),
+        )
+    except KeyboardInterrupt:
+        sys.exit(130)
+    if args.metrics_json:
+        metrics.write_json(os.path.abspath(args.metrics_json))
+    sys.exit(0 if counts is not None and not counts["failed"] else 1)
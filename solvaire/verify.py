@@ -0,0 +1,173 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from digest import hash_file
+from mapping import (
+    flat_location,
+    is_jsonl_mapping,
+    iter_mapping_digests,
+    read_manifest,
+    read_mapping_meta,
+    record_digests,
+)
+from progress import Metrics, ProgressReporter
+from walker import walk_files
+
+
+def _hash_or_none(path):
+    """Hashes a file, or returns None if it does not exist."""
+    try:
+        return hash_file(path)
+    except FileNotFoundError:
+        return None
+
+
+def verify_tree(
+    flattened_dir,
+    tree_dir,
+    mapping_file_path,
+    workers=4,
+    record=False,
+    include=None,
+    exclude=None,
+    reporter=None,
+):
+    """
+    Checks that a tree (the flatten source or an unflatten output) and the
+    flattened directory hold the same bytes for every mapping entry.
+
+    Both sides are hashed concurrently in a thread pool, with a bounded
+    number of files in flight; each file is read in fixed-size chunks, so
+    memory stays flat however large the files are. A blob shared by several
+    entries (content-addressed mode) is hashed once. Entries that carry a
+    digest recorded by an earlier verification only hash the tree side.
+    The manifest of a flatten split into sub-batches checks every batch
+    directory against its own mapping shard.
+
+    Args:
+        flattened_dir (str): Path to the flattened directory
+        tree_dir (str): Path to the source or restored directory tree
+        mapping_file_path (str): Path to the mapping file
+        workers (int): Number of hashing threads
+        record (bool): Store the verified digests in the (JSONL) mapping
+        include (list): Patterns limiting which tree files count as extra
+        exclude (list): Patterns of tree files never reported as extra
+        reporter (ProgressReporter): Receives progress and metrics
+
+    Returns:
+        dict: Counts of "verified", "mismatched", "missing" and "extra" files
+    """
+    if reporter is None:
+        reporter = ProgressReporter(Metrics(), verb="Verified")
+    metrics = reporter.metrics
+
+    if not os.path.exists(mapping_file_path):
+        print(f"Error: Mapping file {mapping_file_path} does not exist")
+        return None
+    manifest = read_manifest(mapping_file_path)
+    if manifest is None:
+        # (flattened directory, mapping) pairs to check
+        parts = [(flattened_dir, mapping_file_path)]
+    else:
+        parts = [
+            (os.path.join(flattened_dir, shard["batch"]), shard["mapping"])
+            for shard in manifest["shards"]
+        ]
+    if record and not all(is_jsonl_mapping(part_mapping) for _, part_mapping in parts):
+        print("Error: Digests can only be recorded in a .jsonl mapping")
+        return None
+
+    counts = {"verified": 0, "mismatched": 0, "missing": 0, "extra": 0}
+    expected_paths = set()
+    expected_names = set()
+    # Names only checked against a recorded digest; their blobs are merely
+    # looked for in the flattened directory
+    recorded_names = set()
+    # Flattened filename -> future hashing its blob, shared by all its entries
+    blob_hashes = {}
+    # Flattened filename -> digest confirmed on both sides
+    verified_digests = {}
+    # Each pending entry holds two futures; keep the pool reasonably busy
+    max_pending = max(1, workers) * 2
+    pending = {}
+
+    def report(status, text):
+        counts[status] += 1
+        metrics.count(status)
+        reporter.message(text)
+
+    def collect(tree_future):
+        name, original_path, tree_file, blob, recorded = pending.pop(tree_future)
+        tree_digest = tree_future.result()
+        flat_digest = recorded if blob is None else blob.result()
+        if flat_digest is None:
+            report("missing", f"Missing: {name} (flattened, for {original_path})")
+        elif tree_digest is None:
+            report("missing", f"Missing: {original_path}")
+        elif tree_digest != flat_digest:
+            report("mismatched", f"Mismatch: {original_path} ({name})")
+        else:
+            counts["verified"] += 1
+            verified_digests[name] = tree_digest
+            try:
+                size = os.path.getsize(tree_file)
+            except OSError:
+                size = 0
+            reporter.file_done(original_path, name, size, 0.0)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        with metrics.phase("hash"):
+            for part_dir, part_mapping in parts:
+                meta = read_mapping_meta(part_mapping)
+                # Batches dedupe separately, so a blob is only shared within one
+                blob_hashes.clear()
+                for name, original_path, recorded in iter_mapping_digests(part_mapping):
+                    expected_paths.add(original_path)
+                    expected_names.add(name)
+                    tree_file = os.path.join(tree_dir, original_path)
+                    blob = None
+                    if recorded is not None:
+                        recorded_names.add(name)
+                    else:
+                        blob = blob_hashes.get(name)
+                        if blob is None:
+                            flat_file = os.path.join(part_dir, flat_location(name, meta))
+                            blob = executor.submit(_hash_or_none, flat_file)
+                            blob_hashes[name] = blob
+                    while len(pending) >= max_pending:
+                        done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                        for future in done:
+                            collect(future)
+                    future = executor.submit(_hash_or_none, tree_file)
+                    pending[future] = (name, original_path, tree_file, blob, recorded)
+            while pending:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+
+    # Files in the tree the mapping does not account for
+    with metrics.phase("extra"):
+        for _, relative_path in walk_files(tree_dir, include=include, exclude=exclude):
+            if relative_path not in expected_paths:
+                report("extra", f"Extra: {relative_path}")
+        for entry, relative_path in walk_files(flattened_dir):
+            if entry.name not in expected_names:
+                report("extra", f"Extra: {relative_path} (flattened)")
+            recorded_names.discard(entry.name)
+        for name in sorted(recorded_names):
+            report("missing", f"Missing: {name} (flattened)")
+
+    if record:
+        with metrics.phase("record"):
+            for _, part_mapping in parts:
+                record_digests(part_mapping, verified_digests)
+    reporter.finish()
+    print("\nVerification complete.")
+    print(f"Files verified: {counts['verified']}")
+    print(f"Mismatched: {counts['mismatched']}")
+    print(f"Missing: {counts['missing']}")
+    print(f"Extra: {counts['extra']}")
+    if record:
+        print(f"Digests recorded in {mapping_file_path}: {len(verified_digests)}")
+    metrics.print_summary()
+    return counts
@@ -0,0 +1,223 @@
+import os
+import re
+
+
+# Patterns excluded from every walk unless a later "!" pattern re-includes them
+DEFAULT_EXCLUDES = ("Thumbs.db",)
+
+
+def _translate(pattern):
+    """Translates the glob part of a gitignore-style pattern into a regex."""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            # Zero or more leading directories
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            # Everything below this point
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                parts.append(re.escape("["))
+                i += 1
+                continue
+            body = pattern[i + 1 : end].replace("\\", "\\\\")
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            parts.append(f"[{body}]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(parts)
+
+
+def compile_glob(pattern):
+    """
+    Compiles a glob matched against whole relative paths: "*", "?" and
+    "[...]" stay within one path component, "**" spans several.
+
+    Returns:
+        re.Pattern: Regex that fully matches the paths the glob selects
+    """
+    return re.compile(_translate(pattern.lstrip("/")) + r"\Z", re.DOTALL)
+
+
+class _Rule:
+    """One compiled gitignore-style pattern."""
+
+    def __init__(self, pattern):
+        self.negated = pattern.startswith("!")
+        if self.negated:
+            pattern = pattern[1:]
+        self.directory_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        # A slash anywhere but the end anchors the pattern to the walk root;
+        # otherwise it matches the name at any depth
+        self.anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+        self.regex = re.compile(_translate(pattern) + r"\Z", re.DOTALL)
+
+    def matches(self, relative_path, name, is_dir):
+        if self.directory_only and not is_dir:
+            return False
+        if self.anchored:
+            return self.regex.match(relative_path) is not None
+        return self.regex.match(name) is not None
+
+
+class PathMatcher:
+    """
+    Matches relative paths against gitignore-style patterns:
+
+    - "*", "?" and "[...]" match within one path component, "**" across them
+    - a pattern containing "/" is anchored to the walk root, otherwise it
+      matches the file or directory name at any depth
+    - a trailing "/" only matches directories
+    - a leading "!" re-includes what an earlier pattern matched; the last
+      matching pattern wins
+    """
+
+    def __init__(self, patterns):
+        self.rules = [
+            _Rule(pattern)
+            for pattern in (p.strip() for p in patterns)
+            if pattern and not pattern.startswith("#")
+        ]
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def matches(self, relative_path, is_dir=False):
+        """
+        Args:
+            relative_path (str): Path relative to the walk root, "/"-separated
+            is_dir (bool): Whether the path is a directory
+
+        Returns:
+            bool: True if the last pattern that applies is not a negation
+        """
+        name = relative_path.rsplit("/", 1)[-1]
+        matched = False
+        for rule in self.rules:
+            if rule.matches(relative_path, name, is_dir):
+                matched = not rule.negated
+        return matched
+
+
+def load_patterns(path):
+    """
+    Reads patterns from a gitignore-style file (one per line, "#" comments).
+
+    Args:
+        path (str): Path to the pattern file
+
+    Returns:
+        list: The patterns in file order
+    """
+    with open(path, "r") as f:
+        return [line.rstrip("\n") for line in f]
+
+
+def make_matchers(include=None, exclude=None):
+    """
+    Compiles include and exclude patterns for scan_directory.
+
+    Returns:
+        tuple: (include PathMatcher, exclude PathMatcher including DEFAULT_EXCLUDES)
+    """
+    include_matcher = PathMatcher(include or ())
+    exclude_matcher = PathMatcher(list(DEFAULT_EXCLUDES) + list(exclude or ()))
+    return include_matcher, exclude_matcher
+
+
+def scan_directory(directory, prefix, include_matcher, exclude_matcher):
+    """
+    Lists one directory with os.scandir and applies the patterns.
+
+    Args:
+        directory (str): Full path of the directory to list
+        prefix (str): Its path relative to the walk root, ending in os.sep (or "")
+        include_matcher (PathMatcher): Patterns a file must match, may be empty
+        exclude_matcher (PathMatcher): Patterns of files and directories to skip
+
+    Returns:
+        tuple: (list of (os.DirEntry, relative path) for the files to process,
+                list of (full path, relative prefix) for the subdirectories to visit)
+
+    Raises:
+        OSError: If the directory cannot be listed
+    """
+    files = []
+    subdirectories = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            relative_path = prefix + entry.name
+            # Patterns are written with "/" on every platform
+            pattern_path = relative_path.replace(os.sep, "/")
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if exclude_matcher.matches(pattern_path, is_dir):
+                continue
+            if is_dir:
+                if not entry.is_symlink():
+                    subdirectories.append((entry.path, relative_path + os.sep))
+                continue
+            if include_matcher and not include_matcher.matches(pattern_path):
+                continue
+            files.append((entry, relative_path))
+    return files, subdirectories
+
+
+def walk_files(root, include=None, exclude=None, onerror=None):
+    """
+    Walks a directory tree with os.scandir and yields every file to process.
+
+    Excluded directories are pruned before they are opened, so large
+    subtrees such as .git or node_modules cost a single directory entry.
+    File type checks reuse the information scandir already returned, and
+    callers can get cached stat data from the yielded DirEntry. Like os.walk,
+    symlinked directories are not descended into.
+
+    Args:
+        root (str): Directory to walk
+        include (list): Patterns a file must match to be yielded (default: all files)
+        exclude (list): Patterns of files and directories to skip, applied
+                        after DEFAULT_EXCLUDES
+        onerror (callable): Called with the OSError when a directory cannot be
+                            listed; errors are ignored if not given
+
+    Yields:
+        tuple: (os.DirEntry, relative path using the platform separator)
+    """
+    include_matcher, exclude_matcher = make_matchers(include, exclude)
+    # Directories still to visit as (full path, relative prefix) pairs
+    stack = [(root, "")]
+    while stack:
+        directory, prefix = stack.pop()
+        try:
+            files, subdirectories = scan_directory(
+                directory, prefix, include_matcher, exclude_matcher
+            )
+        except OSError as e:
+            if onerror is not None:
+                onerror(e)
+            continue
+        yield from files
+        # Visit subdirectories in listing order, depth first like os.walk
+        stack.extend(reversed(subdirectories))
@@ -0,0 +1,510 @@
+import os
+import sys
+import time
+import uuid
+import ctypes
+import select
+import struct
+import ctypes.util
+
+from mapping import (
+    flat_location,
+    is_jsonl_mapping,
+    iter_mapping,
+    read_manifest,
+    read_mapping_meta,
+    write_json_mapping,
+    write_jsonl_mapping,
+)
+from naming import naming_salt, path_name
+from placement import Placer
+from restore import target_is_current
+from script import _remove_orphans, flatten_directory
+from walker import make_matchers, scan_directory
+
+
+# inotify event bits, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+# Events subscribed to on every directory of the source tree
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+)
+
+# Fixed part of an event record: watch descriptor, mask, cookie, name length
+_EVENT = struct.Struct("iIII")
+
+# Bytes read from the inotify descriptor at once (many events per read)
+READ_SIZE = 64 * 1024
+
+# Seconds without events before pending changes are applied, so a file
+# being written is copied once it is complete rather than on every write
+QUIET_PERIOD = 0.5
+
+# Longest a change waits while events keep arriving
+MAX_DELAY = 5.0
+
+# Suffix of the temporary copy that replaces a flattened file atomically
+TEMP_SUFFIX = ".watch-tmp"
+
+
+class Inotify:
+    """Minimal inotify(7) binding through ctypes, so no extra package is needed."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path, mask):
+        """
+        Watches a directory; watching it again returns the same descriptor.
+
+        Raises:
+            OSError: If the directory is gone or the watch limit is reached
+        """
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def rm_watch(self, wd):
+        # Fails harmlessly when the kernel already dropped the watch
+        self._rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """
+        Waits up to timeout seconds for events.
+
+        Returns:
+            list: (watch descriptor, mask, cookie, name) tuples, possibly empty
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, READ_SIZE)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _is_below(relative_path, directory):
+    return relative_path.startswith(directory + os.sep)
+
+
+class _Mirror:
+    """
+    A flattened directory and its mapping, kept in memory as relative
+    source path -> flattened filename. A file keeps its flattened name for
+    as long as it exists, through edits and renames; only new files get a
+    new UUID. With path-derived names (see naming.py) the name follows the
+    path instead, so a renamed file is renamed in the mirror too.
+    """
+
+    def __init__(self, source_dir, target_dir, mapping_file_path, placer):
+        self.source_dir = source_dir
+        self.target_dir = target_dir
+        self.mapping_file_path = mapping_file_path
+        self.placer = placer
+        self.meta = read_mapping_meta(mapping_file_path)
+        self.salt = naming_salt(self.meta)
+        self.paths = {}
+        for name, relative_source_path in iter_mapping(mapping_file_path):
+            self.paths[relative_source_path] = name
+        if len(set(self.paths.values())) != len(self.paths):
+            raise ValueError("the mapping shares flattened files between paths (--dedupe)")
+        # The mapping on disk is behind the in-memory state
+        self.changed = False
+        self.counts = {"added": 0, "updated": 0, "renamed": 0, "deleted": 0}
+
+    def _target(self, name):
+        return os.path.join(self.target_dir, flat_location(name, self.meta))
+
+    def sync_file(self, relative_source_path, force=True):
+        """
+        Copies a new or changed file into the mirror.
+
+        Args:
+            relative_source_path (str): Path of the file relative to the source directory
+            force (bool): Copy even if size and modification time look current
+        """
+        source_path = os.path.join(self.source_dir, relative_source_path)
+        if not os.path.isfile(source_path) or os.path.islink(source_path):
+            # Gone again before the change was applied, or not a regular file
+            return
+        name = self.paths.get(relative_source_path)
+        if name is None:
+            if self.salt is not None:
+                name = path_name(relative_source_path, self.salt)
+            else:
+                _, file_extension = os.path.splitext(relative_source_path)
+                name = str(uuid.uuid4()) + file_extension
+            action = "added"
+        elif not force and target_is_current(source_path, self._target(name)):
+            return
+        else:
+            action = "updated"
+        target_path = self._target(name)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        temp_path = target_path + TEMP_SUFFIX
+        self.placer.place(source_path, temp_path, keep_source=True)
+        os.replace(temp_path, target_path)
+        if action == "added":
+            self.paths[relative_source_path] = name
+            self.changed = True
+        self.counts[action] += 1
+        print(f"{'+' if action == 'added' else '~'} {relative_source_path} -> {name}")
+
+    def rename(self, old_path, new_path):
+        """
+        Follows a file rename. A file renamed over another one takes the
+        replaced file's name, so a path keeps its UUID across editors'
+        write-then-rename saves.
+
+        Returns:
+            bool: False if the old path was not mirrored yet
+        """
+        name = self.paths.pop(old_path, None)
+        if name is None:
+            return False
+        new_name = self.paths.get(new_path)
+        if self.salt is not None:
+            new_name = path_name(new_path, self.salt)
+        if new_name is not None and new_name != name:
+            target_path = self._target(new_name)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            os.replace(self._target(name), target_path)
+            name = new_name
+        self.paths[new_path] = name
+        print(f"> {old_path} -> {new_path} ({name})")
+        self.counts["renamed"] += 1
+        self.changed = True
+        return True
+
+    def rename_tree(self, old_directory, new_directory):
+        """Follows a directory rename; random flattened names stay as they are."""
+        for old_path in [path for path in self.paths if _is_below(path, old_directory)]:
+            new_path = new_directory + old_path[len(old_directory) :]
+            if self.salt is not None:
+                self.rename(old_path, new_path)
+                continue
+            self.paths[new_path] = self.paths.pop(old_path)
+            self.counts["renamed"] += 1
+            self.changed = True
+        print(f"> {old_directory}{os.sep} -> {new_directory}{os.sep}")
+
+    def delete(self, relative_source_path):
+        name = self.paths.pop(relative_source_path, None)
+        if name is None:
+            return
+        try:
+            os.remove(self._target(name))
+        except FileNotFoundError:
+            pass
+        self.counts["deleted"] += 1
+        self.changed = True
+        print(f"- {relative_source_path} ({name})")
+
+    def delete_tree(self, directory):
+        for path in [path for path in self.paths if _is_below(path, directory)]:
+            self.delete(path)
+
+    def reconcile(self, include_matcher, exclude_matcher):
+        """
+        Brings the mirror in line with the source tree after changes that
+        were not watched: while no watcher ran, or when events were lost.
+        """
+        present = set()
+        directories = [(self.source_dir, "")]
+        while directories:
+            directory, prefix = directories.pop()
+            try:
+                files, subdirectories = scan_directory(
+                    directory, prefix, include_matcher, exclude_matcher
+                )
+            except OSError as e:
+                print(f"Error: Cannot list {directory}: {e}")
+                continue
+            for _, relative_path in files:
+                present.add(relative_path)
+                try:
+                    self.sync_file(relative_path, force=False)
+                except OSError as e:
+                    print(f"Error: {relative_path}: {e}")
+            directories.extend(subdirectories)
+        for relative_path in [path for path in self.paths if path not in present]:
+            self.delete(relative_path)
+        _remove_orphans(self.target_dir, set(self.paths.values()))
+
+    def write_mapping(self):
+        """Rewrites the mapping (atomically) if anything changed."""
+        if not self.changed:
+            return
+        entries = sorted((name, path) for path, name in self.paths.items())
+        if is_jsonl_mapping(self.mapping_file_path):
+            write_jsonl_mapping(entries, self.mapping_file_path, meta=self.meta)
+        else:
+            write_json_mapping(entries, self.mapping_file_path, meta=self.meta)
+        self.changed = False
+
+
+def watch_directory(
+    source_dir,
+    target_dir,
+    mapping_file_path,
+    workers=1,
+    strategy="copy",
+    fanout=0,
+    include=None,
+    exclude=None,
+    reporter=None,
+    salt=None,
+):
+    """
+    Keeps a flattened mirror of a directory in sync until interrupted.
+
+    The first run flattens the whole tree; with an existing mapping the
+    mirror is reconciled with the tree instead. After that the tree is
+    watched with inotify and only created, modified, renamed and deleted
+    files are applied to the flattened directory and the mapping, once
+    they have been quiet for QUIET_PERIOD. Unchanged files, and renamed
+    ones, keep their flattened names. If the kernel drops events (queue
+    overflow) the mirror is reconciled again.
+
+    Args:
+        source_dir (str): Path to the directory to mirror
+        target_dir (str): Path to the flattened directory
+        mapping_file_path (str): Path to the mapping file (.json or .jsonl)
+        workers (int): Number of copier threads for the initial flatten
+        strategy (str): Placement strategy (rename is not allowed)
+        fanout (int): Levels of fan-out subdirectories for a new mirror
+        include (list): Patterns a file must match to be mirrored
+        exclude (list): Patterns of files and directories to skip
+        reporter (ProgressReporter): Receives progress of the initial flatten
+        salt (str): Name files of a new mirror by the UUIDv5 of their path
+                    and this salt; an existing mapping keeps its own naming
+    """
+    if not sys.platform.startswith("linux"):
+        print("Error: Watch mode needs inotify, which is only available on Linux")
+        return
+    if strategy == "rename":
+        print("Error: Watch mode cannot move files out of the watched tree (--strategy rename)")
+        return
+    if not os.path.isdir(source_dir):
+        print(f"Error: Source directory {source_dir} does not exist")
+        return
+    if os.path.exists(mapping_file_path) and read_manifest(mapping_file_path) is not None:
+        print("Error: Watch mode cannot keep a flatten split into sub-batches in sync")
+        return
+
+    include_matcher, exclude_matcher = make_matchers(include, exclude)
+    inotify = Inotify()
+    # Watch descriptor -> watched directory, relative to the source ("" for the root)
+    watches = {}
+
+    def selected(relative_path, is_dir):
+        # Patterns are written with "/" on every platform
+        pattern_path = relative_path.replace(os.sep, "/")
+        if exclude_matcher.matches(pattern_path, is_dir):
+            return False
+        return is_dir or not include_matcher or include_matcher.matches(pattern_path)
+
+    def add_tree(relative_directory):
+        """Watches a directory and all below it; returns the files found in it."""
+        found = []
+        directories = [relative_directory]
+        while directories:
+            relative = directories.pop()
+            directory = os.path.join(source_dir, relative) if relative else source_dir
+            try:
+                watches[inotify.add_watch(directory, WATCH_MASK)] = relative
+                prefix = relative + os.sep if relative else ""
+                files, subdirectories = scan_directory(
+                    directory, prefix, include_matcher, exclude_matcher
+                )
+            except OSError as e:
+                print(f"Error: Cannot watch {directory}: {e}")
+                continue
+            found.extend(relative_path for _, relative_path in files)
+            directories.extend(prefix[:-1] for _, prefix in subdirectories)
+        return found
+
+    def remove_tree(relative_directory):
+        for wd, relative in list(watches.items()):
+            if relative == relative_directory or _is_below(relative, relative_directory):
+                inotify.rm_watch(wd)
+                del watches[wd]
+
+    # Watch first, so nothing that changes during the initial pass is missed
+    print("Watching source tree...")
+    add_tree("")
+    placer = Placer(strategy)
+    if not os.path.exists(mapping_file_path):
+        flatten_directory(
+            source_dir,
+            target_dir,
+            mapping_file_path,
+            workers=workers,
+            strategy=strategy,
+            fanout=fanout,
+            include=include,
+            exclude=exclude,
+            reporter=reporter,
+            salt=salt,
+        )
+        if not os.path.exists(mapping_file_path):
+            inotify.close()
+            return
+    try:
+        mirror = _Mirror(source_dir, target_dir, mapping_file_path, placer)
+    except ValueError as e:
+        print(f"Error: Watch mode cannot keep this mapping in sync: {e}")
+        inotify.close()
+        return
+    print("Reconciling mirror with source tree...")
+    mirror.reconcile(include_matcher, exclude_matcher)
+    mirror.write_mapping()
+    print(f"Watching {source_dir} ({len(mirror.paths)} files); press Ctrl-C to stop")
+
+    # Files to copy once events settle
+    dirty = set()
+    # Cookie -> (relative path, is directory) of renames awaiting their other half
+    moves = {}
+    overflowed = False
+    pending_since = None
+
+    def flush():
+        nonlocal overflowed
+        # A rename without its other half moved the path out of the tree
+        for relative_path, is_dir in moves.values():
+            if is_dir:
+                remove_tree(relative_path)
+                mirror.delete_tree(relative_path)
+            else:
+                mirror.delete(relative_path)
+        moves.clear()
+        if overflowed:
+            print("Warning: Events were lost; reconciling mirror with source tree")
+            watches.clear()
+            add_tree("")
+            mirror.reconcile(include_matcher, exclude_matcher)
+            overflowed = False
+            dirty.clear()
+        for relative_path in sorted(dirty):
+            try:
+                mirror.sync_file(relative_path)
+            except OSError as e:
+                print(f"Error: {relative_path}: {e}")
+        dirty.clear()
+        mirror.write_mapping()
+
+    try:
+        while True:
+            events = inotify.read(QUIET_PERIOD)
+            for wd, mask, cookie, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                    continue
+                if mask & IN_IGNORED:
+                    watches.pop(wd, None)
+                    continue
+                directory = watches.get(wd)
+                if directory is None or not name:
+                    continue
+                relative_path = os.path.join(directory, name) if directory else name
+                is_dir = bool(mask & IN_ISDIR)
+                if not selected(relative_path, is_dir):
+                    # A rename to an excluded name keeps its first half
+                    # unmatched, so the old path is deleted from the mirror
+                    continue
+                if mask & IN_MOVED_FROM:
+                    moves[cookie] = (relative_path, is_dir)
+                elif mask & IN_MOVED_TO:
+                    moved = moves.pop(cookie, None)
+                    if moved is not None and moved[1] == is_dir:
+                        old_path = moved[0]
+                        if is_dir:
+                            mirror.rename_tree(old_path, relative_path)
+                            for path in [path for path in dirty if _is_below(path, old_path)]:
+                                dirty.discard(path)
+                                dirty.add(relative_path + path[len(old_path) :])
+                            # Re-watching returns the same descriptors under the new path
+                            dirty.update(
+                                path for path in add_tree(relative_path) if path not in mirror.paths
+                            )
+                        else:
+                            if not mirror.rename(old_path, relative_path):
+                                dirty.add(relative_path)
+                            elif old_path in dirty:
+                                dirty.add(relative_path)
+                            dirty.discard(old_path)
+                    elif is_dir:
+                        dirty.update(add_tree(relative_path))
+                    else:
+                        dirty.add(relative_path)
+                elif mask & IN_DELETE:
+                    if is_dir:
+                        mirror.delete_tree(relative_path)
+                    else:
+                        mirror.delete(relative_path)
+                    dirty.discard(relative_path)
+                elif is_dir:
+                    if mask & IN_CREATE:
+                        # Files may have landed before the watch was in place
+                        dirty.update(add_tree(relative_path))
+                else:
+                    dirty.add(relative_path)
+            pending = dirty or moves or overflowed or mirror.changed
+            if not pending:
+                pending_since = None
+                continue
+            now = time.monotonic()
+            if pending_since is None:
+                pending_since = now
+            if not events or now - pending_since >= MAX_DELAY:
+                flush()
+                pending_since = None
+    except KeyboardInterrupt:
+        flush()
+        counts = mirror.counts
+        print(
+            f"\nStopped watching. Added: {counts['added']}, updated: {counts['updated']}, "
+            f"renamed: {counts['renamed']}, deleted: {counts['deleted']}"
+        )
+        raise
+    finally:
+        inotify.close()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The tools import each other by module name, as when run from solvaire/
+SOLVAIRE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "solvaire")
+sys.path.insert(0, SOLVAIRE_DIR)
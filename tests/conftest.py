@@ -0,0 +1,30 @@
+import pytest
+
+from script import flatten_directory
+from tests.helpers import quiet_reporter, write_tree
+
+
+@pytest.fixture
+def source_tree(tmp_path):
+    """A small tree with nested directories and two identical files."""
+    root = tmp_path / "source"
+    write_tree(
+        str(root),
+        {
+            "Contracts/2023/lease.pdf": b"%PDF-1.7 lease",
+            "Contracts/2023/copy-of-lease.pdf": b"%PDF-1.7 lease",
+            "Contracts/notes.txt": b"call back on monday\n",
+            "Photos/site.png": b"\x89PNG\r\n\x1a\n" + b"\x00" * 32,
+            "readme.txt": b"top level\n",
+        },
+    )
+    return str(root)
+
+
+@pytest.fixture
+def flattened(tmp_path, source_tree):
+    """The source tree flattened with default options: (target, mapping file path)."""
+    target = str(tmp_path / "flat")
+    mapping_file_path = str(tmp_path / "mapping.jsonl")
+    flatten_directory(source_tree, target, mapping_file_path, reporter=quiet_reporter())
+    return target, mapping_file_path
@@ -0,0 +1,36 @@
+import io
+import os
+
+from mapping import iter_mapping
+from progress import Metrics, ProgressReporter
+from tests import SOLVAIRE_DIR  # noqa: F401
+
+
+def write_tree(root, files):
+    """Creates files (relative path -> bytes) below root."""
+    for relative_path, content in files.items():
+        path = os.path.join(root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+
+
+def read_tree(root):
+    """Returns relative path -> bytes of every file below root."""
+    files = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, root)] = f.read()
+    return files
+
+
+def names_by_path(mapping_file_path):
+    """Returns relative source path -> flattened name."""
+    return {path: name for name, path in iter_mapping(mapping_file_path)}
+
+
+def quiet_reporter(verb="Copied"):
+    """A reporter that writes its status lines to a buffer instead of stdout."""
+    return ProgressReporter(Metrics(), verb=verb, stream=io.StringIO())
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+import aflatten
+from aflatten import flatten_directory_async
+from journal import journal_path_for
+from script import unflatten_directory
+from tests.helpers import names_by_path, quiet_reporter, read_tree
+
+
+def test_async_flatten(tmp_path, source_tree):
+    target = str(tmp_path / "flat")
+    mapping_file_path = str(tmp_path / "mapping.jsonl")
+    flatten_directory_async(
+        source_tree, target, mapping_file_path, concurrency=4, reporter=quiet_reporter()
+    )
+    assert set(names_by_path(mapping_file_path)) == set(read_tree(source_tree))
+
+    restored = str(tmp_path / "restored")
+    unflatten_directory(target, restored, mapping_file_path, reporter=quiet_reporter("Restored"))
+    assert read_tree(restored) == read_tree(source_tree)
+
+
+def test_async_flatten_fails_when_copiers_die(tmp_path, source_tree, monkeypatch):
+    def broken(*args):
+        raise RuntimeError("copier bug")
+
+    monkeypatch.setattr(aflatten, "_flatten_file", broken)
+    mapping_file_path = str(tmp_path / "mapping.jsonl")
+    with pytest.raises(RuntimeError, match="copier bug"):
+        aflatten.flatten_directory_async(
+            source_tree,
+            str(tmp_path / "flat"),
+            mapping_file_path,
+            concurrency=1,
+            reporter=quiet_reporter(),
+        )
+    assert os.path.exists(journal_path_for(mapping_file_path))
@@ -0,0 +1,71 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from archive import PAX_PATH_KEY, iter_volumes, restore_archive
+from script import flatten_directory, unflatten_directory
+from tests.helpers import quiet_reporter, read_tree, write_tree
+
+
+@pytest.mark.parametrize("suffix", [".tar", ".tar.gz", ".zip"])
+@pytest.mark.parametrize("dedupe", [False, True])
+def test_round_trip(tmp_path, source_tree, suffix, dedupe):
+    archive_path = str(tmp_path / f"batch{suffix}")
+    flatten_directory(
+        source_tree,
+        str(tmp_path / "unused"),
+        str(tmp_path / "mapping.jsonl"),
+        archive=archive_path,
+        dedupe=dedupe,
+        reporter=quiet_reporter(),
+    )
+    assert os.path.exists(archive_path)
+
+    restored = str(tmp_path / "restored")
+    unflatten_directory(archive_path, restored, None, reporter=quiet_reporter("Restored"))
+    assert read_tree(restored) == read_tree(source_tree)
+
+
+def test_volumes(tmp_path):
+    source_tree = str(tmp_path / "source")
+    write_tree(source_tree, {f"d{number}/f.bin": bytes([number]) * 8000 for number in range(6)})
+    archive_path = str(tmp_path / "batch.tar")
+    flatten_directory(
+        source_tree,
+        str(tmp_path / "unused"),
+        str(tmp_path / "mapping.jsonl"),
+        archive=archive_path,
+        volume_size=4 * tarfile.RECORDSIZE,
+        reporter=quiet_reporter(),
+    )
+    volumes = list(iter_volumes(archive_path))
+    assert len(volumes) > 1
+    assert all(os.path.getsize(volume) <= 4 * tarfile.RECORDSIZE for volume in volumes)
+
+    restored = str(tmp_path / "restored")
+    assert restore_archive(archive_path, restored) == 6
+    assert read_tree(restored) == read_tree(source_tree)
+
+
+def test_restore_rejects_paths_outside_the_output(tmp_path, capsys):
+    archive_path = str(tmp_path / "evil.tar")
+    original_paths = ["../outside.txt", str(tmp_path / "absolute.txt"), "link/x.txt", "ok/fine.txt"]
+    with tarfile.open(archive_path, "w", format=tarfile.PAX_FORMAT) as archive:
+        for number, original_path in enumerate(original_paths):
+            info = tarfile.TarInfo(f"{number}.txt")
+            info.size = 1
+            info.pax_headers = {PAX_PATH_KEY: original_path}
+            archive.addfile(info, io.BytesIO(b"x"))
+    restored = tmp_path / "restored"
+    restored.mkdir()
+    os.symlink(str(tmp_path), str(restored / "link"))
+
+    assert restore_archive(archive_path, str(restored)) == 1
+
+    assert "outside the output directory" in capsys.readouterr().out
+    assert (restored / "ok" / "fine.txt").read_bytes() == b"x"
+    assert not (tmp_path / "outside.txt").exists()
+    assert not (tmp_path / "absolute.txt").exists()
+    assert not (tmp_path / "x.txt").exists()
@@ -0,0 +1,57 @@
+import os
+
+from batches import BatchPacker, batch_name
+from mapping import iter_mapping, read_manifest
+from script import flatten_directory, unflatten_directory
+from tests.helpers import names_by_path, quiet_reporter, read_tree
+
+
+def test_batch_name():
+    assert batch_name(1) == "batch-0001"
+    assert batch_name(120) == "batch-0120"
+
+
+def test_first_fit_by_bytes():
+    packer = BatchPacker(max_bytes=100)
+    assert [packer.add(size) for size in (60, 60, 30, 40, 10)] == [1, 2, 1, 2, 1]
+    assert packer.batches == [[3, 100], [2, 100]]
+
+
+def test_oversized_file_gets_its_own_batch():
+    packer = BatchPacker(max_bytes=100)
+    assert packer.add(500) == 1
+    assert packer.add(10) == 2
+    assert packer.batches == [[1, 500], [1, 10]]
+
+
+def test_file_count_limit():
+    packer = BatchPacker(max_files=2)
+    assert [packer.add(0) for _ in range(5)] == [1, 1, 2, 2, 3]
+
+
+def test_restore_continues_an_interrupted_packing():
+    packer = BatchPacker(max_bytes=100, max_files=10)
+    assert packer.restore(10, 50) == 1
+    assert packer.restore(3, 90) == 2
+    # The first batch is full by count, so only the second one is open
+    assert packer.add(10) == 2
+    assert packer.add(10) == 3
+
+
+def test_split_into_batches(tmp_path, source_tree):
+    target = str(tmp_path / "flat")
+    mapping_file_path = str(tmp_path / "mapping.jsonl")
+    flatten_directory(
+        source_tree, target, mapping_file_path, max_batch_files=2, reporter=quiet_reporter()
+    )
+
+    manifest = read_manifest(mapping_file_path)
+    assert len(manifest["shards"]) == 3
+    for shard in manifest["shards"]:
+        assert len(list(iter_mapping(shard["mapping"]))) <= 2
+    assert sorted(os.listdir(target)) == ["batch-0001", "batch-0002", "batch-0003"]
+    assert set(names_by_path(mapping_file_path)) == set(read_tree(source_tree))
+
+    restored = str(tmp_path / "restored")
+    unflatten_directory(target, restored, mapping_file_path, reporter=quiet_reporter("Restored"))
+    assert read_tree(restored) == read_tree(source_tree)
@@ -0,0 +1,32 @@
+from bench import compare_results, generate_tree, run_benchmarks
+from tests.helpers import read_tree
+
+TINY_PROFILE = {"depth": 2, "fanout": 2, "files": 12, "min_size": 0, "max_size": 4096}
+
+
+def test_generate_tree_is_reproducible(tmp_path):
+    first = str(tmp_path / "first")
+    second = str(tmp_path / "second")
+    total = generate_tree(first, seed=3, **TINY_PROFILE)
+    generate_tree(second, seed=3, **TINY_PROFILE)
+
+    files = read_tree(first)
+    assert len(files) == 12
+    assert total == sum(len(data) for data in files.values())
+    assert read_tree(second) == files
+
+
+def test_run_benchmarks_and_compare(tmp_path, capsys):
+    results = run_benchmarks(
+        {"tiny": TINY_PROFILE}, ["copy"], [1, 2], work_dir=str(tmp_path), upload=True
+    )
+
+    operations = sorted({(result["operation"], result["workers"]) for result in results})
+    assert ("flatten", 1) in operations and ("unflatten", 2) in operations
+    assert all(result["errors"] == 0 for result in results)
+    assert all(result["files"] == 12 for result in results)
+
+    slower = [dict(result, seconds=result["seconds"] / 10) for result in results]
+    assert compare_results(results, slower) == len(results)
+    assert compare_results(results, results) == 0
+    assert "REGRESSION" in capsys.readouterr().out
@@ -0,0 +1,86 @@
+import os
+
+import catalog
+from catalog import Catalog, bloom_path_for, load_catalog
+from mapping import iter_mapping
+from script import flatten_directory
+from sniff import quarantine_path_for
+from upload import UPLOAD_ERRORS_SUFFIX
+from tests.helpers import quiet_reporter, write_tree
+
+
+def _flatten_batches(tmp_path, source_tree):
+    """Flattens the tree and a second one as two batches with mappings in one directory."""
+    mappings_dir = tmp_path / "mappings"
+    mappings_dir.mkdir()
+    other_tree = str(tmp_path / "other")
+    write_tree(other_tree, {"Invoices/march.pdf": b"%PDF-1.4 march", "no-extension": b"text\n"})
+    mapping_paths = []
+    for number, tree in enumerate([source_tree, other_tree], start=1):
+        mapping_file_path = str(mappings_dir / f"batch{number}.jsonl")
+        flatten_directory(
+            tree,
+            str(tmp_path / f"flat{number}"),
+            mapping_file_path,
+            sniff=True,
+            reporter=quiet_reporter(),
+        )
+        mapping_paths.append(mapping_file_path)
+    return str(mappings_dir), mapping_paths
+
+
+def test_directory_catalog_skips_sidecar_files(tmp_path, source_tree):
+    mappings_dir, mapping_paths = _flatten_batches(tmp_path, source_tree)
+    # The extensionless file of the second batch is quarantined next to its mapping
+    assert os.path.exists(quarantine_path_for(mapping_paths[1]))
+    with open(os.path.join(mappings_dir, "flat2" + UPLOAD_ERRORS_SUFFIX), "w") as f:
+        f.write('{"name": "x.pdf", "status": 415, "error": "Unsupported", "attempts": 1}\n')
+
+    assert load_catalog(mappings_dir) == mapping_paths
+
+
+def test_list_file_catalog(tmp_path, source_tree):
+    mappings_dir, mapping_paths = _flatten_batches(tmp_path, source_tree)
+    list_path = tmp_path / "catalog.txt"
+    list_path.write_text(
+        "# every batch of the venue\nmappings/batch1.jsonl\n\nmappings/batch2.jsonl\n"
+    )
+
+    assert load_catalog(str(list_path)) == mapping_paths
+
+
+def test_locate_across_batches(tmp_path, source_tree):
+    mappings_dir, mapping_paths = _flatten_batches(tmp_path, source_tree)
+    catalog = Catalog(mappings_dir)
+    try:
+        for mapping_file_path in mapping_paths:
+            for name, original_path in iter_mapping(mapping_file_path):
+                assert catalog.locate(name) == (mapping_file_path, original_path)
+        assert catalog.resolve("00000000-0000-0000-0000-000000000000.pdf") is None
+        found = list(catalog.find_paths("Invoices/"))
+        assert [(batch, path) for batch, _, path in found] == [
+            (mapping_paths[1], "Invoices/march.pdf")
+        ]
+    finally:
+        catalog.close()
+
+
+def test_read_only_batches_are_filtered_in_memory(tmp_path, source_tree, monkeypatch, capsys):
+    mappings_dir, mapping_paths = _flatten_batches(tmp_path, source_tree)
+
+    def read_only(*args):
+        raise PermissionError(13, "Permission denied", mappings_dir)
+
+    # What filter building sees in a read-only batch directory: no index, no saving
+    monkeypatch.setattr(catalog, "open_index", lambda *args: None)
+    monkeypatch.setattr(catalog, "write_filter", read_only)
+    catalog_ = Catalog(mappings_dir)
+    try:
+        assert not catalog_.indexed
+        for mapping_file_path in mapping_paths:
+            assert not os.path.exists(bloom_path_for(mapping_file_path))
+            for name, original_path in iter_mapping(mapping_file_path):
+                assert catalog_.locate(name) == (mapping_file_path, original_path)
+    finally:
+        catalog_.close()
+    assert "keeping it in memory" in capsys.readouterr().err
@@ -0,0 +1,19 @@
+import io
+
+from convert_names import convert_uuid_to_original_names
+from tests.helpers import names_by_path
+
+
+def test_convert_list_from_stdin(flattened, monkeypatch, capsys):
+    _, mapping_file_path = flattened
+    names = names_by_path(mapping_file_path)
+    lines = [names["readme.txt"], "- " + names["Photos/site.png"] + ": rejected", "gone.pdf"]
+    monkeypatch.setattr("sys.stdin", io.StringIO("\n".join(lines) + "\n"))
+
+    convert_uuid_to_original_names(None, mapping_file_path)
+
+    assert capsys.readouterr().out.splitlines() == [
+        f"{names['readme.txt']} -> readme.txt",
+        f"{names['Photos/site.png']} -> Photos/site.png",
+        "gone.pdf -> NOT FOUND IN MAPPING",
+    ]
@@ -0,0 +1,21 @@
+import os
+
+from script import flatten_directory, unflatten_directory
+from tests.helpers import names_by_path, quiet_reporter, read_tree
+
+
+def test_dedupe_copies_identical_files_once(tmp_path, source_tree):
+    target = str(tmp_path / "flat")
+    mapping_file_path = str(tmp_path / "mapping.jsonl")
+    flatten_directory(
+        source_tree, target, mapping_file_path, dedupe=True, reporter=quiet_reporter()
+    )
+
+    mapping = names_by_path(mapping_file_path)
+    assert len(mapping) == 5
+    assert mapping["Contracts/2023/lease.pdf"] == mapping["Contracts/2023/copy-of-lease.pdf"]
+    assert len(os.listdir(target)) == 4
+
+    restored = str(tmp_path / "restored")
+    unflatten_directory(target, restored, mapping_file_path, reporter=quiet_reporter("Restored"))
+    assert read_tree(restored) == read_tree(source_tree)
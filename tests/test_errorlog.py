@@ -0,0 +1,25 @@
+from errorlog import rewrite_logs
+from tests.helpers import names_by_path
+
+
+def test_rewrite_error_logs(tmp_path, flattened):
+    _, mapping_file_path = flattened
+    names = names_by_path(mapping_file_path)
+    stem = names["Contracts/notes.txt"].split(".", 1)[0]
+    log_path = tmp_path / "errors.log"
+    log_path.write_bytes(
+        f"upload failed: {names['readme.txt']} (415)\n".encode()
+        + f"retrying {stem} after timeout\n".encode()
+        + b"latin-1 noise \xe9 left alone\n"
+    )
+    output = str(tmp_path / "errors.resolved.log")
+
+    totals = rewrite_logs([str(log_path)], mapping_file_path, output=output)
+
+    with open(output, "rb") as f:
+        assert f.read() == (
+            b"upload failed: readme.txt (415)\n"
+            b"retrying Contracts/notes.txt after timeout\n"
+            b"latin-1 noise \xe9 left alone\n"
+        )
+    assert totals["resolved"] == 2
@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from mapping import flat_location, read_mapping_meta
+from script import flatten_directory, unflatten_directory
+from tests.helpers import SOLVAIRE_DIR, names_by_path, quiet_reporter, read_tree, write_tree
+
+
+def test_fanout_and_workers(tmp_path, source_tree):
+    target = str(tmp_path / "flat")
+    mapping_file_path = str(tmp_path / "mapping.jsonl")
+    flatten_directory(
+        source_tree, target, mapping_file_path, workers=4, fanout=2, reporter=quiet_reporter()
+    )
+    meta = read_mapping_meta(mapping_file_path)
+    assert meta["layout"]["fanout"] == 2
+    for name in names_by_path(mapping_file_path).values():
+        assert os.path.exists(os.path.join(target, flat_location(name, meta)))
+    assert all(len(entry) == meta["layout"]["width"] for entry in os.listdir(target))
+
+    restored = str(tmp_path / "restored")
+    unflatten_directory(target, restored, mapping_file_path, reporter=quiet_reporter("Restored"))
+    assert read_tree(restored) == read_tree(source_tree)
+
+
+def test_concurrent_workers_share_fanout_directories(tmp_path, monkeypatch):
+    source = str(tmp_path / "source")
+    write_tree(source, {f"d{number % 7}/{number}.txt": b"%d" % number for number in range(300)})
+    real_makedirs = os.makedirs
+
+    def slow_makedirs(*args, **kwargs):
+        # Widens the window in which another worker could use the directory
+        time.sleep(0.01)
+        real_makedirs(*args, **kwargs)
+
+    monkeypatch.setattr(os, "makedirs", slow_makedirs)
+    target = str(tmp_path / "flat")
+    mapping_file_path = str(tmp_path / "mapping.jsonl")
+    reporter = quiet_reporter()
+    flatten_directory(source, target, mapping_file_path, workers=8, fanout=1, reporter=reporter)
+
+    assert reporter.metrics.counters.get("errors", 0) == 0
+    assert set(names_by_path(mapping_file_path)) == set(read_tree(source))
+
+
+@pytest.mark.parametrize(
+    "option, value", [("--fanout", "-1"), ("--workers", "0"), ("--concurrency", "0")]
+)
+def test_invalid_counts_are_rejected(tmp_path, option, value):
+    result = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(SOLVAIRE_DIR, "script.py"),
+            "-s",
+            str(tmp_path),
+            "-t",
+            str(tmp_path / "flat"),
+            "-m",
+            str(tmp_path / "mapping.jsonl"),
+            option,
+            value,
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 2
+    assert option in result.stderr
+    assert not os.path.exists(str(tmp_path / "flat"))
@@ -0,0 +1,27 @@
+import pytest
+
+from index import find_paths
+from tests.helpers import names_by_path
+
+
+@pytest.mark.parametrize("use_index", [True, False])
+@pytest.mark.parametrize(
+    "query, match, expected",
+    [
+        ("readme.txt", "exact", ["readme.txt"]),
+        (
+            "Contracts",
+            "auto",
+            ["Contracts/2023/copy-of-lease.pdf", "Contracts/2023/lease.pdf", "Contracts/notes.txt"],
+        ),
+        ("Contracts/2023/l", "prefix", ["Contracts/2023/lease.pdf"]),
+        ("**/*.pdf", "auto", ["Contracts/2023/copy-of-lease.pdf", "Contracts/2023/lease.pdf"]),
+        ("*.txt", "glob", ["readme.txt"]),
+        ("Contract", "auto", []),
+    ],
+)
+def test_find_paths(flattened, use_index, query, match, expected):
+    _, mapping_file_path = flattened
+    names = names_by_path(mapping_file_path)
+    found = sorted(find_paths(query, mapping_file_path, match, use_index=use_index))
+    assert found == sorted((names[path], path) for path in expected)
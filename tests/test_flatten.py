@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+from script import flatten_directory, unflatten_directory
+from tests.helpers import names_by_path, quiet_reporter, read_tree
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_round_trip(tmp_path, source_tree, workers):
+    target = str(tmp_path / "flat")
+    mapping_file_path = str(tmp_path / "mapping.json")
+    flatten_directory(
+        source_tree, target, mapping_file_path, workers=workers, reporter=quiet_reporter()
+    )
+
+    flat_files = os.listdir(target)
+    assert len(flat_files) == 5
+    assert all("/" not in name for name in flat_files)
+    assert set(names_by_path(mapping_file_path)) == set(read_tree(source_tree))
+
+    restored = str(tmp_path / "restored")
+    unflatten_directory(target, restored, mapping_file_path, reporter=quiet_reporter("Restored"))
+    assert read_tree(restored) == read_tree(source_tree)
@@ -0,0 +1,30 @@
+import os
+
+from script import unflatten_directory
+from tests.helpers import quiet_reporter, read_tree, write_tree
+
+
+def test_incremental_unflatten_only_restores_changes(tmp_path, source_tree, flattened, capsys):
+    target, mapping_file_path = flattened
+    restored = str(tmp_path / "restored")
+    unflatten_directory(target, restored, mapping_file_path, reporter=quiet_reporter("Restored"))
+    write_tree(restored, {"readme.txt": b"edited after the restore\n", "stray.log": b"x"})
+
+    reporter = quiet_reporter("Restored")
+    unflatten_directory(
+        target,
+        restored,
+        mapping_file_path,
+        incremental=True,
+        verify_hash=True,
+        delete=True,
+        reporter=reporter,
+    )
+
+    assert read_tree(restored) == read_tree(source_tree)
+    assert reporter.metrics.counters["unchanged"] == 4
+    assert reporter.metrics.files == 1
+    assert reporter.metrics.counters["deleted"] == 1
+    assert not os.path.exists(os.path.join(restored, "stray.log"))
+    # Stale files are counted, not listed one per line
+    assert "stray.log" not in capsys.readouterr().out
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from index import NameResolver, index_path_for
+from script import flatten_directory
+from tests.helpers import names_by_path, quiet_reporter
+
+
+@pytest.mark.parametrize("use_index", [True, False])
+def test_resolver(flattened, use_index):
+    _, mapping_file_path = flattened
+    names = names_by_path(mapping_file_path)
+    resolver = NameResolver(mapping_file_path, use_index=use_index)
+    try:
+        assert resolver.indexed == use_index
+        for path, name in names.items():
+            assert resolver.resolve(name) == path
+            stem = name.split(".", 1)[0]
+            assert resolver.resolve_stem(stem) == (name, path)
+        assert resolver.resolve("00000000-0000-0000-0000-000000000000.pdf") is None
+    finally:
+        resolver.close()
+    assert os.path.exists(index_path_for(mapping_file_path)) == use_index
+
+
+def test_index_is_rebuilt_when_the_mapping_changes(tmp_path, source_tree, flattened):
+    _, mapping_file_path = flattened
+    first = names_by_path(mapping_file_path)
+    NameResolver(mapping_file_path).close()
+    flatten_directory(
+        source_tree, str(tmp_path / "flat2"), mapping_file_path, reporter=quiet_reporter()
+    )
+    second = names_by_path(mapping_file_path)
+
+    resolver = NameResolver(mapping_file_path)
+    try:
+        assert resolver.resolve(second["readme.txt"]) == "readme.txt"
+        assert resolver.resolve(first["readme.txt"]) is None
+    finally:
+        resolver.close()
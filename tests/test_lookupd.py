@@ -0,0 +1,134 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+import threading
+
+import lookupd
+from index import NameResolver
+from lookupd import DaemonResolver, _LookupService, _Session
+from mapping import iter_mapping
+from script import flatten_directory
+from tests.helpers import SOLVAIRE_DIR, quiet_reporter
+
+
+def _connect(socket_path, process, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return DaemonResolver(socket_path)
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def test_daemon_serves_and_reloads(tmp_path, source_tree, flattened):
+    _, mapping_file_path = flattened
+    socket_path = str(tmp_path / "lookupd.sock")
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(SOLVAIRE_DIR, "lookupd.py"),
+            "-m",
+            mapping_file_path,
+            "-s",
+            socket_path,
+        ],
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        client = _connect(socket_path, process)
+        try:
+            entries = list(iter_mapping(mapping_file_path))
+            assert client.locate_many([name for name, _ in entries]) == [
+                (None, path) for _, path in entries
+            ]
+            assert client.resolve("missing.pdf") is None
+            assert sorted(path for _, _, path in client.find_paths("Contracts/2023/")) == [
+                "Contracts/2023/copy-of-lease.pdf",
+                "Contracts/2023/lease.pdf",
+            ]
+
+            # A new flatten rewrites the mapping; the daemon picks it up on its own
+            flatten_directory(
+                source_tree, str(tmp_path / "flat2"), mapping_file_path, reporter=quiet_reporter()
+            )
+            name, path = next(iter_mapping(mapping_file_path))
+            deadline = time.monotonic() + 10
+            while client.resolve(name) is None and time.monotonic() < deadline:
+                time.sleep(0.1)
+            assert client.resolve(name) == path
+        finally:
+            client.close()
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=10)
+    assert not os.path.exists(socket_path)
+
+
+def test_failed_reload_keeps_the_previous_mapping(flattened, monkeypatch, capsys):
+    _, mapping_file_path = flattened
+    monkeypatch.setattr(lookupd, "RELOAD_CHECK_INTERVAL", 0)
+    service = _LookupService(mapping_file_path)
+    session = _Session(service)
+    try:
+        name, path = next(iter_mapping(mapping_file_path))
+        # The session opens its resolver before the mapping goes away
+        assert service.handle({"op": "ping"}, session)["ok"]
+
+        def vanished(*args):
+            raise FileNotFoundError(2, "No such file or directory", mapping_file_path)
+
+        monkeypatch.setattr(lookupd, "NameResolver", vanished)
+        os.utime(mapping_file_path, (1, 1))
+
+        request = {"op": "resolve", "names": [name]}
+        assert service.handle(request, session) == {"results": [[None, path]]}
+        assert "reload failed" in capsys.readouterr().err
+    finally:
+        session.close()
+
+
+def test_bad_requests_get_an_error(flattened):
+    _, mapping_file_path = flattened
+    service = _LookupService(mapping_file_path)
+    session = _Session(service)
+    try:
+        assert "error" in service.handle({"op": "explode"}, session)
+        request = {"op": "find_paths", "queries": ["x"], "match": "fuzzy"}
+        assert "error" in service.handle(request, session)
+    finally:
+        session.close()
+
+
+def test_sessions_are_served_concurrently(flattened, monkeypatch):
+    _, mapping_file_path = flattened
+    service = _LookupService(mapping_file_path)
+    name, path = next(iter_mapping(mapping_file_path))
+    release = threading.Event()
+    original_resolve = NameResolver.resolve
+
+    def resolve(self, name):
+        if name == "slow.pdf":
+            release.wait(5)
+        return original_resolve(self, name)
+
+    monkeypatch.setattr(NameResolver, "resolve", resolve)
+    slow, fast = _Session(service), _Session(service)
+    thread = threading.Thread(
+        target=service.handle, args=({"op": "resolve", "names": ["slow.pdf"]}, slow)
+    )
+    thread.start()
+    try:
+        assert service.handle({"op": "resolve", "names": [name]}, fast) == {
+            "results": [[None, path]]
+        }
+        # Answered while the other session's lookup was still running
+        assert thread.is_alive()
+    finally:
+        release.set()
+        thread.join()
+        slow.close()
+        fast.close()
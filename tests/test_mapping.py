@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from mapping import iter_mapping, read_mapping_meta, write_json_mapping, write_jsonl_mapping
+from script import flatten_directory, unflatten_directory
+from tests.helpers import names_by_path, quiet_reporter, read_tree
+
+ENTRIES = [("a.pdf", "x/a.pdf"), ("b.txt", "b.txt"), ("c.png", "y/z/c.png")]
+
+
+def test_jsonl_round_trip(tmp_path, source_tree):
+    target = str(tmp_path / "flat")
+    mapping_file_path = str(tmp_path / "mapping.jsonl")
+    flatten_directory(source_tree, target, mapping_file_path, reporter=quiet_reporter())
+
+    with open(mapping_file_path) as f:
+        entries = [json.loads(line) for line in f]
+    assert sorted(entry["path"] for entry in entries) == sorted(read_tree(source_tree))
+    assert set(names_by_path(mapping_file_path)) == set(read_tree(source_tree))
+
+    restored = str(tmp_path / "restored")
+    unflatten_directory(target, restored, mapping_file_path, reporter=quiet_reporter("Restored"))
+    assert read_tree(restored) == read_tree(source_tree)
+
+
+@pytest.mark.parametrize(
+    "mapping_name, write",
+    [
+        ("mapping.jsonl", write_jsonl_mapping),
+        ("mapping.json", write_json_mapping),
+        ("grouped.json", lambda *args, **kwargs: write_json_mapping(*args, grouped=True, **kwargs)),
+    ],
+)
+def test_both_formats_stream_the_same_entries(tmp_path, mapping_name, write):
+    mapping_file_path = str(tmp_path / mapping_name)
+    write(ENTRIES, mapping_file_path, meta={"layout": {"fanout": 1, "width": 2}})
+
+    assert list(iter_mapping(mapping_file_path)) == ENTRIES
+    assert read_mapping_meta(mapping_file_path)["layout"]["fanout"] == 1
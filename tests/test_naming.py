@@ -0,0 +1,49 @@
+from convert_names import check_names
+from naming import name_matches_path, path_name
+from script import flatten_directory
+from tests.helpers import names_by_path, quiet_reporter
+
+
+def test_deterministic_names(tmp_path, source_tree):
+    mappings = []
+    for run in ("first", "second"):
+        mapping_file_path = str(tmp_path / f"{run}.jsonl")
+        flatten_directory(
+            source_tree,
+            str(tmp_path / run),
+            mapping_file_path,
+            salt="batch-7",
+            reporter=quiet_reporter(),
+        )
+        mappings.append(names_by_path(mapping_file_path))
+
+    assert mappings[0] == mappings[1]
+    for relative_source_path, name in mappings[0].items():
+        assert name == path_name(relative_source_path, "batch-7")
+        assert name_matches_path(name, relative_source_path, "batch-7")
+        assert not name_matches_path(name, relative_source_path, "batch-8")
+
+
+def test_check_deterministic_names(tmp_path, source_tree, capsys):
+    mapping_file_path = str(tmp_path / "mapping.jsonl")
+    flatten_directory(
+        source_tree,
+        str(tmp_path / "flat"),
+        mapping_file_path,
+        salt="venue",
+        reporter=quiet_reporter(),
+    )
+    name = names_by_path(mapping_file_path)["readme.txt"]
+    capsys.readouterr()
+
+    pairs = [(name, "readme.txt"), (name, "Contracts/notes.txt")]
+    assert check_names(pairs, mapping_file_path) == 1
+    assert capsys.readouterr().out.splitlines() == [
+        f"Match: {name} -> readme.txt",
+        f"No match: {name} is not Contracts/notes.txt",
+    ]
+    # Without a salt in the mapping there is nothing to check against
+    flatten_directory(
+        source_tree, str(tmp_path / "random"), mapping_file_path, reporter=quiet_reporter()
+    )
+    assert check_names(pairs, mapping_file_path) is None
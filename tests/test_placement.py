@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from placement import Placer
+from script import flatten_directory, unflatten_directory
+from tests.helpers import quiet_reporter, read_tree
+
+
+@pytest.fixture
+def source_file(tmp_path):
+    path = tmp_path / "source.pdf"
+    path.write_bytes(b"%PDF-1.7 " + b"x" * 3000)
+    os.utime(str(path), (1_600_000_000, 1_600_000_000))
+    return str(path)
+
+
+@pytest.mark.parametrize("strategy", ["copy", "hardlink", "auto"])
+def test_place_keeps_contents_and_mtime(tmp_path, source_file, strategy):
+    placer = Placer(strategy)
+    target = str(tmp_path / "placed.pdf")
+    name = placer.place(source_file, target)
+
+    with open(source_file, "rb") as f, open(target, "rb") as g:
+        assert f.read() == g.read()
+    assert int(os.stat(target).st_mtime) == 1_600_000_000
+    assert placer.counts == {name: 1}
+    if strategy == "hardlink":
+        assert os.path.samefile(source_file, target)
+
+
+def test_place_head_reads_the_first_bytes_of_the_copy(tmp_path, source_file):
+    name, head = Placer("copy").place_head(source_file, str(tmp_path / "placed.pdf"), 8)
+    assert (name, head) == ("copy", b"%PDF-1.7")
+
+
+def test_rename_moves_unless_the_source_is_kept(tmp_path, source_file):
+    placer = Placer("rename")
+    kept = str(tmp_path / "kept.pdf")
+    placer.place(source_file, kept, keep_source=True)
+    assert os.path.exists(source_file)
+
+    moved = str(tmp_path / "moved.pdf")
+    assert placer.place(source_file, moved) == "rename"
+    assert not os.path.exists(source_file)
+    assert os.path.exists(moved)
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        Placer("teleport")
+
+
+def test_flatten_with_hardlinks(tmp_path, source_tree):
+    target = str(tmp_path / "flat")
+    mapping_file_path = str(tmp_path / "mapping.jsonl")
+    flatten_directory(
+        source_tree, target, mapping_file_path, strategy="hardlink", reporter=quiet_reporter()
+    )
+    for name in os.listdir(target):
+        assert os.stat(os.path.join(target, name)).st_nlink == 2
+
+    restored = str(tmp_path / "restored")
+    unflatten_directory(target, restored, mapping_file_path, reporter=quiet_reporter("Restored"))
+    assert read_tree(restored) == read_tree(source_tree)
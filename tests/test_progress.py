@@ -0,0 +1,60 @@
+import io
+import json
+
+from progress import Metrics, ProgressReporter
+
+
+class _Terminal(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def test_redirected_output_logs_the_final_state():
+    stream = io.StringIO()
+    reporter = ProgressReporter(Metrics(), verb="Copied", stream=stream, log_interval=3600)
+    reporter.file_done("a.txt", "1.txt", 10, 0.001)
+    reporter.file_done("b.txt", "2.txt", 20, 0.002)
+    reporter.finish()
+
+    lines = stream.getvalue().splitlines()
+    # The first file draws a line at once; the rest only show up in the final one
+    assert lines[0].startswith("Copied 1 file, 10 B |")
+    assert lines[-1].startswith("Copied 2 files, 30 B |")
+
+
+def test_terminal_line_is_cleared_on_finish():
+    stream = _Terminal()
+    reporter = ProgressReporter(Metrics(), verb="Restored", stream=stream)
+    reporter.file_done("a.txt", "a.txt", 10, 0.001)
+    reporter.message("Warning: something")
+    reporter.finish()
+
+    output = stream.getvalue()
+    assert output.startswith("\r\033[KRestored 1 file")
+    assert output.endswith("\r\033[KWarning: something\n")
+
+
+def test_errors_are_counted_in_the_status():
+    stream = io.StringIO()
+    metrics = Metrics()
+    reporter = ProgressReporter(metrics, stream=stream)
+    metrics.count("errors")
+    reporter.finish()
+    assert stream.getvalue().rstrip().endswith("| 1 error")
+
+
+def test_metrics(tmp_path):
+    metrics = Metrics()
+    with metrics.phase("walk"):
+        pass
+    for number in range(100):
+        metrics.record_file(f"{number}.txt", 1000, (number + 1) / 1000)
+    assert metrics.files == 100
+    assert metrics.bytes == 100000
+    assert metrics.percentile(0.5) <= metrics.percentile(0.99)
+    assert metrics.slowest()[0] == (0.1, "99.txt")
+
+    path = str(tmp_path / "metrics.json")
+    metrics.write_json(path)
+    with open(path) as f:
+        assert "walk" in json.load(f)["phases"]
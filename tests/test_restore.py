@@ -0,0 +1,27 @@
+import pytest
+
+from restore import plan_directories
+from script import unflatten_directory
+from tests.helpers import quiet_reporter, read_tree
+
+
+def test_plan_directories_lists_each_directory_once():
+    paths = ["a/b/c/one.txt", "a/b/c/two.txt", "a/b/three.txt", "top.txt", "d/four.txt"]
+    directories, entry_count = plan_directories((f"{n}.txt", path) for n, path in enumerate(paths))
+    assert sorted(directories) == ["a", "a/b", "a/b/c", "d"]
+    assert entry_count == 5
+
+
+@pytest.mark.parametrize("strategy", ["copy", "hardlink", "auto"])
+def test_parallel_unflatten(tmp_path, source_tree, flattened, strategy):
+    target, mapping_file_path = flattened
+    restored = str(tmp_path / "restored")
+    unflatten_directory(
+        target,
+        restored,
+        mapping_file_path,
+        strategy=strategy,
+        workers=4,
+        reporter=quiet_reporter("Restored"),
+    )
+    assert read_tree(restored) == read_tree(source_tree)
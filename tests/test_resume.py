@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from journal import journal_path_for
+from script import flatten_directory, unflatten_directory
+from tests.helpers import names_by_path, quiet_reporter, read_tree, write_tree
+
+
+class _InterruptingReporter:
+    """Raises KeyboardInterrupt once, after a number of files, like Ctrl-C would."""
+
+    def __init__(self, after):
+        self._reporter = quiet_reporter()
+        self.metrics = self._reporter.metrics
+        self._after = after
+        self._interrupted = False
+
+    def file_done(self, *args):
+        self._reporter.file_done(*args)
+        if not self._interrupted and self.metrics.files >= self._after:
+            self._interrupted = True
+            raise KeyboardInterrupt
+
+    def message(self, text):
+        self._reporter.message(text)
+
+    def finish(self):
+        self._reporter.finish()
+
+
+def test_resume_finishes_an_interrupted_run(tmp_path, source_tree):
+    target = str(tmp_path / "flat")
+    mapping_file_path = str(tmp_path / "mapping.jsonl")
+    with pytest.raises(KeyboardInterrupt):
+        flatten_directory(
+            source_tree, target, mapping_file_path, reporter=_InterruptingReporter(after=2)
+        )
+    assert os.path.exists(journal_path_for(mapping_file_path))
+    assert not os.path.exists(mapping_file_path)
+
+    flatten_directory(
+        source_tree, target, mapping_file_path, resume=True, reporter=quiet_reporter()
+    )
+    assert not os.path.exists(journal_path_for(mapping_file_path))
+    mapping = names_by_path(mapping_file_path)
+    assert set(mapping) == set(read_tree(source_tree))
+    # Every file was placed once: no orphans or second copies were left behind
+    assert sorted(os.listdir(target)) == sorted(mapping.values())
+
+    restored = str(tmp_path / "restored")
+    unflatten_directory(target, restored, mapping_file_path, reporter=quiet_reporter("Restored"))
+    assert read_tree(restored) == read_tree(source_tree)
+
+
+def test_resume_without_journal_leaves_target_alone(tmp_path, source_tree, capsys):
+    target = str(tmp_path / "flat")
+    write_tree(target, {"keep.me": b"not ours"})
+    mapping_file_path = str(tmp_path / "mapping.jsonl")
+
+    flatten_directory(
+        source_tree, target, mapping_file_path, resume=True, reporter=quiet_reporter()
+    )
+
+    assert "nothing to resume" in capsys.readouterr().out
+    assert read_tree(target) == {"keep.me": b"not ours"}
+    assert not os.path.exists(mapping_file_path)
@@ -0,0 +1,100 @@
+import io
+import json
+import zipfile
+
+import pytest
+
+from script import flatten_directory
+from sniff import QuarantineList, quarantine_path_for, quarantine_reason, sniff_type
+from tests.helpers import quiet_reporter, write_tree
+
+
+def _zip_with(part):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr(part, "<xml/>")
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize(
+    "head, file_type",
+    [
+        (b"", "empty"),
+        (b"%PDF-1.7\n", "pdf"),
+        (b"\x89PNG\r\n\x1a\n\x00\x00", "png"),
+        (b"\xff\xd8\xff\xe0", "jpeg"),
+        (b"\x7fELF\x02\x01", "elf"),
+        (b"MZ\x90\x00\x03\x00", "exe"),
+        (b"MZ is how this note starts\n", "text"),
+        (_zip_with("word/document.xml"), "docx"),
+        (_zip_with("xl/workbook.xml"), "xlsx"),
+    ],
+)
+def test_sniff_type(head, file_type):
+    assert sniff_type(head) == file_type
+
+
+def test_quarantine_reason():
+    assert quarantine_reason("a/report.pdf", "pdf") is None
+    assert quarantine_reason("a/report.pdf", "jpeg") == "extension .pdf but content is jpeg"
+    assert quarantine_reason("a/README", "text").startswith("no extension")
+    assert quarantine_reason("a/setup.exe", "exe") == "unsupported type exe"
+    assert quarantine_reason("a/blank.txt", "empty") == "empty file"
+
+
+@pytest.mark.parametrize("options", [{}, {"dedupe": True}, {"workers": 4}])
+def test_flatten_records_types_and_quarantines(tmp_path, options):
+    source = str(tmp_path / "source")
+    write_tree(
+        source,
+        {
+            "ok/report.pdf": b"%PDF-1.7 report",
+            "bad/renamed.pdf": b"\xff\xd8\xff\xe0 a photo",
+            "bad/tool.exe": b"MZ\x90\x00\x03\x00\x00\x00",
+            "bad/empty.txt": b"",
+        },
+    )
+    mapping_file_path = str(tmp_path / "mapping.jsonl")
+    flatten_directory(
+        source,
+        str(tmp_path / "flat"),
+        mapping_file_path,
+        sniff=True,
+        reporter=quiet_reporter(),
+        **options,
+    )
+
+    with open(mapping_file_path) as f:
+        entries = [json.loads(line) for line in f]
+    types = {entry["path"]: entry.get("type") for entry in entries if "path" in entry}
+    assert types == {
+        "ok/report.pdf": "pdf",
+        "bad/renamed.pdf": "jpeg",
+        "bad/tool.exe": "exe",
+        "bad/empty.txt": "empty",
+    }
+    with open(quarantine_path_for(mapping_file_path)) as f:
+        quarantined = {json.loads(line)["path"] for line in f}
+    assert quarantined == {"bad/renamed.pdf", "bad/tool.exe", "bad/empty.txt"}
+
+
+def test_quarantine_list_resume_counts_kept_entries(tmp_path):
+    path = str(tmp_path / "mapping.jsonl.quarantine.jsonl")
+    quarantine = QuarantineList(path)
+    quarantine.add("a.exe", "a.exe", "exe", "unsupported type exe")
+    quarantine.add("b.txt", "b.txt", "empty", "empty file")
+    quarantine.close()
+    # Interrupted halfway through a line
+    with open(path, "a") as f:
+        f.write('{"name": "c.')
+
+    quarantine = QuarantineList(path, resume=True)
+    assert quarantine.count == 2
+    quarantine.add("d.bin", "d.bin", "binary", "unsupported type binary")
+    quarantine.close()
+    assert quarantine.count == 3
+    with open(path) as f:
+        assert [json.loads(line)["name"] for line in f] == ["a.exe", "b.txt", "d.bin"]
+
+    # Without resume the list of an earlier flatten is discarded
+    assert QuarantineList(path).count == 0
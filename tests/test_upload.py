@@ -0,0 +1,191 @@
+import io
+import json
+import os
+import random
+import zipfile
+
+import pytest
+
+import upload
+from script import flatten_directory
+from sniff import quarantine_path_for
+from stub_server import start_stub_server
+from upload import read_skip_list, upload_files
+from tests.helpers import quiet_reporter, read_tree, write_tree
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = start_stub_server(store_dir=str(tmp_path / "stored"))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _flatten(tmp_path, source_tree, **options):
+    target = str(tmp_path / "flat")
+    mapping_file_path = str(tmp_path / "mapping.jsonl")
+    flatten_directory(source_tree, target, mapping_file_path, reporter=quiet_reporter(), **options)
+    return target, mapping_file_path
+
+
+def test_upload_directory_over_pooled_connections(tmp_path, source_tree, server):
+    target, _ = _flatten(tmp_path, source_tree, fanout=1)
+
+    counts = upload_files(target, server.url, workers=2, reporter=quiet_reporter("Uploaded"))
+
+    assert counts == {"uploaded": 5, "failed": 0, "skipped": 0}
+    flat_files = {os.path.basename(path): data for path, data in read_tree(target).items()}
+    assert read_tree(server.store_dir) == flat_files
+    assert server.stats.snapshot()["connections"] <= 2
+    assert not os.path.exists(target + upload.UPLOAD_ERRORS_SUFFIX)
+
+
+@pytest.mark.parametrize("suffix", [".zip", ".tar", ".tar.gz"])
+def test_upload_archive_members(tmp_path, source_tree, server, suffix):
+    archive_path = str(tmp_path / f"batch{suffix}")
+    flatten_directory(
+        source_tree,
+        str(tmp_path / "unused"),
+        str(tmp_path / "archive-mapping.jsonl"),
+        archive=archive_path,
+        salt="fixed",
+        reporter=quiet_reporter(),
+    )
+
+    counts = upload_files(archive_path, server.url, workers=3, reporter=quiet_reporter("Uploaded"))
+
+    assert counts["uploaded"] == 5
+    assert sorted(read_tree(server.store_dir).values()) == sorted(read_tree(source_tree).values())
+
+
+def test_rejected_files_are_logged_and_quarantined_ones_skipped(tmp_path, server):
+    source = str(tmp_path / "source")
+    write_tree(
+        source,
+        {"ok.pdf": b"%PDF-1.7", "tool.exe": b"MZ\x90\x00\x03\x00", "no-extension": b"hello\n"},
+    )
+    target, mapping_file_path = _flatten(tmp_path, source, sniff=True)
+    error_log_path = str(tmp_path / "errors.jsonl")
+
+    counts = upload_files(
+        target, server.url, error_log_path=error_log_path, reporter=quiet_reporter("Uploaded")
+    )
+    assert counts == {"uploaded": 1, "failed": 2, "skipped": 0}
+    with open(error_log_path) as f:
+        errors = [json.loads(line) for line in f]
+    assert sorted(error["status"] for error in errors) == [415, 415]
+    # A refused file is not retried
+    assert all(error["attempts"] == 1 for error in errors)
+
+    skip = read_skip_list(quarantine_path_for(mapping_file_path))
+    counts = upload_files(
+        target,
+        server.url,
+        error_log_path=error_log_path,
+        skip=skip,
+        reporter=quiet_reporter("Uploaded"),
+    )
+    assert counts == {"uploaded": 1, "failed": 0, "skipped": 2}
+    assert not os.path.exists(error_log_path)
+
+
+def test_transient_failures_are_retried(tmp_path, source_tree, server, monkeypatch):
+    monkeypatch.setattr(upload, "BACKOFF_BASE", 0.001)
+    random.seed(7)
+    server.fail_rate = 0.5
+    target, _ = _flatten(tmp_path, source_tree)
+    reporter = quiet_reporter("Uploaded")
+
+    counts = upload_files(target, server.url, max_attempts=30, reporter=reporter)
+
+    assert counts == {"uploaded": 5, "failed": 0, "skipped": 0}
+    assert reporter.metrics.counters["retries"] == server.stats.snapshot()["failed"] > 0
+
+
+def test_reused_connection_failures_are_not_retried_forever(monkeypatch):
+    monkeypatch.setattr(upload.time, "sleep", lambda seconds: None)
+
+    class DroppedConnection:
+        def request(self, *args, **kwargs):
+            raise ConnectionResetError("connection reset by peer")
+
+        def close(self):
+            pass
+
+    class StalePool:
+        """Every connection handed out looks reused and turns out dead."""
+
+        def acquire(self):
+            return DroppedConnection(), True
+
+        def release(self, connection, reusable):
+            pass
+
+        def request_path(self, name):
+            return "/upload/" + name
+
+    class Item:
+        name = "x.pdf"
+        size = 1
+
+        def open(self):
+            return io.BytesIO(b"x")
+
+    result = upload._upload_item(StalePool(), Item(), {}, max_attempts=3)
+
+    assert result["attempts"] == 3
+    assert result["status"] is None
+    assert "ConnectionResetError" in result["error"]
+
+
+def test_zip_handles_are_closed_after_upload(tmp_path, source_tree, server, monkeypatch):
+    archive_path = str(tmp_path / "batch.zip")
+    flatten_directory(
+        source_tree,
+        str(tmp_path / "unused"),
+        str(tmp_path / "mapping.jsonl"),
+        archive=archive_path,
+        reporter=quiet_reporter(),
+    )
+    opened = []
+    original_get = upload._ZipHandles.get
+
+    def recording_get(self, volume):
+        archive = original_get(self, volume)
+        opened.append(archive)
+        return archive
+
+    monkeypatch.setattr(upload._ZipHandles, "get", recording_get)
+    upload_files(archive_path, server.url, workers=3, reporter=quiet_reporter("Uploaded"))
+
+    assert opened
+    assert all(archive.fp is None for archive in opened)
+
+
+def test_corrupt_zip_member_fails_only_that_file(tmp_path, source_tree, server):
+    archive_path = str(tmp_path / "batch.zip")
+    flatten_directory(
+        source_tree,
+        str(tmp_path / "unused"),
+        str(tmp_path / "mapping.jsonl"),
+        archive=archive_path,
+        reporter=quiet_reporter(),
+    )
+    with zipfile.ZipFile(archive_path) as archive:
+        info = next(info for info in archive.infolist() if info.filename.endswith(".png"))
+    with open(archive_path, "r+b") as f:
+        # Past the local header, into the member's compressed data
+        f.seek(info.header_offset + 30 + len(info.filename) + 2)
+        f.write(b"\xff" * 8)
+    error_log_path = str(tmp_path / "errors.jsonl")
+
+    counts = upload_files(
+        archive_path, server.url, error_log_path=error_log_path, reporter=quiet_reporter("Uploaded")
+    )
+
+    assert counts == {"uploaded": 4, "failed": 1, "skipped": 0}
+    with open(error_log_path) as f:
+        (error,) = [json.loads(line) for line in f]
+    assert error["name"] == os.path.basename(info.filename)
+    assert error["attempts"] == 1
@@ -0,0 +1,19 @@
+import os
+
+from verify import verify_tree
+from tests.helpers import quiet_reporter, write_tree
+
+
+def test_verify_tree(tmp_path, source_tree, flattened):
+    target, mapping_file_path = flattened
+    counts = verify_tree(
+        target, source_tree, mapping_file_path, reporter=quiet_reporter("Verified")
+    )
+    assert counts == {"verified": 5, "mismatched": 0, "missing": 0, "extra": 0}
+
+    write_tree(source_tree, {"Contracts/notes.txt": b"changed\n", "new.txt": b"new\n"})
+    os.remove(os.path.join(source_tree, "readme.txt"))
+    counts = verify_tree(
+        target, source_tree, mapping_file_path, reporter=quiet_reporter("Verified")
+    )
+    assert counts == {"verified": 3, "mismatched": 1, "missing": 1, "extra": 1}
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from walker import PathMatcher, walk_files
+from tests.helpers import write_tree
+
+
+@pytest.mark.parametrize(
+    "patterns, path, is_dir, expected",
+    [
+        (["*.tmp"], "a/b/c.tmp", False, True),
+        (["/build/"], "build", True, True),
+        (["/build/"], "build", False, False),
+        (["/build/"], "src/build", True, False),
+        (["docs/**/*.md"], "docs/a/b/readme.md", False, True),
+        (["*.log", "!keep.log"], "keep.log", False, False),
+        (["# a comment", ""], "anything", False, False),
+    ],
+)
+def test_path_matcher(patterns, path, is_dir, expected):
+    assert PathMatcher(patterns).matches(path, is_dir) == expected
+
+
+def test_walk_files_prunes_and_filters(tmp_path):
+    root = str(tmp_path / "tree")
+    write_tree(
+        root,
+        {
+            "keep/a.pdf": b"",
+            "keep/b.txt": b"",
+            "keep/Thumbs.db": b"",
+            "node_modules/dep/index.pdf": b"",
+            "top.pdf": b"",
+        },
+    )
+    found = sorted(
+        relative_path
+        for _, relative_path in walk_files(root, include=["*.pdf"], exclude=["node_modules/"])
+    )
+    assert found == [os.path.join("keep", "a.pdf"), "top.pdf"]
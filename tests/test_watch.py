@@ -0,0 +1,97 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from placement import Placer
+from script import flatten_directory, unflatten_directory
+from walker import make_matchers
+from watch import _Mirror
+from tests.helpers import SOLVAIRE_DIR, names_by_path, quiet_reporter, read_tree, write_tree
+
+pytestmark = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="watch mode needs inotify"
+)
+
+
+def _mapping(mapping_file_path):
+    if not os.path.exists(mapping_file_path):
+        return {}
+    return names_by_path(mapping_file_path)
+
+
+def _wait_for(condition, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+
+def test_reconcile_applies_offline_changes(tmp_path, source_tree):
+    target = str(tmp_path / "flat")
+    mapping_file_path = str(tmp_path / "mapping.jsonl")
+    flatten_directory(source_tree, target, mapping_file_path, reporter=quiet_reporter())
+    before = _mapping(mapping_file_path)
+
+    os.remove(os.path.join(source_tree, "readme.txt"))
+    write_tree(source_tree, {"Photos/new.png": b"\x89PNG\r\n\x1a\n new"})
+    with open(os.path.join(source_tree, "Contracts", "notes.txt"), "ab") as f:
+        f.write(b"and on friday\n")
+
+    mirror = _Mirror(source_tree, target, mapping_file_path, Placer("copy"))
+    mirror.reconcile(*make_matchers(None, None))
+    mirror.write_mapping()
+
+    after = _mapping(mapping_file_path)
+    assert set(after) == set(read_tree(source_tree))
+    # Files keep their flattened names through edits
+    assert after["Contracts/notes.txt"] == before["Contracts/notes.txt"]
+    assert sorted(os.listdir(target)) == sorted(after.values())
+    restored = str(tmp_path / "restored")
+    unflatten_directory(target, restored, mapping_file_path, reporter=quiet_reporter("Restored"))
+    assert read_tree(restored) == read_tree(source_tree)
+
+
+def test_watch_mirrors_changes(tmp_path, source_tree):
+    target = str(tmp_path / "flat")
+    mapping_file_path = str(tmp_path / "mapping.jsonl")
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(SOLVAIRE_DIR, "script.py"),
+            "-s",
+            source_tree,
+            "-t",
+            target,
+            "-m",
+            mapping_file_path,
+            "--watch",
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        assert _wait_for(lambda: len(_mapping(mapping_file_path)) == 5)
+        renamed_name = _mapping(mapping_file_path)["readme.txt"]
+
+        write_tree(source_tree, {"Photos/2024/new.png": b"\x89PNG\r\n\x1a\n new"})
+        os.rename(os.path.join(source_tree, "readme.txt"), os.path.join(source_tree, "README.txt"))
+        os.remove(os.path.join(source_tree, "Contracts", "notes.txt"))
+
+        expected = set(read_tree(source_tree))
+        assert _wait_for(lambda: set(_mapping(mapping_file_path)) == expected)
+        mapping = _mapping(mapping_file_path)
+        # A renamed file keeps its flattened name
+        assert mapping["README.txt"] == renamed_name
+        assert _wait_for(lambda: sorted(os.listdir(target)) == sorted(mapping.values()))
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait(timeout=15)
+
+    restored = str(tmp_path / "restored")
+    unflatten_directory(target, restored, mapping_file_path, reporter=quiet_reporter("Restored"))
+    assert read_tree(restored) == read_tree(source_tree)